@@ -25,13 +25,17 @@ app = application
 # Import Configurations from config.py
 # Depends on the environment (e.g. production, dev, testing...)
 #export APPLICATION_SETTINGS='config.DevelopmentConfig' to set config
-#app.config.from_object(os.environ['APPLICATION_SETTINGS'])
-app.config.from_object('config.DevelopmentConfig')
+app.config.from_object(os.environ.get('APPLICATION_SETTINGS', 'config.DevelopmentConfig'))
 #app_settings = "app.server.config.DevelopmentConfig"
 
+# Engine options for the database backend (WAL for SQLite, pool sizes for server databases)
+from app.server.database import configure_database, report_database_settings, RoutingSQLAlchemy
+configure_database(app)
+
 # Define the database object which is imported
 # by modules and views
-db = SQLAlchemy(app)
+# read-only views use the read replica when one is configured
+db = RoutingSQLAlchemy(app)
 cache = Cache(app)
 mail = Mail(app)
 
@@ -44,6 +48,23 @@ from app.server.models import Users, Team, Roles, GameSession
 app.register_blueprint(main)
 app.register_blueprint(auth)
 
+# Throttle /solve and /login (RATE_LIMITS), before anything loads the user
+from app.server.rate_limit import init_rate_limiting
+init_rate_limiting(app)
+
+# Opt-in group commit of solves (SOLVE_GROUP_COMMIT)
+from app.server.solve_writer import init_solve_writer
+init_solve_writer(app)
+
+# Opt-in request profiling (PROFILE_REQUESTS)
+from app.server.profiling import init_profiling
+init_profiling(app)
+
+# Register command line tools
+from app.server.cli import build_dataset, migrate_report_times_command
+app.cli.add_command(build_dataset)
+app.cli.add_command(migrate_report_times_command)
+
 
 # login manager to be used for authentication
 login_manager = LoginManager()
@@ -53,6 +74,16 @@ login_manager.login_view = 'auth.login'
 # Build the database:
 # This will create the database file using SQLAlchemy
 db.create_all()
+# and add columns and indexes introduced since the tables were created
+from app.server.utils import add_missing_columns, create_missing_indexes, migrate_legacy_mitigations
+add_missing_columns()
+# report times stored as text by older releases are converted by `flask migrate-report-times`
+create_missing_indexes()
+# deny lists used to be a JSON blob on the team
+migrate_legacy_mitigations()
+report_database_settings(db.engine)
+if "replica" in (app.config.get("SQLALCHEMY_BINDS") or {}):
+    report_database_settings(db.get_engine(app, bind="replica"))
 
 
 # HTTP error handling
@@ -119,7 +150,8 @@ def before_first_request():
     current_session = db.session.query(GameSession).get(1)
     if not GameSession.query.all():
         try:
-            current_session = GameSession(state=True, start_time=datetime.now())
+            current_session = GameSession(state=True, start_time=datetime.now(),
+                                          seed=app.config.get("GAME_SEED"))
             db.session.add(current_session)
             db.session.commit()
             print("Created a new game session!")
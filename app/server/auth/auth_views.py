@@ -16,6 +16,8 @@ from app.server.auth.forms import EmailForm, PasswordForm
 from app.server.utils import *
 from flask import current_app
 from app.server.security import ts
+from app.server.rate_limit import rate_limited
+from app.server.passwords import HashingBusy
 from flask_mail import Message
 from app import mail
 
@@ -25,6 +27,9 @@ auth = Blueprint('auth', __name__)
 
 
 @auth.route('/login', methods=['GET', 'POST'])
+@rate_limited("login", methods=("POST",), field="username")
+@rate_limited("login_ip", methods=("POST",))
+@rate_limited("login_user", methods=("POST",), field="username", per_ip=False)
 def login():
     if request.method == 'GET':
         return render_template('auth/login.html')
@@ -35,8 +40,17 @@ def login():
     if 'remember_me' in request.form:
         remember_me = True
     registered_user = Users.query.filter_by(username=username).first()
+    try:
+        valid = (registered_user is not None) and registered_user.check_password(password)
+        # upgrade hashes made with an older PASSWORD_HASH_METHOD while we have the password
+        if valid and registered_user.password_needs_rehash():
+            registered_user.set_password(password)
+            db.session.commit()
+    except HashingBusy:
+        flash('The server is busy, please try again in a moment', 'error')
+        return redirect(url_for('auth.login'))
     # if the username or password is invalid
-    if (registered_user is not None) and (registered_user.check_password(password)):
+    if valid:
         login_user(registered_user, remember=remember_me)
         flash('Logged in successfully', 'success')
         return redirect(request.args.get('next') or url_for('main.home'))
@@ -87,6 +101,8 @@ def register(username:str=None, password:str=None, email:str=None, team_id:int=N
             #html = render_template('email/basic.html',
             #                       username=username)
             #send_email("Welcome to the attendance app!", email, html)
+        except HashingBusy:
+            flash('The server is busy, please try again in a moment', 'error')
         except Exception as e:
             print(f"failed to create user {username}: {e}")
             flash("Oops, something went wrong in creating your account" , "error")
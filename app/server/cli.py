@@ -0,0 +1,48 @@
+"""
+Command line tools, run through the flask cli:
+
+    export FLASK_APP=app
+    flask build-dataset --days 30 --seed 42 --output datasets/kc7
+    flask migrate-report-times
+"""
+import click
+from flask.cli import with_appcontext
+
+
+@click.command("build-dataset")
+@click.option("--days", type=int, required=True, help="Days of game time to generate")
+@click.option("--seed", type=int, default=None, help="Game seed, defaults to the seed of the current game session")
+@click.option("--sink", type=click.Choice(["file", "console", "null"]), default="file", help="Where to send the logs")
+@click.option("--output", default="dataset", show_default=True, help="Output directory for the file sink")
+@click.option("--compress", is_flag=True, help="gzip the files written by the file sink")
+@click.option("--processes", type=int, default=1, show_default=True, help="Worker processes used for generation")
+@with_appcontext
+def build_dataset(days, seed, sink, output, compress, processes):
+    """
+    Generate a full game dataset offline, without the web server
+
+    Runs the game setup and then generates DAYS of activity as fast as possible.
+    Rows are streamed to the sink as the uploader queue fills, so memory stays flat
+    no matter how large the dataset gets.
+    The running game is left alone: no reports or scores are written to its database.
+    """
+    # the game modules are only needed by this command
+    from app.server.game_functions import start_game
+
+    sink_options = {"directory": output, "compress": compress} if sink == "file" else {}
+    start_game(max_days=days, seed=seed, processes=processes, sink=sink, sink_options=sink_options, offline=True)
+
+
+@click.command("migrate-report-times")
+@with_appcontext
+def migrate_report_times_command():
+    """
+    Convert the report times older releases stored as text to timestamps
+
+    Run once after upgrading a database created before report.time was a DateTime.
+    Times that can't be read are listed and left alone, running it again picks them
+    up once they are fixed.
+    """
+    from app.server.utils import migrate_report_times
+
+    click.echo(f"Converted {migrate_report_times()} reports")
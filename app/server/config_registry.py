@@ -0,0 +1,137 @@
+"""
+Cached, validated loading of the YAML game configs (actors and malware)
+
+Every config file is parsed and validated once. The result is cached by path
+together with the file's mtime and a hash of its content, so restarting the game
+only re-parses the files that changed. All files are validated before any of them
+is used and every problem is reported at once, so a bad config stops the game
+before it starts generating data instead of crashing it halfway through.
+"""
+import copy
+import glob
+import hashlib
+import inspect
+import os
+
+
+class ConfigError(Exception):
+    """
+    Raised when one or more config files are invalid
+    errors maps each bad file to the list of problems found in it
+    """
+
+    def __init__(self, errors: "dict[str, list[str]]"):
+        self.errors = errors
+        lines = [f"{path}: {problem}" for path, problems in errors.items() for problem in problems]
+        super().__init__("Invalid game config(s):\n" + "\n".join(lines))
+
+
+class ConfigRegistry():
+    """
+    The configs of one directory
+
+    load(path) turns a file into the object the game uses
+    validate(obj) returns a list of problems with it (empty when it is valid)
+    """
+
+    def __init__(self, directory: str, load, validate, pattern: str = "*.yaml"):
+        self.directory = directory
+        self.pattern = pattern
+        self.load = load
+        self.validate = validate
+        # path -> (mtime_ns, sha1 of the content, loaded object)
+        self._cache = {}
+
+    def _get(self, path: str, errors: dict):
+        mtime = os.stat(path).st_mtime_ns
+        cached = self._cache.get(path)
+        if cached and cached[0] == mtime:
+            return cached[2]
+
+        with open(path, "rb") as f:
+            digest = hashlib.sha1(f.read()).hexdigest()
+        if cached and cached[1] == digest:
+            # touched but not changed
+            self._cache[path] = (mtime, digest, cached[2])
+            return cached[2]
+
+        try:
+            obj = self.load(path)
+        except Exception as e:
+            errors[path] = [f"could not be parsed: {e}"]
+            return None
+        problems = self.validate(obj)
+        if problems:
+            errors[path] = problems
+            return None
+
+        self._cache[path] = (mtime, digest, obj)
+        return obj
+
+    def load_all(self) -> list:
+        """
+        Return a fresh copy of every config in the directory, in file name order
+        Raises ConfigError if any of them is invalid
+        """
+        paths = sorted(glob.glob(os.path.join(self.directory, self.pattern)))
+        # forget files that were removed
+        for path in set(self._cache) - set(paths):
+            del self._cache[path]
+
+        errors = {}
+        objs = [self._get(path, errors) for path in paths]
+        if errors:
+            raise ConfigError(errors)
+        # callers are free to modify what they get back
+        return [copy.deepcopy(obj) for obj in objs if obj]
+
+
+def validate_actor_config(config, actor_class) -> "list[str]":
+    """
+    Check an actor config against the arguments of the actor class
+    Empty configs are allowed, they are skipped when actors are created
+    """
+    if not config:
+        return []
+    if not isinstance(config, dict):
+        return [f"expected a mapping of actor attributes, got {type(config).__name__}"]
+
+    problems = []
+    parameters = inspect.signature(actor_class.__init__).parameters
+    accepts_any = any(p.kind == p.VAR_KEYWORD for p in parameters.values())
+    for key in config:
+        if key not in parameters and not accepts_any:
+            problems.append(f"unknown actor attribute '{key}'")
+    for name, parameter in parameters.items():
+        if name == "self" or parameter.kind in (parameter.VAR_POSITIONAL, parameter.VAR_KEYWORD):
+            continue
+        if parameter.default is parameter.empty and name not in config:
+            problems.append(f"missing required actor attribute '{name}'")
+
+    name = config.get("name")
+    if not isinstance(name, str) or not name.strip():
+        problems.append("'name' must be a non-empty string")
+    elif name == "Default":
+        problems.append("the name 'Default' is reserved for the noise actor")
+    for key, value in config.items():
+        if key.startswith("count_") and (not isinstance(value, int) or isinstance(value, bool) or value < 0):
+            problems.append(f"'{key}' must be a non-negative integer")
+    effectiveness = config.get("effectiveness")
+    if effectiveness is not None and not (isinstance(effectiveness, (int, float)) and 0 <= effectiveness <= 100):
+        problems.append("'effectiveness' must be a number between 0 and 100")
+    return problems
+
+
+def validate_malware(malware) -> "list[str]":
+    """
+    Check a malware object loaded from its config
+    """
+    if malware is None:
+        return ["the config is empty"]
+    problems = []
+    name = getattr(malware, "name", None)
+    if not isinstance(name, str) or not name.strip():
+        problems.append("'name' must be a non-empty string")
+    if not isinstance(getattr(malware, "hashes", None), list):
+        problems.append("'hashes' must be a list")
+    return problems
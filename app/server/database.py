@@ -0,0 +1,202 @@
+"""
+Database backend settings
+
+SQLite
+    Connections run in WAL mode (SQLITE_WAL, default on) so readers don't block the
+    writer, and wait SQLITE_BUSY_TIMEOUT milliseconds (default 5000) for the write lock
+    instead of failing with "database is locked".
+    SQLITE_SYNCHRONOUS (default FULL) is the synchronous setting in WAL mode. NORMAL
+    saves an fsync per commit, but the last commits before a power loss or OS crash
+    can be lost (the database itself stays consistent).
+Server databases (PostgreSQL, MySQL, ...)
+    The connection pool is sized with DB_POOL_SIZE (default 10) and DB_MAX_OVERFLOW
+    (default 20). Connections are checked before use with DB_POOL_PRE_PING (default on)
+    and recycled after DB_POOL_RECYCLE seconds (default 1800).
+
+The database URI can be given in the DATABASE_URL environment variable.
+Anything set in SQLALCHEMY_ENGINE_OPTIONS takes precedence over these settings.
+
+Read replica
+    When SQLALCHEMY_BINDS has a "replica" entry, the queries of read-only views
+    (see read_only) and of replica_reads blocks go to the replica, everything else
+    and every write goes to the primary. A user who just wrote something reads from
+    the primary for REPLICA_READ_YOUR_WRITES_SECONDS (default 10) so they see their
+    own changes while the replica catches up.
+"""
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from flask import g, session, has_app_context, has_request_context
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy import event, orm
+from sqlalchemy.engine import Engine, make_url
+
+
+# pragmas run on every new SQLite connection, set by configure_database
+SQLITE_PRAGMAS = {}
+
+# values accepted for SQLITE_SYNCHRONOUS
+SQLITE_SYNCHRONOUS_MODES = ("FULL", "NORMAL")
+
+
+@event.listens_for(Engine, "connect")
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    for pragma, value in SQLITE_PRAGMAS.items():
+        cursor.execute(f"PRAGMA {pragma}={value}")
+    cursor.close()
+
+
+def is_sqlite(uri: str) -> bool:
+    return make_url(uri).get_backend_name() == "sqlite"
+
+
+def configure_database(app) -> None:
+    """
+    Fill in the engine options for the configured backend
+    Must run before the SQLAlchemy extension creates its engine
+    """
+    if os.environ.get("DATABASE_URL"):
+        app.config["SQLALCHEMY_DATABASE_URI"] = os.environ["DATABASE_URL"]
+    uri = app.config.get("SQLALCHEMY_DATABASE_URI", "sqlite://")
+
+    options = {}
+    if is_sqlite(uri):
+        SQLITE_PRAGMAS.clear()
+        SQLITE_PRAGMAS["busy_timeout"] = int(app.config.get("SQLITE_BUSY_TIMEOUT", 5000))
+        # an in-memory database has no journal file to switch to WAL
+        if app.config.get("SQLITE_WAL", True) and make_url(uri).database not in (None, "", ":memory:"):
+            SQLITE_PRAGMAS["journal_mode"] = "WAL"
+            # NORMAL is opt-in: it keeps the database consistent but not the last commits durable
+            synchronous = str(app.config.get("SQLITE_SYNCHRONOUS", "FULL")).upper()
+            if synchronous not in SQLITE_SYNCHRONOUS_MODES:
+                raise ValueError(f"SQLITE_SYNCHRONOUS must be one of {', '.join(SQLITE_SYNCHRONOUS_MODES)}")
+            SQLITE_PRAGMAS["synchronous"] = synchronous
+    else:
+        options = {
+            "pool_size": app.config.get("DB_POOL_SIZE", 10),
+            "max_overflow": app.config.get("DB_MAX_OVERFLOW", 20),
+            "pool_pre_ping": app.config.get("DB_POOL_PRE_PING", True),
+            "pool_recycle": app.config.get("DB_POOL_RECYCLE", 1800),
+        }
+    options.update(app.config.get("SQLALCHEMY_ENGINE_OPTIONS") or {})
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = options
+
+
+def report_database_settings(engine) -> dict:
+    """
+    Print and return the settings the database is actually running with
+    """
+    settings = {
+        "backend": engine.url.get_backend_name(),
+        "database": engine.url.render_as_string(hide_password=True),
+        "pool": type(engine.pool).__name__,
+    }
+    if settings["backend"] == "sqlite":
+        with engine.connect() as connection:
+            for pragma in ("journal_mode", "busy_timeout", "synchronous"):
+                settings[pragma] = connection.exec_driver_sql(f"PRAGMA {pragma}").scalar()
+    else:
+        pool = engine.pool
+        settings["pool_size"] = pool.size() if hasattr(pool, "size") else None
+        settings["max_overflow"] = getattr(pool, "_max_overflow", None)
+        settings["pool_pre_ping"] = getattr(pool, "_pre_ping", None)
+        settings["pool_recycle"] = getattr(pool, "_recycle", None)
+
+    print("Database settings:")
+    for name, value in settings.items():
+        print(f"    {name:<16}{value}")
+    return settings
+
+
+# bind key of the read replica in SQLALCHEMY_BINDS
+REPLICA_BIND = "replica"
+
+
+def _replica_enabled(app) -> bool:
+    return REPLICA_BIND in (app.config.get("SQLALCHEMY_BINDS") or {})
+
+
+def _reads_from_replica(app) -> bool:
+    if not (has_app_context() and g.get("db_replica") and _replica_enabled(app)):
+        return False
+    # read your own writes from the primary
+    if has_request_context() and session.get("read_primary_until", 0) > time.time():
+        return False
+    return True
+
+
+class RoutingSession(SignallingSession):
+    """
+    Session that sends the reads of read-only code to the replica
+    Flushes, models with their own __bind_key__ and everything else use the primary
+    """
+
+    def __init__(self, db, **options):
+        self._db = db
+        super().__init__(db, **options)
+
+    def get_bind(self, mapper=None, clause=None):
+        if self._flushing:
+            if has_app_context():
+                g.db_wrote = True
+        elif _reads_from_replica(self.app):
+            info = getattr(mapper.persist_selectable, "info", {}) if mapper is not None else {}
+            if info.get("bind_key") is None:
+                return self._db.get_engine(self.app, bind=REPLICA_BIND)
+        return super().get_bind(mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    """
+    SQLAlchemy extension using the RoutingSession
+    """
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+    def init_app(self, app):
+        super().init_app(app)
+
+        @app.after_request
+        def remember_writes(response):
+            if g.get("db_wrote") and _replica_enabled(app):
+                session["read_primary_until"] = time.time() + app.config.get("REPLICA_READ_YOUR_WRITES_SECONDS", 10)
+            return response
+
+
+def mark_written() -> None:
+    """
+    Record a write the session didn't flush itself (e.g. made by another thread),
+    so the user keeps reading from the primary for a while
+    """
+    g.db_wrote = True
+
+
+@contextmanager
+def replica_reads():
+    """
+    Send the reads of the enclosed block to the replica, if there is one
+    """
+    previous = g.get("db_replica", False)
+    g.db_replica = True
+    try:
+        yield
+    finally:
+        g.db_replica = previous
+
+
+def read_only(f):
+    """
+    Decorator for views that only read, their queries go to the replica if there is one
+    """
+    @wraps(f)
+    def wrap(*args, **kw):
+        with replica_reads():
+            return f(*args, **kw)
+    return wrap
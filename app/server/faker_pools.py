@@ -0,0 +1,134 @@
+"""
+Pools of pre-generated Faker values
+
+Faker providers are among the slowest calls made while generating game data.
+A FakerPool calls each provider a fixed number of times and generators then sample
+from those values. Pools are built from their own seeded Faker instance so they are
+reproducible and don't disturb the shared Faker generator.
+Only distinct values are kept, as a numpy array of strings.
+
+With generations > 1 every provider has that many pools, each built from its own seed,
+so long games don't keep reusing the same values. Each draw picks its generation with
+the caller's generator, which is seeded per chunk of work: the values a chunk gets
+only depend on its seed, not on which process ran it or what ran before.
+
+The per-event generators call the shared Faker instances of models.py and utils.py.
+Those are PooledFakers: a pooled provider called without arguments draws one value
+from get_pool() with Faker's own random generator, so seed_generation still makes
+the draws repeatable. Every other call goes to Faker.
+"""
+import numpy as np
+from faker import Faker
+
+
+# pool name -> Faker provider method
+PROVIDERS = {
+    "domain": "domain_name",
+    "uri_path": "uri_path",
+    "file_name": "file_name",
+    "sentence": "sentence",
+    "ipv4": "ipv4_public",
+    "user_agent": "user_agent",
+}
+
+
+class FakerPool():
+    """
+    Sample Faker values from pools generated up front
+
+    size is the number of provider calls per pool
+    generations is the number of pools per provider, the first is built right away and
+    the others the first time a draw picks them
+    """
+
+    def __init__(self, size: int = 10000, seed: int = None, generations: int = 1,
+                 providers: dict = None):
+        self.size = size
+        self.seed = seed
+        self.generations = max(generations or 1, 1)
+        self.providers = providers or PROVIDERS
+        # (name, generation) -> values
+        self.pools = {}
+        for name in self.providers:
+            self.get(name, 0)
+
+    def _generation_seed(self, generation: int) -> int:
+        # utils builds a PooledFaker, it can't be imported before this module
+        from app.server.utils import derive_seed
+
+        # the first generation keeps the game's pool seed
+        if self.seed is None or generation == 0:
+            return self.seed
+        return derive_seed(self.seed, "generation", generation)
+
+    def get(self, name: str, generation: int = 0) -> np.ndarray:
+        """
+        The values of one pool, built on first use
+        """
+        key = (name, generation)
+        if key not in self.pools:
+            faker = Faker()
+            faker.seed_instance(self._generation_seed(generation))
+            generate = getattr(faker, self.providers[name])
+            self.pools[key] = np.array(sorted({generate() for _ in range(self.size)}), dtype=object)
+        return self.pools[key]
+
+    def sample_many(self, name: str, n: int, rng: np.random.Generator) -> np.ndarray:
+        """
+        Draw n values (with replacement) at once from a generation picked with rng
+        """
+        generation = int(rng.integers(0, self.generations)) if self.generations > 1 else 0
+        pool = self.get(name, generation)
+        return pool[rng.integers(0, len(pool), size=n)]
+
+    def draw(self, name: str, rng) -> str:
+        """
+        Draw a single value, with a random.Random generator picking the generation and the value
+        """
+        generation = rng.randrange(self.generations) if self.generations > 1 else 0
+        pool = self.get(name, generation)
+        return pool[rng.randrange(len(pool))]
+
+
+class PooledFaker():
+    """
+    Wraps a Faker instance, its pooled providers draw from get_pool() when called without arguments
+    Arguments (e.g. sentence(nb_words=3)) and any other attribute go to the Faker instance
+    """
+
+    def __init__(self, faker: Faker):
+        self.faker = faker
+        for name, provider in PROVIDERS.items():
+            setattr(self, provider, self._pooled(name, getattr(faker, provider)))
+
+    def _pooled(self, name: str, generate):
+        def draw(*args, **kwargs):
+            if args or kwargs:
+                return generate(*args, **kwargs)
+            return get_pool().draw(name, self.faker.random)
+        return draw
+
+    def __getattr__(self, attr: str):
+        return getattr(self.faker, attr)
+
+
+# The pool shared by the generators of this process, see init_pools
+POOL = None
+
+
+def init_pools(seed: int = None, size: int = 10000, generations: int = 1) -> FakerPool:
+    """
+    Build the pools for this process, called at game start
+    """
+    global POOL
+    POOL = FakerPool(size=size, seed=seed, generations=generations)
+    return POOL
+
+
+def get_pool() -> FakerPool:
+    """
+    Return the pools of this process, building unseeded pools if the game didn't
+    """
+    if POOL is None:
+        init_pools()
+    return POOL
@@ -0,0 +1,152 @@
+"""
+Simulated clock and scheduler for the game loop
+
+Game time starts at GameSession.seed_date and runs time_multiplier times
+faster than real time from GameSession.start_time.
+The scheduler cuts game time into ticks and tells the game loop how many
+events each actor may generate in a tick.
+"""
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+from app.server.models import db, GameSession
+
+
+# One step of the game loop
+# start and end are the simulated time window covered by the tick
+Tick = namedtuple("Tick", ["index", "start", "end"])
+
+
+def parse_game_time(value) -> datetime:
+    """
+    GameSession stores times as strings
+    Accept a timestamp float, an ISO date or a str(datetime)
+    """
+    if isinstance(value, datetime):
+        return value
+    try:
+        return datetime.fromtimestamp(float(value))
+    except (TypeError, ValueError):
+        return datetime.fromisoformat(str(value))
+
+
+class GameClock():
+    """
+    Maps real time to simulated game time
+    """
+
+    def __init__(self, seed_date, start_time, time_multiplier: int = 1000):
+        self.seed_date = parse_game_time(seed_date)
+        self.start_time = parse_game_time(start_time)
+        self.time_multiplier = time_multiplier or 1
+
+    def to_game_time(self, real_time: datetime) -> datetime:
+        return self.seed_date + (real_time - self.start_time) * self.time_multiplier
+
+    def now(self) -> datetime:
+        return self.to_game_time(datetime.now())
+
+
+class GameScheduler():
+    """
+    Drives the game loop one tick at a time
+
+    Live mode (max_days=None): a tick lasts at least tick_seconds of real time
+    and covers the game time that passed since the previous tick. The scheduler
+    sleeps between ticks so the loop never runs faster than the game clock.
+
+    Batch mode (max_days=N): ticks run back to back without sleeping until
+    N days of game time have been generated, then the scheduler stops.
+
+    In both modes the game stops as soon as GameSession.state is cleared.
+    The flag is re-read from the database at most every poll_seconds.
+    Offline builds pass follow_session=False, they run until max_days whatever the flag says.
+    """
+
+    def __init__(self, session: GameSession, events_per_second: dict, tick_seconds: float = 1.0,
+                 max_days: int = None, poll_seconds: float = 5.0, follow_session: bool = True):
+        self.session_id = session.id
+        self.clock = GameClock(session.seed_date, session.start_time, session.time_multiplier)
+        # events per second of real time for each actor, keyed by actor name
+        # "*" is used for actors that are not listed
+        self.events_per_second = events_per_second
+        self.tick_seconds = tick_seconds
+        self.max_days = max_days
+        self.poll_seconds = poll_seconds
+        self.follow_session = follow_session
+        self._last_poll = 0.0
+        self._running = True
+
+    def budget_for(self, actor, tick: Tick) -> float:
+        """
+        How many events the actor should generate for the tick
+        The budget is per second of real time, i.e. game time / time_multiplier
+        """
+        rate = self.events_per_second.get(actor.name, self.events_per_second.get("*", 0))
+        return rate * (tick.end - tick.start).total_seconds() / self.clock.time_multiplier
+
+    def is_running(self) -> bool:
+        """
+        Check the stop flag, only going to the database every poll_seconds
+        """
+        now = time.monotonic()
+        if self.follow_session and self._running and now - self._last_poll >= self.poll_seconds:
+            self._last_poll = now
+            # read just the flag, the session object in the identity map may be stale
+            self._running = bool(
+                db.session.query(GameSession.state).filter(GameSession.id == self.session_id).scalar()
+            )
+            db.session.commit()
+        return self._running
+
+    def stop(self) -> None:
+        self._running = False
+
+    @property
+    def step(self) -> timedelta:
+        """
+        Game time covered by a batch mode tick
+        """
+        return timedelta(seconds=self.tick_seconds * self.clock.time_multiplier)
+
+    def first_window(self) -> tuple:
+        """
+        The (start, end) game time of the first tick in batch mode, None in live mode
+        The live game follows the clock, there is no window to hold events to
+        """
+        if self.max_days is None:
+            return None
+        start = self.clock.seed_date
+        return start, min(start + self.step, start + timedelta(days=self.max_days))
+
+    def ticks(self):
+        """
+        Yield ticks until the game is stopped or max_days of game time have been generated
+        """
+        step = self.step
+        live = self.max_days is None
+        if live:
+            start = self.clock.now()
+        else:
+            start = self.clock.seed_date
+            end_of_game = start + timedelta(days=self.max_days)
+
+        index = 0
+        tick_started = time.monotonic()
+        while self.is_running():
+            if live:
+                # hold the loop to real time, don't wait at all if the last tick ran long
+                delay = self.tick_seconds - (time.monotonic() - tick_started)
+                if delay > 0:
+                    time.sleep(delay)
+                tick_started = time.monotonic()
+                end = self.clock.now()
+            else:
+                if start >= end_of_game:
+                    break
+                end = min(start + step, end_of_game)
+
+            yield Tick(index=index, start=start, end=end)
+            index += 1
+            start = end
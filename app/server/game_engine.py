@@ -0,0 +1,188 @@
+"""
+Spread the generation of game activity over a pool of worker processes
+
+The actors of a cycle are split into one work unit per process, balanced on their event budgets.
+A worker runs every generator of each of its actors in the order generate_activity would,
+with the seed generate_activity would get for that actor and cycle, so every actor produces
+the same rows as in a single process. Only the interleaving differs: each worker has its own
+LogUploader (and its own part files with the file sink), and database ids of the records the
+generators create (e.g. passive DNS) follow the order in which the workers commit.
+A worker flushes its uploader and commits once per unit, i.e. once per cycle.
+SQLite serializes those commits, workers wait on its busy timeout.
+"""
+import os
+import random
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+from app import app, db
+from app.server.utils import derive_seed
+from app.server.registries import Registry
+from app.server.metrics import METRICS
+
+
+# The activity of some actors for one cycle
+# actors holds an (actor id, counts, seed) tuple per actor
+WorkUnit = namedtuple("WorkUnit", ["actors", "time_window"])
+
+# Employees are loaded once per worker process, see _run_work_unit
+WORKER_EMPLOYEES = None
+
+
+def split_actors(actor_ids: "list[int]", budgets: dict = None, parts: int = 1) -> "list[list[int]]":
+    """
+    Split actors into at most parts groups with about the same total budget
+    The largest budgets are placed first, each in the lightest group; actors without
+    a budget count as 1. Groups keep the order of actor_ids and empty groups are dropped
+    """
+    budgets = budgets or {}
+    groups = [[] for _ in range(max(1, min(parts, len(actor_ids))))]
+    loads = [0.0] * len(groups)
+    for actor_id in sorted(actor_ids, key=lambda actor_id: -(budgets.get(actor_id) or 1)):
+        lightest = loads.index(min(loads))
+        groups[lightest].append(actor_id)
+        loads[lightest] += budgets.get(actor_id) or 1
+    order = {actor_id: i for i, actor_id in enumerate(actor_ids)}
+    return [sorted(group, key=order.get) for group in groups if group]
+
+
+def _init_worker(queue_limit: int, seed: int, sink: str = None, sink_options: dict = None,
+                 create_reports: bool = True) -> None:
+    """
+    Prepare a worker process to run work units
+    """
+    from app.server import game_functions
+    from app.server import reports
+    from app.server.log_sinks import make_sink
+    from app.server import faker_pools
+
+    # database connections inherited from the parent process must not be reused
+    db.engine.dispose()
+    app.app_context().push()
+    reports.CREATE_REPORTS = create_reports
+
+    # forked workers inherit the pools of the game, others rebuild the same pools
+    if faker_pools.POOL is None:
+        faker_pools.init_pools(seed=derive_seed(seed, "faker_pools"),
+                               size=app.config.get("FAKER_POOL_SIZE", 10000),
+                               generations=app.config.get("FAKER_POOL_GENERATIONS", 1))
+
+    # each worker gets its own upload buffer
+    if sink:
+        sink_options = dict(sink_options or {})
+        if sink == "file":
+            # workers must not append to the same files
+            sink_options["part"] = os.getpid()
+        game_functions.LOG_UPLOADER = game_functions.LogUploader(queue_limit=queue_limit,
+                                                                 sink=make_sink(sink, **sink_options))
+    else:
+        game_functions.LOG_UPLOADER = game_functions.LogUploader(queue_limit=queue_limit)
+    if getattr(game_functions, "MALWARE_OBJECTS", None) is None:
+        game_functions.MALWARE_OBJECTS = game_functions.create_malware()
+
+
+def _run_work_unit(unit: WorkUnit) -> "tuple[dict, dict, float]":
+    """
+    Run one cycle of activity for the actors of a unit inside a worker process
+    Returns the number of rows produced per table, the (rows, seconds) of each generator
+    and how long the unit took
+    """
+    from app.server import game_functions
+
+    global WORKER_EMPLOYEES
+    if WORKER_EMPLOYEES is None:
+        WORKER_EMPLOYEES = Registry.from_model(game_functions.Employee)
+
+    uploader = game_functions.LOG_UPLOADER
+    rows_before = dict(uploader.row_counts)
+    generators = {}
+    started = time.perf_counter()
+
+    for actor_id, counts, seed in unit.actors:
+        actor = db.session.query(game_functions.Actor).get(actor_id)
+        for generator in game_functions.get_activity_generators(actor):
+            generator_rows = sum(uploader.row_counts.values())
+            generator_started = time.perf_counter()
+            # a generator produces the same rows alone as in the full cycle
+            game_functions.generate_activity(actor, WORKER_EMPLOYEES, generators=[generator], seed=seed,
+                                             time_window=unit.time_window, **counts)
+            rows, seconds = generators.get(generator, (0, 0.0))
+            generators[generator] = (rows + sum(uploader.row_counts.values()) - generator_rows,
+                                     seconds + time.perf_counter() - generator_started)
+
+    # one ingestion per table and one commit for the whole unit
+    uploader.flush_queue()
+    # persist anything the generators created (e.g. passive DNS records)
+    db.session.commit()
+
+    rows = {table_name: count - rows_before.get(table_name, 0)
+            for table_name, count in uploader.row_counts.items()
+            if count != rows_before.get(table_name, 0)}
+    return rows, generators, time.perf_counter() - started
+
+
+class GenerationEngine():
+    """
+    Runs cycles of game activity on a pool of worker processes
+    """
+
+    def __init__(self, processes: int = None, seed: int = None, queue_limit: int = 10000,
+                 sink: str = None, sink_options: dict = None, create_reports: bool = True):
+        self.processes = processes or os.cpu_count()
+        # the game seed should be passed in, a random seed is only kept so the run can be reproduced
+        self.seed = seed if seed is not None else random.randrange(2**63)
+        self.pool = ProcessPoolExecutor(
+            max_workers=self.processes,
+            initializer=_init_worker,
+            # sinks are passed by name, each worker creates its own
+            initargs=(queue_limit, self.seed, sink, sink_options, create_reports)
+        )
+        print(f"Generation engine running {self.processes} processes with seed {self.seed}")
+
+    def partition(self, actors: list, cycle: int = 0, budgets: dict = None,
+                  time_window: tuple = None) -> "list[WorkUnit]":
+        """
+        Split one cycle of activity for the given actors into a work unit per process
+        budgets optionally maps actor ids to the number of events the actor should generate
+        time_window is the (start, end) game time covered by the cycle
+        """
+        from app.server.game_functions import get_activity_counts
+
+        by_id = {actor.id: actor for actor in actors}
+        units = []
+        for actor_ids in split_actors(list(by_id), budgets, self.processes):
+            unit_actors = []
+            for actor_id in actor_ids:
+                rng = random.Random(derive_seed(self.seed, cycle, actor_id))
+                counts = get_activity_counts(by_id[actor_id], rng, budget=(budgets or {}).get(actor_id))
+                unit_actors.append((actor_id, counts, derive_seed(self.seed, cycle, actor_id)))
+            units.append(WorkUnit(actors=unit_actors, time_window=time_window))
+        return units
+
+    def run_cycle(self, actors: list, cycle: int = 0, budgets: dict = None,
+                  time_window: tuple = None) -> "dict[str, int]":
+        """
+        Generate one cycle of activity for all actors
+        Returns the number of rows produced for each table
+        """
+        started = time.perf_counter()
+        rows = {}
+        for unit_rows, generators, unit_seconds in self.pool.map(
+                _run_work_unit, self.partition(actors, cycle, budgets, time_window)):
+            for table_name, count in unit_rows.items():
+                rows[table_name] = rows.get(table_name, 0) + count
+            # the workers' own metrics stay in their process, record what they report here
+            for generator, (generator_rows, seconds) in generators.items():
+                METRICS.observe("generator_seconds", seconds, generator=generator)
+                METRICS.increment("generator_runs", generator=generator)
+                METRICS.increment("generator_rows", generator_rows, generator=generator)
+            METRICS.observe("engine_unit_seconds", unit_seconds)
+
+        elapsed = time.perf_counter() - started
+        total = sum(rows.values())
+        print(f"cycle {cycle}: generated {total} rows in {elapsed:.2f}s ({total / elapsed:.0f} rows/s)")
+        return rows
+
+    def shutdown(self) -> None:
+        self.pool.shutdown()
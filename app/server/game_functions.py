@@ -10,7 +10,7 @@ from  sqlalchemy.sql.expression import func, select
 from app.server.models import db, GameSession
 from app.server.modules.organization.Company import Company, Employee
 from app.server.modules.infrastructure.DNSRecord import DNSRecord
-from app.server.modules.logging.uploadLogs import LogUploader
+from app.server.uploadLogs import LogUploader
 from app.server.modules.email.email_controller import gen_email
 from app.server.modules.outbound_browsing.browsing_controller import *
 from app.server.modules.infrastructure.passiveDNS_controller import *
@@ -25,72 +25,209 @@ from app.server.modules.helpers.config_helper import load_malware_obj_from_yaml_
 
 from app.server.utils import *
 from app.server.modules.file.vt_seed_files import FILES_MALICIOUS_VT_SEED_HASHES
+from app.server.game_engine import GenerationEngine
+from app.server.game_clock import GameScheduler
+from app.server.log_sinks import make_sink
+from app.server.registries import Registry
+from app.server.faker_pools import init_pools
+from app.server.config_registry import ConfigRegistry, validate_actor_config, validate_malware
+from app.server.metrics import METRICS, game_metrics_path
+from app.server.noise import synthesize_outbound_browsing, synthesize_inbound_browsing, synthesize_auth_events, \
+    company_domains, OUTBOUND_BROWSING_TABLE, INBOUND_BROWSING_TABLE, AUTHENTICATION_TABLE
+from app.server.scoring import get_scorer
+from app.server import reports
+from app.server.malware_hashes import index_malware_hashes
+import numpy as np
+import pandas as pd
+from time import perf_counter
 
-def start_game() -> None:
+# Actor and malware configs are parsed and validated once and cached between games
+ACTOR_CONFIGS = ConfigRegistry(
+    "app/game_configs/actors",
+    load=read_config_from_yaml,
+    validate=lambda config: validate_actor_config(config, Actor)
+)
+MALWARE_CONFIGS = ConfigRegistry(
+    "app/game_configs/malware",
+    load=load_malware_obj_from_yaml_by_file,
+    validate=validate_malware
+)
+
+
+def start_game(max_days: int = None, seed: int = None, processes: int = None,
+               sink: str = None, sink_options: dict = None, offline: bool = False) -> None:
     """
     This function call starts the game
 
     1. Get the game session
     2. Generate starter data
-    3. Run infinite loop to generate additional activity
+    3. Run the game loop to generate additional activity
+
+    The loop runs until the game is stopped
+    Pass max_days to generate that many days of game time as fast as possible and then stop
+    Pass the name of a sink (see log_sinks.py) to send logs somewhere other than ADX
+    Pass offline=True to build a dataset without touching the running game: the session
+    isn't started or stopped, no reports are created and team scores are left alone
     """
     print("Starting the game...")
 
     # instantiate a logUploader. This instance is used by all other modules to send logs to azure
     # we use a singular instances in order to queue up muliple rows of logs and send them all at once
     global LOG_UPLOADER
-    LOG_UPLOADER = LogUploader(queue_limit=10000)
-    LOG_UPLOADER.create_tables(reset=True)
+    if sink:
+        LOG_UPLOADER = LogUploader(queue_limit=10000, sink=make_sink(sink, **(sink_options or {})))
+    else:
+        LOG_UPLOADER = LogUploader(queue_limit=10000)
+        LOG_UPLOADER.create_tables(reset=True)
+    METRICS.register_gauge("uploader_queue_rows", LOG_UPLOADER.get_queue_length)
 
+    # fail before generating anything if a config is broken
+    ACTOR_CONFIGS.load_all()
+
+    # create_malware also sets malware_hashes.FILE_HASH_MALWARE_MAPPING, the 1-1 mapping of hashes <-> malware types
     global MALWARE_OBJECTS
     MALWARE_OBJECTS = create_malware()
 
-    # instantiate a global mapping of hashes to malware families. 
-    # this is updated to make sure we and a 1-1 mapping of hashes <-> malware types
-    # global FILE_HASH_MALWARE_MAPPING 
-    # FILE_HASH_MALWARE_MAPPING = {}
-    # assign_hash_to_malware()
-
     # The the current game session
     # This data object tracks whether or not the game is currently running
     # It allows us to start/stop/restart the game from the views
-    current_session = db.session.query(GameSession).get(1)
-    current_session.state = True
+    current_session = get_game_session(seed=seed)
+    reports.CREATE_REPORTS = not offline
+    if not offline:
+        current_session.state = True
+        if seed is not None:
+            current_session.seed = seed
 
-    # instantiate the clock
-    print(f"Game started at {current_session.start_time}")
+        # instantiate the clock
+        print(f"Game started at {current_session.start_time}")
 
-    # TODO: allow users ot modify start time in the web UI
-    db.session.commit()
+        # TODO: allow users ot modify start time in the web UI
+        db.session.commit()
     
+    # every piece of generated data derives from the game seed
+    seed = seed if seed is not None else current_session.seed
+    print(f"Game seed is {seed}")
+
+    # pre-generate the Faker values sampled by the generators
+    init_pools(seed=derive_seed(seed, "faker_pools"),
+               size=current_app.config.get("FAKER_POOL_SIZE", 10000),
+               generations=current_app.config.get("FAKER_POOL_GENERATIONS", 1))
+
+    # The scheduler advances the game clock and hands out an event budget to each actor
+    scheduler = GameScheduler(
+        current_session,
+        events_per_second=current_app.config.get("GAME_EVENTS_PER_SECOND", {"Default": 500, "*": 2}),
+        tick_seconds=current_app.config.get("GAME_TICK_SECONDS", 1.0),
+        max_days=max_days,
+        follow_session=not offline
+    )
+
     # run startup functions 
-    employees = Employee.query.all()
-    actors = Actor.query.all()
+    # the generators pick employees from a read-only snapshot rather than ORM objects
+    employees = Registry.from_model(Employee)
+    actors = Actor.query.order_by(Actor.id).all()
     if not (employees or actors):
-        employees, actors  = init_setup()
+        # a dataset starts with the setup activity, timed in its first tick
+        employees, actors  = init_setup(seed=seed, time_window=scheduler.first_window())
     
     print("initialization complete...")
 
+    # Spread generation over several processes when configured to
+    processes = processes or current_app.config.get("GAME_GENERATION_PROCESSES", 1)
+    engine = None
+    # the workers load what they need themselves, the engine only needs actor ids and names
+    actor_registry = Registry.from_model(Actor)
+    if processes > 1:
+        engine = GenerationEngine(processes=processes, seed=seed, sink=sink, sink_options=sink_options,
+                                  create_reports=not offline)
+
+    # rows generated per table, reported every GAME_PROGRESS_SECONDS
+    engine_rows = {}
+    progress_seconds = current_app.config.get("GAME_PROGRESS_SECONDS", 10)
+    started = last_report = perf_counter()
+
+    # team scores follow the indicators the game activates, this loop is the one process syncing them
+    scorer = get_scorer()
+    scoring_seconds = current_app.config.get("MITIGATION_SCORING_SECONDS", 5)
+    # full rescores catch anything the incremental updates missed (e.g. concurrent deny list changes)
+    rescore_seconds = current_app.config.get("MITIGATION_RESCORE_SECONDS", 60)
+    if not offline:
+        scorer.sync_indicators()
+        db.session.commit()
+    last_scoring = last_rescore = perf_counter()
+    tick = None
+
     # This is where the action is
-    # While this infinite loop runs, the game continues to generate data
-    # To implement games of finite size -> bound this loop (e.g. use a for loop instead)
-    while current_session.state == True:
+    # While the game is running, each tick generates the activity for its slice of game time
+    for tick in scheduler.ticks():
         # generate the activity
-        print("Running the game...")
-        for actor in actors: 
-            if actor.name == "Default":
-                # Default actor is used to create noise
-                generate_activity(actor, employees) 
-            else:
-                # generate activity of actors defined in actor config
-                generate_activity(actor, 
-                                  employees, 
-                                  num_passive_dns=random.randint(5, 10), 
-                                  num_email=random.randint(1, 5), 
-                                ) 
+        print(f"Running the game... {tick.start} -> {tick.end}")
+        budgets = {actor.id: scheduler.budget_for(actor, tick) for actor in actors}
+        if engine:
+            for table_name, rows in engine.run_cycle(actor_registry, cycle=tick.index, budgets=budgets,
+                                                     time_window=(tick.start, tick.end)).items():
+                engine_rows[table_name] = engine_rows.get(table_name, 0) + rows
+        else:
+            for actor in actors: 
+                rng = random.Random(derive_seed(seed, tick.index, actor.id))
+                generate_activity(actor, employees, seed=derive_seed(seed, tick.index, actor.id),
+                                  time_window=(tick.start, tick.end),
+                                  **get_activity_counts(actor, rng, budget=budgets[actor.id]))
+            # persist anything the generators created (e.g. passive DNS records)
+            db.session.commit()
+
+        if not offline and perf_counter() - last_scoring >= scoring_seconds:
+            last_scoring = perf_counter()
+            scorer.sync_indicators()
+            db.session.commit()
+
+        if not offline and perf_counter() - last_rescore >= rescore_seconds:
+            last_rescore = perf_counter()
+            scorer.rescore_all()
+            db.session.commit()
 
+        if perf_counter() - last_report >= progress_seconds:
+            last_report = perf_counter()
+            report_progress(tick, LOG_UPLOADER.row_counts, engine_rows, elapsed=last_report - started)
+            if not offline:
+                # the web process serves these at /admin/metrics
+                METRICS.export(game_metrics_path())
 
-def init_setup():
+    if engine:
+        engine.shutdown()
+    LOG_UPLOADER.flush_queue()
+    LOG_UPLOADER.sink.close()
+    if tick is not None:
+        report_progress(tick, LOG_UPLOADER.row_counts, engine_rows, elapsed=perf_counter() - started)
+    if not offline:
+        METRICS.export(game_metrics_path())
+
+    if max_days is not None and not offline:
+        # a finite game is over once all of its days are generated
+        current_session.state = False
+        db.session.commit()
+    print("Game stopped")
+
+
+def report_progress(tick, *row_counts: dict, elapsed: float) -> None:
+    """
+    Print the number of rows generated so far and the rate for each table
+    """
+    totals = {}
+    for counts in row_counts:
+        for table_name, rows in counts.items():
+            totals[table_name] = totals.get(table_name, 0) + rows
+
+    print(f"tick {tick.index}, game time {tick.end}, {elapsed:.0f}s elapsed")
+    for table_name, rows in sorted(totals.items()):
+        print(f"    {table_name:<30}{rows:>12} rows {rows / elapsed:>12.0f} rows/s")
+
+
+# seconds spent in each phase of the last init_setup
+INIT_PHASE_TIMINGS = {}
+
+
+def init_setup(seed: int = None, time_window: tuple = None):
     """
     These actions are conducted at the start of a new game session
 
@@ -99,47 +236,192 @@ def init_setup():
     Create Malicious Actors
     Create first batch of legit passive DNS
     Create first batch of malicious passive DNS
+
+    Two setups with the same seed create the same company, actors and records
+    Employees and DNS records are written with batched INSERTs (see utils.batched_inserts)
+    Pass the (start, end) game time window to time the initial activity inside it
+    The time spent in each phase is printed and kept in INIT_PHASE_TIMINGS
     """
-    employees = Employee.query.all()
-    actors = Actor.query.all()
+    timings = INIT_PHASE_TIMINGS
+    timings.clear()
+
+    employees = Registry.from_model(Employee)
+    actors = Actor.query.order_by(Actor.id).all()
 
     # only create employees for the company or actors 
     # if they do not already exist
     if not employees:
-        create_company()
+        if seed is not None:
+            seed_generation(derive_seed(seed, "company"))
+        with phase_timer("create company", timings), batched_inserts(Employee):
+            create_company()
         print("making employeesq")
-        employees = Employee.query.all()
+        employees = Registry.from_model(Employee)
         print(f"made {len(employees)} employees")
     if not actors:
-        create_actors()
-        actors = Actor.query.all()
+        with phase_timer("create actors", timings):
+            create_actors(seed=None if seed is None else derive_seed(seed, "actors"))
+        actors = Actor.query.order_by(Actor.id).all()
 
     # generate some initial activity for the actors
-    for actor in actors:
-        generate_activity(
-                            actor, 
-                            employees, 
-                            num_passive_dns=actor.count_init_passive_dns, 
-                            num_email=actor.count_init_email
-                        )                        
+    with phase_timer("initial activity", timings), batched_inserts(DNSRecord):
+        for actor in actors:
+            generate_activity(
+                                actor, 
+                                employees, 
+                                num_passive_dns=actor.count_init_passive_dns, 
+                                num_email=actor.count_init_email,
+                                seed=None if seed is None else derive_seed(seed, "init", actor.id),
+                                time_window=time_window
+                            )                        
+        db.session.commit()
     
-    all_dns_records = DNSRecord.query.all()
     # shuffle the dns records so that pivot points are not all next to each other in azure
-    random.shuffle(all_dns_records)
-    all_dns_records = [d.stringify() for d in all_dns_records]
-    upload_dns_records_to_azure(all_dns_records)
+    with phase_timer("upload dns records", timings):
+        upload_shuffled_dns_records(random.Random(derive_seed(seed, "dns_shuffle") if seed is not None else None),
+                                    time_window=time_window)
 
     for actor in actors:
         print(f"{actor.name}: {actor.get_attacks_by_type('email')}")
 
+    for phase, seconds in timings.items():
+        print(f"    {phase:<24}{seconds:>8.2f}s")
+
     return employees, actors
 
     
-def generate_activity(actor: Actor, employees: list, 
+def upload_shuffled_dns_records(rng=random, chunk_size: int = 500, time_window: tuple = None) -> None:
+    """
+    Upload every DNS record in a random order
+
+    Only the record ids are held in memory and shuffled. Records are then loaded,
+    stringified and uploaded one chunk at a time, so memory use doesn't grow with
+    the number of records and the upload starts with the first chunk.
+    chunk_size is kept under SQLite's default limit of 999 bound parameters.
+    The uploaded rows are timed inside time_window when it is given.
+    """
+    record_ids = [record_id for record_id, in db.session.query(DNSRecord.id).order_by(DNSRecord.id)]
+    rng.shuffle(record_ids)
+
+    for i in range(0, len(record_ids), chunk_size):
+        chunk_ids = record_ids[i:i + chunk_size]
+        records = {record.id: record for record in DNSRecord.query.filter(DNSRecord.id.in_(chunk_ids))}
+        with LOG_UPLOADER.time_window(time_window, np.random.default_rng(rng.getrandbits(64))):
+            upload_dns_records_to_azure([records[record_id].stringify() for record_id in chunk_ids])
+        # drop the chunk from the session so it can be garbage collected
+        for record in records.values():
+            db.session.expunge(record)
+
+
+# Generators that make up one cycle of activity, keyed by name
+# Each one is called with the actor, the employees and the counts passed to generate_activity
+# Naming them lets the generation engine hand individual generators to worker processes
+ACTIVITY_GENERATORS = {
+    "passive_dns": lambda actor, employees, counts: gen_passive_dns(actor, counts["num_passive_dns"]),
+    "email": lambda actor, employees, counts: gen_email(employees, actor, counts["num_email"]),
+    "browsing": lambda actor, employees, counts: browse_random_website(employees, actor, counts["num_random_browsing"]),
+    "auth": lambda actor, employees, counts: auth_random_user_to_mail_server(employees, counts["num_auth_events"]),
+    "inbound_browsing": lambda actor, employees, counts: gen_random_inbound_browsing(counts["num_random_browsing"]),
+    "system_files": lambda actor, employees, counts: gen_system_files_on_host(counts["count_of_endpoint_events"]),
+    "user_files": lambda actor, employees, counts: gen_user_files_on_host(counts["count_of_endpoint_events"]),
+    "system_processes": lambda actor, employees, counts: gen_system_processes_on_host(counts["count_of_endpoint_events"]),
+}
+
+# Vectorized versions of the Default actor's noise generators (see noise.py)
+# These are used instead of the generators above when the time window of the cycle is known
+# Each one is called with the actor, the employees, the counts, the time window and a numpy generator
+# and returns the name of the table and a dataframe of rows for it
+BATCH_GENERATORS = {
+    "browsing": lambda actor, employees, counts, window, rng: (
+        OUTBOUND_BROWSING_TABLE, synthesize_outbound_browsing(employees, counts["num_random_browsing"], window, rng,
+                                                              domains=get_actor_domains(actor))),
+    "auth": lambda actor, employees, counts, window, rng: (
+        AUTHENTICATION_TABLE, synthesize_auth_events(employees, counts["num_auth_events"], window, rng)),
+    "inbound_browsing": lambda actor, employees, counts, window, rng: (
+        INBOUND_BROWSING_TABLE, synthesize_inbound_browsing(counts["num_random_browsing"], window, rng,
+                                                            domains=company_domains(employees))),
+}
+
+
+def get_actor_domains(actor: Actor) -> "list[str]":
+    """
+    The domains of the actor's passive DNS records, in a fixed order
+    """
+    return [domain for domain, in
+            db.session.query(DNSRecord.domain).filter(DNSRecord.actor_id == actor.id).distinct().order_by(DNSRecord.domain)]
+
+# Every actor gets passive DNS and email
+# browsing for other actors should only come through email clicks
+ACTOR_GENERATORS = ("passive_dns", "email")
+# The Default actor also creates the background noise of the company
+DEFAULT_ACTOR_GENERATORS = ACTOR_GENERATORS + (
+    "browsing", "auth", "inbound_browsing", "system_files", "user_files", "system_processes"
+)
+
+
+# Share of an actor's events that goes to each generate_activity count
+# These match the ratios of the generate_activity defaults
+DEFAULT_ACTOR_EVENT_WEIGHTS = {
+    "num_passive_dns": 500,
+    "num_email": 1000,
+    "num_random_browsing": 1000,
+    "num_auth_events": 400,
+    "count_of_endpoint_events": 900,
+}
+ACTOR_EVENT_WEIGHTS = {
+    "num_passive_dns": 7.5,
+    "num_email": 3,
+}
+# Counts that are used by more than one generator
+GENERATORS_PER_COUNT = {
+    "num_random_browsing": 2,       # outbound and inbound browsing
+    "count_of_endpoint_events": 3,  # system files, user files and processes
+}
+
+
+def get_activity_counts(actor: Actor, rng=random, budget: float = None) -> dict:
+    """
+    Return the generate_activity keyword arguments for one cycle of an actor
+    The Default actor is used to create noise and runs with the default counts
+    Actors defined in actor configs only trickle out a few events per cycle
+
+    When a budget is given, that many events (on average) are split between the generators
+    """
+    if budget is None:
+        if actor.name == "Default":
+            return {}
+        return {
+            "num_passive_dns": rng.randint(5, 10),
+            "num_email": rng.randint(1, 5),
+        }
+
+    weights = DEFAULT_ACTOR_EVENT_WEIGHTS if actor.name == "Default" else ACTOR_EVENT_WEIGHTS
+    total_weight = sum(weights.values())
+    counts = {}
+    for name, weight in weights.items():
+        expected = budget * weight / total_weight / GENERATORS_PER_COUNT.get(name, 1)
+        # round at random so that small budgets still produce the right number of events over time
+        counts[name] = int(expected) + (rng.random() < expected % 1)
+    return counts
+
+
+def get_activity_generators(actor: Actor) -> "tuple[str]":
+    """
+    Return the names of the generators that run for the given actor
+    """
+    if actor.name == "Default":
+        return DEFAULT_ACTOR_GENERATORS
+    return ACTOR_GENERATORS
+
+    
+def generate_activity(actor: Actor, employees: Registry, 
                         num_passive_dns:int=500, num_email:int=1000, 
                         num_random_browsing:int=500, 
                         num_auth_events:int=400,
-                        count_of_endpoint_events=300) -> None:
+                        count_of_endpoint_events=300,
+                        generators: "list[str]"=None,
+                        seed: int=None,
+                        time_window: tuple=None) -> None:
     """
     Given an actor, enerates one cycle of activity for users in the orgs
     Current:
@@ -148,65 +430,87 @@ def generate_activity(actor: Actor, employees: list,
         - Generate passiev DNS traffic
 
     The Default actor is user to represent normal company activities
+    The time spent and the rows queued by each generator are recorded in METRICS
+    Pass a list of generator names to only run part of the cycle
+    Each generator is seeded from seed, so a generator produces the same data
+    whether it runs alone or as part of the full cycle
+    When the (start, end) time window of the cycle is given, every event is timed inside it
+    and the noise generators that have a vectorized version in BATCH_GENERATORS synthesize
+    their events in bulk (unless GAME_BATCH_NOISE is turned off)
+    The reports of the emails are created right after the email generator (see reports.py)
     """
     print(f" activity for actor {actor.name}")
-    # Generate passive DNS for specified actor
-    gen_passive_dns(actor, num_passive_dns)
-
-    # Generate emails for random employees for specified actor
-    # TODO: handle number of emails generated in the function
-    gen_email(employees, actor, num_email)
+    counts = {
+        "num_passive_dns": num_passive_dns,
+        "num_email": num_email,
+        "num_random_browsing": num_random_browsing,
+        "num_auth_events": num_auth_events,
+        "count_of_endpoint_events": count_of_endpoint_events,
+    }
+    batch_noise = time_window is not None and current_app.config.get("GAME_BATCH_NOISE", True)
+    for generator in generators or get_activity_generators(actor):
+        if seed is not None:
+            seed_generation(derive_seed(seed, generator))
+        rows_before = sum(LOG_UPLOADER.row_counts.values())
+        emails = []
+        with METRICS.timer("generator_seconds", generator=generator):
+            if batch_noise and generator in BATCH_GENERATORS:
+                rng = np.random.default_rng(None if seed is None else derive_seed(seed, generator))
+                table_name, data_table_df = BATCH_GENERATORS[generator](actor, employees, counts, time_window, rng)
+                LOG_UPLOADER.send_batch_to_queue(table_name, data_table_df)
+            else:
+                # the generators' own clock doesn't follow the ticks, move their rows into the tick
+                rng = np.random.default_rng(None if seed is None else derive_seed(seed, generator, "time"))
+                reports_before = reports.ORM_REPORTS
+                with LOG_UPLOADER.collect(reports.EMAIL_TABLE) as emails:
+                    with LOG_UPLOADER.time_window(time_window, rng):
+                        ACTIVITY_GENERATORS[generator](actor, employees, counts)
+        METRICS.increment("generator_runs", generator=generator)
+        METRICS.increment("generator_rows", sum(LOG_UPLOADER.row_counts.values()) - rows_before,
+                          generator=generator)
 
-    # Generate browsing activity for random emplyoees for the default actor
-    # browsing for other actors should only come through email clicks
-    if actor.name == "Default":
-        browse_random_website(employees, actor, num_random_browsing)
-        auth_random_user_to_mail_server(employees, num_auth_events)
-        gen_random_inbound_browsing(num_random_browsing)
-        gen_system_files_on_host(count_of_endpoint_events)
-        gen_user_files_on_host(count_of_endpoint_events)
-        gen_system_processes_on_host(count_of_endpoint_events)
+        # employees of every team report some of the emails, unless the generator made the reports itself
+        if emails and reports.ORM_REPORTS == reports_before:
+            with METRICS.timer("report_creation_seconds"):
+                reports.create_reports(pd.DataFrame(emails))
 
-def create_actors() -> None:
+def create_actors(seed: int = None) -> None:
     """
     Create a malicious actor in the game and adds them to the database
     Actors are read in from yaml files in the actor_configs folder
-
-    TODO: there should be some validation of actor configs prior to creation
+    The configs are validated first, ConfigError is raised if any of them is invalid
     """
+    if seed is not None:
+        seed_generation(seed)
 
     # instantial a default actor - this actor should always exist
     # the default actor is used to generate background noise in the game
+    # draw the words for both themes at once
+    theme_words = wordGenerator.get_words(2000)
     default_actor = Actor(
         name = "Default",  # Dont change the name!
         effectiveness = 99,
         count_init_passive_dns=5000, 
         count_init_email= 5000, 
         count_init_browsing=5000,
-        domain_themes = wordGenerator.get_words(1000),
-        sender_themes = wordGenerator.get_words(1000)
+        domain_themes = theme_words[:1000],
+        sender_themes = theme_words[1000:]
     )
 
     # load add default_actor
     actors = [default_actor]
 
     # use yaml configs to load other actors
-    # read yaml file for each new actor, load json from yaml
-    actor_configs = glob.glob("app/game_configs/actors/*.yaml") 
-    for file in actor_configs:
-        actor_config = read_config_from_yaml(file)
-        # use dictionary value to instantiate actor
-        if actor_config:
-            print(f"adding actor: {actor_config}")
-            # use dict to instantiate the actor
-            actors.append(
-                Actor(**actor_config)
-            )
+    for actor_config in ACTOR_CONFIGS.load_all():
+        print(f"adding actor: {actor_config}")
+        # use dict to instantiate the actor
+        actors.append(
+            Actor(**actor_config)
+        )
 
     # add all the actors to the database
     try:
-        for actor in actors:
-            db.session.add(actor)
+        db.session.add_all(actors)
         db.session.commit()
     except Exception as e:
         db.session.rollback()
@@ -216,11 +520,7 @@ def create_malware() -> "list[Malware]":
     """
     Load all malware configs from YAML and configure a list of Malware objects
     """
-    malware_objects = []
-    malware_configs = glob.glob(f"app/game_configs/malware/*.yaml")
-    for path in malware_configs:
-        malware_objects.append(load_malware_obj_from_yaml_by_file(path))
-    
+    malware_objects = MALWARE_CONFIGS.load_all()
     malware_objects = assign_hash_to_malware(malware_objects)
     return malware_objects
 
@@ -228,15 +528,7 @@ def assign_hash_to_malware(malware_objects: "list[Malware]") -> "list[Malware]":
     """
     Take all available VT hashes and assign them to malware families 
     there should be a 1-1 mapping of hash to malware family
+    The generators look families up with malware_hashes.get_malware_family_for_hash
     """
-    # Look through available hashes and assign them to malware families via a round robin
-    while FILES_MALICIOUS_VT_SEED_HASHES:
-        for malware_object in malware_objects:
-            if not FILES_MALICIOUS_VT_SEED_HASHES:
-                break
-            # take a hash and remove it from our list of hashes
-            hash = FILES_MALICIOUS_VT_SEED_HASHES.pop()
-            malware_object.hashes.append(hash) # TODO: This might not work!!
-   
-    return malware_objects
+    return index_malware_hashes(malware_objects, FILES_MALICIOUS_VT_SEED_HASHES)
 
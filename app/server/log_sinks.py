@@ -0,0 +1,107 @@
+"""
+Destinations for the logs generated by the game
+
+LogUploader batches rows per table and hands each batch to a sink as a dataframe.
+ADX is the default. The other sinks allow datasets to be built offline.
+"""
+import os
+import pandas as pd
+
+
+class LogSink():
+    """
+    Base class for sinks, write is called with each batch of rows for a table
+    """
+
+    def write(self, table_name: str, data_table_df: pd.DataFrame) -> None:
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+
+class AdxSink(LogSink):
+    """
+    Submit logs to Kusto through a queued ingest client
+    """
+
+    def __init__(self, ingest_client, database: str):
+        from azure.kusto.data.data_format import DataFormat
+        from azure.kusto.ingest import IngestionProperties, ReportLevel
+
+        self.ingest = ingest_client
+        self.database = database
+        self._ingestion_props = lambda table_name: IngestionProperties(
+            database=database,
+            table=table_name,
+            data_format=DataFormat.CSV,
+            report_level=ReportLevel.FailuresAndSuccesses
+        )
+
+    def write(self, table_name: str, data_table_df: pd.DataFrame) -> None:
+        result = self.ingest.ingest_from_dataframe(
+            data_table_df, ingestion_properties=self._ingestion_props(table_name))
+        print(result)
+        print(f"....adding data to azure for {table_name} table")
+
+
+class ConsoleSink(LogSink):
+    """
+    Print logs instead of uploading them (ADX_DEBUG_MODE)
+    """
+
+    def write(self, table_name: str, data_table_df: pd.DataFrame) -> None:
+        print(f"Uploading to table {table_name}...")
+        print(data_table_df.to_markdown())
+
+
+class FileSink(LogSink):
+    """
+    Append logs to one CSV file per table in a directory
+
+    Rows are written as soon as a batch is flushed so memory use is bounded by the
+    uploader queue, not by the size of the dataset.
+    part is added to the file names so that several processes can write to the same directory
+    """
+
+    def __init__(self, directory: str, part=None, compress: bool = False):
+        self.directory = directory
+        self.part = part
+        self.compress = compress
+        os.makedirs(directory, exist_ok=True)
+
+    def path_for(self, table_name: str) -> str:
+        name = table_name if self.part is None else f"{table_name}.part-{self.part}"
+        return os.path.join(self.directory, name + (".csv.gz" if self.compress else ".csv"))
+
+    def write(self, table_name: str, data_table_df: pd.DataFrame) -> None:
+        path = self.path_for(table_name)
+        data_table_df.to_csv(path, mode="a", header=not os.path.exists(path), index=False,
+                             compression="gzip" if self.compress else None)
+
+
+class NullSink(LogSink):
+    """
+    Throw logs away, useful to benchmark generation on its own
+    """
+
+    def write(self, table_name: str, data_table_df: pd.DataFrame) -> None:
+        pass
+
+
+# sinks that can be selected by name, e.g. from the command line
+SINKS = {
+    "console": ConsoleSink,
+    "file": FileSink,
+    "null": NullSink,
+}
+
+
+def make_sink(name: str, **options) -> LogSink:
+    """
+    Instantiate a sink by name
+    The ADX sink is not listed, it is created by LogUploader when no sink is given
+    """
+    if name not in SINKS:
+        raise ValueError(f"Unknown log sink {name}, expected one of {', '.join(SINKS)}")
+    return SINKS[name](**options)
@@ -0,0 +1,57 @@
+"""
+Which malware family each file hash belongs to
+
+Every seed VT hash is handed to one malware family, round robin, so a hash always
+identifies a single family. The index is built once per set of families and kept
+as a read-only mapping, which gives the file and process generators an O(1)
+hash -> family lookup. It lives apart from game_functions so the generator modules
+can import it without importing the game loop.
+"""
+from functools import lru_cache
+from types import MappingProxyType
+
+
+# hash -> malware family name, set by index_malware_hashes
+FILE_HASH_MALWARE_MAPPING = MappingProxyType({})
+
+
+@lru_cache(maxsize=None)
+def build_hash_index(families: "tuple[str]", hashes: "tuple[str]") -> MappingProxyType:
+    """
+    Assign every hash to one of the given malware families via a round robin
+    Returns a read-only hash -> family mapping
+    Raises ValueError when a family name is given twice, the mapping has to be 1-1
+    """
+    duplicates = sorted({family for family in families if families.count(family) > 1})
+    if duplicates:
+        raise ValueError(f"malware family names must be unique, found {', '.join(duplicates)} more than once")
+    index = {}
+    if families:
+        # hashes used to be popped off the end of the list, keep handing them out in that order
+        for hash in reversed(hashes):
+            if hash not in index:
+                index[hash] = families[len(index) % len(families)]
+    return MappingProxyType(index)
+
+
+def index_malware_hashes(malware_objects: list, hashes: "list[str]") -> list:
+    """
+    Build the hash index for the malware families and add each family's hashes to its object
+    The hash list itself is never modified, so the same families always get the same hashes
+    """
+    global FILE_HASH_MALWARE_MAPPING
+    FILE_HASH_MALWARE_MAPPING = build_hash_index(tuple(m.name for m in malware_objects), tuple(hashes))
+
+    hashes_by_family = {}
+    for hash, family in FILE_HASH_MALWARE_MAPPING.items():
+        hashes_by_family.setdefault(family, []).append(hash)
+    for malware_object in malware_objects:
+        malware_object.hashes.extend(hashes_by_family.get(malware_object.name, []))
+    return malware_objects
+
+
+def get_malware_family_for_hash(hash: str) -> "str | None":
+    """
+    Return the name of the malware family a file hash belongs to, None for unknown hashes
+    """
+    return FILE_HASH_MALWARE_MAPPING.get(hash)
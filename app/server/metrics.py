@@ -0,0 +1,208 @@
+"""
+In-process metrics for the game: counters, gauges and timers
+
+Metrics are identified by a name and optional labels, e.g.
+    METRICS.observe("generator_seconds", 0.25, generator="email")
+They are exposed as JSON or in the Prometheus text format at /admin/metrics.
+Metrics are kept per process, the generation engine reports the timings of its
+workers back to the game process. The game loop runs in its own process (or the
+build-dataset cli) and writes a snapshot to METRICS_EXPORT_PATH every progress
+report; /admin/metrics serves it next to the web process's own metrics, each
+series labelled with the process it comes from.
+"""
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+
+class Metrics():
+    """
+    Thread-safe store of counters, gauges and timers
+    """
+
+    def __init__(self, prefix: str = "kc7"):
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}
+        # gauges read from a callback when metrics are exported
+        self.gauge_callbacks = {}
+        # (name, labels) -> [count, total seconds, max seconds]
+        self.timers = {}
+
+    @staticmethod
+    def _key(name: str, labels: dict) -> tuple:
+        return name, tuple(sorted(labels.items()))
+
+    def increment(self, name: str, value: float = 1, **labels) -> None:
+        key = self._key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set_gauge(self, name: str, value: float, **labels) -> None:
+        with self._lock:
+            self.gauges[self._key(name, labels)] = value
+
+    def register_gauge(self, name: str, callback, **labels) -> None:
+        """
+        Report the value returned by callback whenever metrics are exported
+        """
+        with self._lock:
+            self.gauge_callbacks[self._key(name, labels)] = callback
+
+    def observe(self, name: str, seconds: float, **labels) -> None:
+        key = self._key(name, labels)
+        with self._lock:
+            timer = self.timers.setdefault(key, [0, 0.0, 0.0])
+            timer[0] += 1
+            timer[1] += seconds
+            timer[2] = max(timer[2], seconds)
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        """
+        Time the enclosed block
+        """
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def timed(self, name: str, **labels):
+        """
+        Decorator that times every call of a function
+        """
+        def decorator(f):
+            @wraps(f)
+            def wrap(*args, **kw):
+                with self.timer(name, **labels):
+                    return f(*args, **kw)
+            return wrap
+        return decorator
+
+    def _gauge_values(self) -> dict:
+        with self._lock:
+            gauges = dict(self.gauges)
+            callbacks = dict(self.gauge_callbacks)
+        for key, callback in callbacks.items():
+            try:
+                gauges[key] = callback()
+            except Exception:
+                # the object behind the callback may be gone, skip it
+                pass
+        return gauges
+
+    def snapshot(self) -> dict:
+        """
+        All metrics as a JSON serialisable dictionary
+        """
+        gauges = self._gauge_values()
+        with self._lock:
+            return {
+                "counters": [{"name": name, "labels": dict(labels), "value": value}
+                             for (name, labels), value in sorted(self.counters.items())],
+                "gauges": [{"name": name, "labels": dict(labels), "value": value}
+                           for (name, labels), value in sorted(gauges.items())],
+                "timers": [{"name": name, "labels": dict(labels), "count": count,
+                            "sum": total, "max": longest, "mean": total / count if count else 0}
+                           for (name, labels), (count, total, longest) in sorted(self.timers.items())],
+            }
+
+    def to_prometheus(self) -> str:
+        """
+        All metrics in the Prometheus text exposition format
+        """
+        return format_prometheus(self.snapshot(), self.prefix)
+
+    def export(self, path: str) -> None:
+        """
+        Write a snapshot to path as JSON, for another process to serve (see read_export)
+        The file is replaced atomically, readers never see half of it
+        """
+        snapshot = {**self.snapshot(), "pid": os.getpid(), "exported_at": time.time()}
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(f"{path}.{os.getpid()}.tmp", "w") as f:
+            json.dump(snapshot, f)
+        os.replace(f"{path}.{os.getpid()}.tmp", path)
+
+    def reset(self) -> None:
+        with self._lock:
+            self.counters.clear()
+            self.gauges.clear()
+            self.timers.clear()
+
+
+def format_prometheus(snapshot: dict, prefix: str = "kc7") -> str:
+    """
+    A snapshot in the Prometheus text exposition format
+    Timers are exported as summaries (_count and _sum)
+    """
+    def series(entry, suffix=""):
+        label_text = ",".join(f'{k}="{v}"' for k, v in sorted(entry["labels"].items()))
+        return f"{prefix}_{entry['name']}{suffix}" + (f"{{{label_text}}}" if label_text else "")
+
+    lines = []
+    for kind, section in (("counter", "counters"), ("gauge", "gauges"), ("summary", "timers")):
+        declared = set()
+        for entry in snapshot[section]:
+            if entry["name"] not in declared:
+                declared.add(entry["name"])
+                lines.append(f"# TYPE {prefix}_{entry['name']} {kind}")
+            if kind == "summary":
+                lines.append(f"{series(entry, '_count')} {entry['count']}")
+                lines.append(f"{series(entry, '_sum')} {entry['sum']}")
+            else:
+                lines.append(f"{series(entry)} {entry['value']}")
+    return "\n".join(lines) + "\n"
+
+
+def game_metrics_path() -> str:
+    """
+    Where the game process exports its metrics, METRICS_EXPORT_PATH or game_metrics.json in the instance folder
+    """
+    from flask import current_app
+
+    return current_app.config.get("METRICS_EXPORT_PATH") or os.path.join(current_app.instance_path,
+                                                                         "game_metrics.json")
+
+
+def read_export(path: str) -> "dict | None":
+    """
+    The snapshot written by Metrics.export, None if there is none (e.g. the game never ran)
+    """
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def merge_snapshots(snapshots: "dict[str, dict]") -> dict:
+    """
+    One snapshot of the snapshots of several processes, keyed by process name
+    Every series gets a process label, processes without a snapshot are skipped
+    """
+    merged = {"counters": [], "gauges": [], "timers": []}
+    for process, snapshot in snapshots.items():
+        if not snapshot:
+            continue
+        for section, entries in merged.items():
+            entries.extend({**entry, "labels": {**entry["labels"], "process": process}}
+                           for entry in snapshot.get(section, []))
+        if "exported_at" in snapshot:
+            # a stale snapshot means the game stopped reporting
+            merged["gauges"].append({"name": "snapshot_age_seconds", "labels": {"process": process},
+                                     "value": time.time() - snapshot["exported_at"]})
+    for entries in merged.values():
+        entries.sort(key=lambda entry: (entry["name"], sorted(entry["labels"].items())))
+    return merged
+
+
+# metrics of this process
+METRICS = Metrics()
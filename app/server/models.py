@@ -4,10 +4,12 @@ import json
 import datetime
 from faker import Faker
 from faker.providers import internet
+from app.server.faker_pools import PooledFaker
 from flask_security import RoleMixin, UserMixin, user_registered
 from sqlalchemy import desc
 # Import password / encryption helper tools
 from werkzeug.security import check_password_hash, generate_password_hash
+from app.server.passwords import hash_password, verify_password, needs_rehash
 from flask import jsonify
 from app import cache
 
@@ -15,8 +17,8 @@ from app import cache
 # We will define this inside /app/__init__.py in the next sections.
 from app import db
 
-# instantiate faker
-fake = Faker()
+# instantiate faker, the providers that have a pool draw from it (see faker_pools.py)
+fake = PooledFaker(Faker())
 fake.add_provider(internet)
 
 
@@ -50,6 +52,8 @@ class Team(AuthBase):
     score                   = db.Column(db.Integer, nullable=False)
     _mitigations            = db.Column(db.Text)
     security_awareness      = db.Column(db.Float, nullable=False)
+    # set when the score is rewritten as a whole, until the game loop next syncs scores (see scoring.py)
+    rescored                = db.Column(db.Boolean, default=False)
 
     def __init__(self, name, score, _mitigations="", security_awareness=.25):
 
@@ -61,6 +65,119 @@ class Team(AuthBase):
     def __repr__(self):
         return '<Team %r>' % self.name
 
+    def get_deny_list(self) -> "list[str]":
+        """
+        The indicators this team blocks, in the order they were added
+        """
+        rows = (
+            db.session.query(TeamMitigation.indicator)
+            .filter(TeamMitigation.team_id == self.id)
+            .order_by(TeamMitigation.id)
+        )
+        return [indicator for indicator, in rows]
+
+    def add_to_deny_list(self, indicators) -> "list[str]":
+        """
+        Block the given indicators, returns the ones that weren't blocked yet
+        Only the new indicators are written, the rest of the list isn't touched
+        """
+        indicators = normalize_indicators(indicators)
+        blocked = set()
+        for chunk in chunks(indicators):
+            blocked.update(indicator for indicator, in (
+                db.session.query(TeamMitigation.indicator)
+                .filter(TeamMitigation.team_id == self.id, TeamMitigation.indicator.in_(chunk))
+            ))
+        added = [indicator for indicator in indicators if indicator not in blocked]
+        if added:
+            now = datetime.datetime.now()
+            db.session.execute(TeamMitigation.__table__.insert(), [
+                {"team_id": self.id, "indicator": indicator, "added_on": now} for indicator in added
+            ])
+        return added
+
+    def remove_from_deny_list(self, indicators) -> "list[str]":
+        """
+        Unblock the given indicators, returns the ones that were blocked
+        """
+        indicators = normalize_indicators(indicators)
+        removed = []
+        for chunk in chunks(indicators):
+            removed.extend(indicator for indicator, in (
+                db.session.query(TeamMitigation.indicator)
+                .filter(TeamMitigation.team_id == self.id, TeamMitigation.indicator.in_(chunk))
+            ))
+            TeamMitigation.query.filter(
+                TeamMitigation.team_id == self.id, TeamMitigation.indicator.in_(chunk)
+            ).delete(synchronize_session=False)
+        return removed
+
+    def set_deny_list(self, indicators) -> "tuple[list[str], list[str]]":
+        """
+        Make the deny list exactly the given indicators by adding and removing the difference
+        Returns (added, removed)
+        """
+        wanted = normalize_indicators(indicators)
+        current = set(self.get_deny_list())
+        added = self.add_to_deny_list([indicator for indicator in wanted if indicator not in current])
+        removed = self.remove_from_deny_list(sorted(current - set(wanted)))
+        return added, removed
+
+
+# longest indicator a team can block (domains are at most 253 characters)
+MAX_INDICATOR_LENGTH = 255
+
+
+def normalize_indicator(indicator: str) -> str:
+    # domains and hashes are case insensitive
+    return indicator.strip().lower()
+
+
+def normalize_indicators(indicators) -> "list[str]":
+    """
+    Stripped, lower case and de-duplicated indicators in their original order
+    Raises ValueError for an indicator that is too long to store
+    """
+    normalized = {}
+    for indicator in indicators:
+        indicator = normalize_indicator(indicator)
+        if not indicator:
+            continue
+        if len(indicator) > MAX_INDICATOR_LENGTH:
+            raise ValueError(f"indicator longer than {MAX_INDICATOR_LENGTH} characters: {indicator[:50]}...")
+        normalized[indicator] = True
+    return list(normalized)
+
+
+def chunks(items: list, size: int = 500):
+    # keep IN lists under the bound parameter limit of SQLite
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+class TeamMitigation(AuthBase):
+
+    """
+        One indicator (domain, IP or hash) on a team's deny list
+    """
+    __tablename__   = "team_mitigations"
+    __table_args__  = (
+        db.Index("ix_team_mitigations_team_indicator", "team_id", "indicator", unique=True),
+    )
+
+    team_id                = db.Column(db.Integer, db.ForeignKey('teams.id', ondelete="CASCADE"), nullable=False)
+    indicator              = db.Column(db.String(MAX_INDICATOR_LENGTH), nullable=False, index=True)
+    added_on               = db.Column(db.DateTime)
+
+    def __init__(self, team_id, indicator):
+
+        self.team_id = team_id
+        self.indicator = normalize_indicator(indicator)
+        self.added_on = datetime.datetime.now()
+
+    def __repr__(self):
+        return '<TeamMitigation %r %r>' % (self.team_id, self.indicator)
+
 
 class Users(AuthBase, RoleMixin):
 
@@ -73,7 +190,7 @@ class Users(AuthBase, RoleMixin):
     email           = db.Column('email', db.String(50), unique=True, index=True)
     registered_on   = db.Column('registered_on', db.DateTime)
 
-    team_id = db.Column(db.Integer, db.ForeignKey('teams.id'))
+    team_id = db.Column(db.Integer, db.ForeignKey('teams.id'), index=True)
     team = db.relationship(
         'Team', backref=db.backref('members', lazy='dynamic')
     )
@@ -132,27 +249,17 @@ class Users(AuthBase, RoleMixin):
         to no imports within the CTFd application as importing from the
         application itself will result in a circular import.
         """
-        from app.server.utils import get_user_standings
-        from  app.server.utils import ordinalize
-
-        standings = get_user_standings()
-
-        for i, user in enumerate(standings):
-            if user.user_id == self.id:
-                n = i + 1
-                if numeric:
-                    return n
-                ranking =  ordinalize(n)
-                if ranking == "1st":
-                    return ranking + "  🥇"
-                elif ranking == "2nd":
-                    return ranking + "  🥈"
-                elif ranking == "3rd":
-                    return ranking + "  🥉"
-                else: 
-                    return ranking
-        else:
+        from app.server.utils import ranked_players
+        from  app.server.utils import format_place
+
+        # look up this user's row of the ranked players rather than scanning all standings
+        players = ranked_players().subquery()
+        n = db.session.query(players.c.place).filter(players.c.user_id == self.id).scalar()
+        if n is None:
             return None
+        if numeric:
+            return n
+        return format_place(n)
 
     @property
     def place(self):
@@ -160,10 +267,14 @@ class Users(AuthBase, RoleMixin):
 
     
     def set_password(self, password):
-        self.pw_hash = generate_password_hash(password)
+        # hashed on the bounded process pool, see app/server/passwords.py
+        self.pw_hash = hash_password(password)
 
     def check_password(self, password):
-        return check_password_hash(self.pw_hash, password)
+        return verify_password(self.pw_hash, password)
+
+    def password_needs_rehash(self):
+        return needs_rehash(self.pw_hash)
 
     def is_authenticated(self):
         return True
@@ -210,11 +321,15 @@ class Report(AuthBase):
         based on the security awareness of the company
     """
     __tablename__   = "report"
+    __table_args__  = (
+        # a team's reports, newest first (see app/server/reports.py)
+        db.Index("ix_report_team_time", "team_id", "time", "id"),
+    )
 
     subject                = db.Column(db.String(50), nullable=False)
     sender                 = db.Column(db.String(50), nullable=False)
     recipient              = db.Column(db.String(50), nullable=False)
-    time                   = db.Column(db.String(50), nullable=False)
+    time                   = db.Column(db.DateTime, nullable=False)
     
     team_id                = db.Column(db.Integer, db.ForeignKey('teams.id'))
     team                   = db.relationship('Team', backref=db.backref('reports', lazy='dynamic'))
@@ -224,6 +339,11 @@ class Report(AuthBase):
         self.subject = subject
         self.sender = sender
         self.recipient = recipient
+        # the game's email rows carry their time as epoch seconds or an ISO string
+        if isinstance(time, (int, float)):
+            time = datetime.datetime.fromtimestamp(time)
+        elif isinstance(time, str):
+            time = datetime.datetime.fromisoformat(time)
         self.time = time
         self.team = team
 
@@ -242,12 +362,15 @@ class GameSession(Base):
     start_time      = db.Column(db.String(50)) #should be given as a timestamp float
     seed_date       = db.Column(db.String(50))  
     time_multiplier = db.Column(db.Integer())
+    seed            = db.Column(db.BigInteger())
 
-    def __init__(self, state, start_time, seed_date="2022-01-01", time_multiplier=1000):
+    def __init__(self, state, start_time, seed_date="2022-01-01", time_multiplier=1000, seed=None):
         self.state = False
         self.seed_date = seed_date    # starting date for the game
         self.start_time = start_time  # real life start time of game
         self.time_multiplier = time_multiplier
+        # seed for all generated game data, two games with the same seed generate the same data
+        self.seed = seed if seed is not None else random.randrange(2**63)
 
 
 ##################################################################
@@ -298,8 +421,8 @@ class Challenges(db.Model):
 class Solves(Base):
     __tablename__ = 'solves'
     id                          = db.Column(db.Integer(), primary_key=True, autoincrement=True)
-    challenge_id                = db.Column(db.Integer, db.ForeignKey('challenges.id', ondelete="CASCADE"))
-    user_id                     = db.Column(db.Integer, db.ForeignKey('users.user_id', ondelete="CASCADE"))
+    challenge_id                = db.Column(db.Integer, db.ForeignKey('challenges.id', ondelete="CASCADE"), index=True)
+    user_id                     = db.Column(db.Integer, db.ForeignKey('users.user_id', ondelete="CASCADE"), index=True)
     username                   = db.Column(db.String(50))  
 
     def __init__(self, challenge_id:int, user_id:int, username:str="na"):
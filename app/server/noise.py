@@ -0,0 +1,122 @@
+"""
+Vectorized synthesis of background noise for the Default actor
+
+The regular noise generators build one event at a time with Faker and random.
+These functions draw every column of a batch at once as NumPy arrays
+(timestamps, employee indices, domains, user agents...) and return a dataframe
+that goes straight into LogUploader.send_batch_to_queue.
+
+Faker values (domains, user agents, ...) are sampled from the pools in faker_pools.py.
+
+Each function writes one of the tables of the per-event generators, with the same
+columns in the same order (TABLE_COLUMNS). CSV ingestion into ADX maps columns by
+position, so the order matters as much as the names. LogUploader also checks a batch
+against the rows the per-event generators queue for the same table.
+"""
+import numpy as np
+import pandas as pd
+
+from app.server.faker_pools import get_pool
+from app.server.registries import Registry
+
+
+# Employee columns used by the noise generators
+EMPLOYEE_IP = "ip_addr"
+EMPLOYEE_USER_AGENT = "user_agent"
+EMPLOYEE_USERNAME = "username"
+EMPLOYEE_HOSTNAME = "hostname"
+EMPLOYEE_COMPANY_DOMAIN = "company_domain"
+
+# Tables written by browse_random_website, gen_random_inbound_browsing and
+# auth_random_user_to_mail_server, and their columns in table order
+OUTBOUND_BROWSING_TABLE = "OutboundBrowsing"
+INBOUND_BROWSING_TABLE = "InboundBrowsing"
+AUTHENTICATION_TABLE = "AuthenticationEvents"
+TABLE_COLUMNS = {
+    OUTBOUND_BROWSING_TABLE: ["timestamp", "method", "src_ip", "user_agent", "url"],
+    INBOUND_BROWSING_TABLE: ["timestamp", "method", "src_ip", "user_agent", "url"],
+    AUTHENTICATION_TABLE: ["timestamp", "hostname", "src_ip", "user_agent", "username", "result", "description"],
+}
+
+
+def draw_timestamps(rng: np.random.Generator, n: int, time_window: tuple) -> pd.Index:
+    """
+    Draw n sorted timestamps uniformly between the start and end of time_window
+    """
+    start, end = (pd.Timestamp(t).value for t in time_window)
+    nanoseconds = np.sort(rng.integers(start, max(end, start + 1), size=n))
+    return pd.to_datetime(nanoseconds).strftime("%Y-%m-%dT%H:%M:%S")
+
+
+def pick(rng: np.random.Generator, values, n: int) -> np.ndarray:
+    """
+    Draw n values (with replacement) from a sequence
+    """
+    values = np.asarray(values, dtype=object)
+    return values[rng.integers(0, len(values), size=n)]
+
+
+def company_domains(employees: Registry) -> "list[str]":
+    """
+    The distinct domains of the company, None if the employees don't have one
+    """
+    if EMPLOYEE_COMPANY_DOMAIN not in employees.fields:
+        return None
+    return sorted({domain for domain in employees.column(EMPLOYEE_COMPANY_DOMAIN) if domain}) or None
+
+
+def draw_urls(rng: np.random.Generator, n: int, domains=None) -> pd.Series:
+    pool = get_pool()
+    domains = pick(rng, domains, n) if domains else pool.sample_many("domain", n, rng)
+    paths = pool.sample_many("uri_path", n, rng)
+    return "https://" + pd.Series(domains) + "/" + pd.Series(paths)
+
+
+def synthesize_outbound_browsing(employees: Registry, n: int, time_window: tuple,
+                                 rng: np.random.Generator, domains: "list[str]" = None) -> pd.DataFrame:
+    """
+    Employees browsing the websites of the Default actor
+    Random domains are used if the actor's domains are not given
+    """
+    who = rng.integers(0, len(employees), size=n)
+    return pd.DataFrame({
+        "timestamp": draw_timestamps(rng, n, time_window),
+        "method": np.where(rng.random(n) < 0.8, "GET", "POST"),
+        "src_ip": np.asarray(employees.column(EMPLOYEE_IP), dtype=object)[who],
+        "user_agent": np.asarray(employees.column(EMPLOYEE_USER_AGENT), dtype=object)[who],
+        "url": draw_urls(rng, n, domains),
+    }, columns=TABLE_COLUMNS[OUTBOUND_BROWSING_TABLE])
+
+
+def synthesize_inbound_browsing(n: int, time_window: tuple, rng: np.random.Generator,
+                                domains: "list[str]" = None) -> pd.DataFrame:
+    """
+    Visitors from the internet browsing the company's websites
+    Random domains are used if the company domains are not given
+    """
+    return pd.DataFrame({
+        "timestamp": draw_timestamps(rng, n, time_window),
+        "method": np.where(rng.random(n) < 0.9, "GET", "POST"),
+        "src_ip": get_pool().sample_many("ipv4", n, rng),
+        "user_agent": get_pool().sample_many("user_agent", n, rng),
+        "url": draw_urls(rng, n, domains),
+    }, columns=TABLE_COLUMNS[INBOUND_BROWSING_TABLE])
+
+
+def synthesize_auth_events(employees: Registry, n: int, time_window: tuple,
+                           rng: np.random.Generator, failure_rate: float = 0.05) -> pd.DataFrame:
+    """
+    Employees logging in to the mail server
+    """
+    who = rng.integers(0, len(employees), size=n)
+    failed = rng.random(n) < failure_rate
+    return pd.DataFrame({
+        "timestamp": draw_timestamps(rng, n, time_window),
+        "hostname": np.asarray(employees.column(EMPLOYEE_HOSTNAME), dtype=object)[who],
+        "src_ip": np.asarray(employees.column(EMPLOYEE_IP), dtype=object)[who],
+        "user_agent": np.asarray(employees.column(EMPLOYEE_USER_AGENT), dtype=object)[who],
+        "username": np.asarray(employees.column(EMPLOYEE_USERNAME), dtype=object)[who],
+        "result": np.where(failed, "Failed Login", "Successful Login"),
+        "description": np.where(failed, "User failed to login to the mail server",
+                                "User successfully logged in to the mail server"),
+    }, columns=TABLE_COLUMNS[AUTHENTICATION_TABLE])
@@ -0,0 +1,130 @@
+"""
+Password hashing on a bounded process pool
+
+PBKDF2 is meant to be slow, and run inline it holds the request thread (and the GIL)
+for the whole hash, so a burst of logins or registrations stalls every other request.
+Hashes and checks run on a pool of PASSWORD_HASH_PROCESSES worker processes (default 2,
+0 hashes inline). At most PASSWORD_HASH_MAX_CONCURRENT of them (default twice the
+processes) are queued or running at once; further callers wait up to
+PASSWORD_HASH_TIMEOUT seconds (default 10) for a slot and then get HashingBusy.
+
+New hashes use PASSWORD_HASH_METHOD (default "pbkdf2:sha256", werkzeug's default
+iterations), e.g. "pbkdf2:sha256:600000". Stored hashes made with another method are
+rehashed on the next successful login (see needs_rehash).
+"""
+import atexit
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from flask import current_app, has_app_context
+from werkzeug.security import check_password_hash, generate_password_hash, DEFAULT_PBKDF2_ITERATIONS
+
+from app.server.metrics import METRICS
+
+
+DEFAULT_METHOD = "pbkdf2:sha256"
+
+
+class HashingBusy(Exception):
+    """
+    No hashing slot became free within the timeout
+    """
+
+
+def normalize_method(method: str) -> str:
+    """
+    The method as it is written into a hash, "pbkdf2:sha256" -> "pbkdf2:sha256:260000"
+    """
+    if method.startswith("pbkdf2:") and method.count(":") == 1:
+        return f"{method}:{DEFAULT_PBKDF2_ITERATIONS}"
+    return method
+
+
+def needs_rehash(pw_hash: str, method: str = None) -> bool:
+    """
+    Whether the stored hash was made with another method (or cost) than the configured one
+    """
+    method = normalize_method(method or configured_method())
+    return pw_hash.split("$", 1)[0] != method
+
+
+class HashingPool():
+    """
+    Worker processes hashing passwords, with a cap on the jobs queued or running
+    """
+
+    def __init__(self, processes: int = 2, max_concurrent: int = None, timeout: float = 10):
+        self.processes = processes
+        self.max_concurrent = max_concurrent or processes * 2
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(self.max_concurrent)
+        # started on first use, so forked web workers each get their own
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.processes)
+            return self._executor
+
+    def run(self, fn, *args):
+        if not self._slots.acquire(timeout=self.timeout):
+            METRICS.increment("password_hash_busy")
+            raise HashingBusy(f"no password hashing slot free after {self.timeout}s")
+        try:
+            with METRICS.timer("password_hash_seconds", function=fn.__name__):
+                return self._get_executor().submit(fn, *args).result()
+        finally:
+            self._slots.release()
+
+    def shutdown(self) -> None:
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+
+
+# The pool of this process, created on first use (see get_pool)
+POOL = None
+
+
+def get_pool() -> "HashingPool":
+    """
+    The hashing pool, or None to hash inline (PASSWORD_HASH_PROCESSES = 0 or no app)
+    """
+    global POOL
+    if not has_app_context():
+        return POOL
+    if POOL is None:
+        config = current_app.config
+        processes = config.get("PASSWORD_HASH_PROCESSES", min(2, os.cpu_count() or 1))
+        if not processes:
+            return None
+        POOL = HashingPool(processes=processes,
+                           max_concurrent=config.get("PASSWORD_HASH_MAX_CONCURRENT"),
+                           timeout=config.get("PASSWORD_HASH_TIMEOUT", 10))
+        atexit.register(POOL.shutdown)
+    return POOL
+
+
+def configured_method() -> str:
+    if has_app_context():
+        return current_app.config.get("PASSWORD_HASH_METHOD", DEFAULT_METHOD)
+    return DEFAULT_METHOD
+
+
+def hash_password(password: str) -> str:
+    method = configured_method()
+    pool = get_pool()
+    if pool is None:
+        return generate_password_hash(password, method=method)
+    return pool.run(generate_password_hash, password, method)
+
+
+def verify_password(pw_hash: str, password: str) -> bool:
+    pool = get_pool()
+    if pool is None:
+        return check_password_hash(pw_hash, password)
+    return pool.run(check_password_hash, pw_hash, password)
@@ -0,0 +1,160 @@
+"""
+Opt-in per-request profiling
+
+When PROFILE_REQUESTS is set, every request records
+    - the number of SQL queries it ran and the time spent in the database
+    - the time spent rendering templates
+    - its total duration
+Requests slower than PROFILE_SLOW_REQUEST_SECONDS are printed and kept in SLOW_REQUESTS,
+which is shown on the /admin/slow_requests page.
+A sample of requests (PROFILE_SAMPLE_RATE) also runs under cProfile. If a sampled request
+turns out to be slow its profile is kept with it, and written to PROFILE_DIR when set.
+"""
+import cProfile
+import io
+import os
+import pstats
+import random
+import time
+from collections import deque
+from datetime import datetime
+
+from flask import g, request, has_request_context, before_render_template, template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from app.server.metrics import METRICS
+
+
+# the latest slow requests, newest last
+SLOW_REQUESTS = deque(maxlen=100)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context() and "profile_queries" in g:
+        conn.info.setdefault("profile_query_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context() and "profile_queries" in g:
+        starts = conn.info.get("profile_query_start")
+        if starts:
+            g.profile_db_seconds += time.perf_counter() - starts.pop()
+        g.profile_queries += 1
+
+
+def _before_render_template(app, template, context, **extra):
+    if has_request_context() and "profile_queries" in g:
+        g.profile_template_starts.append(time.perf_counter())
+
+
+def _template_rendered(app, template, context, **extra):
+    if has_request_context() and "profile_queries" in g and g.profile_template_starts:
+        started = g.profile_template_starts.pop()
+        # only count the outermost template, included ones are part of its time
+        if not g.profile_template_starts:
+            g.profile_template_seconds += time.perf_counter() - started
+        g.profile_templates.append(template.name)
+
+
+def _start_profiling():
+    g.profile_started = time.perf_counter()
+    g.profile_queries = 0
+    g.profile_db_seconds = 0.0
+    g.profile_template_seconds = 0.0
+    g.profile_template_starts = []
+    g.profile_templates = []
+    g.profiler = None
+    if random.random() < g.profile_settings["sample_rate"]:
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+            g.profiler = profiler
+        except ValueError:
+            # another profiler is already running (e.g. in a concurrent request)
+            pass
+
+
+def _profile_text(profiler: cProfile.Profile, limit: int = 40) -> str:
+    out = io.StringIO()
+    pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(limit)
+    return out.getvalue()
+
+
+def _finish_profiling(response):
+    if "profile_queries" not in g:
+        return response
+    seconds = time.perf_counter() - g.profile_started
+    profiler = g.profiler
+    if profiler:
+        profiler.disable()
+
+    endpoint = request.endpoint or "unknown"
+    METRICS.observe("request_seconds", seconds, endpoint=endpoint)
+    METRICS.observe("request_db_seconds", g.profile_db_seconds, endpoint=endpoint)
+    METRICS.increment("request_queries", g.profile_queries, endpoint=endpoint)
+
+    settings = g.profile_settings
+    if seconds >= settings["slow_seconds"]:
+        record = {
+            "time": datetime.now(),
+            "method": request.method,
+            "path": request.full_path.rstrip("?"),
+            "endpoint": endpoint,
+            "status": response.status_code,
+            "seconds": seconds,
+            "queries": g.profile_queries,
+            "db_seconds": g.profile_db_seconds,
+            "template_seconds": g.profile_template_seconds,
+            "templates": list(g.profile_templates),
+            "profile": None,
+        }
+        if profiler:
+            record["profile"] = _profile_text(profiler)
+            if settings["directory"]:
+                os.makedirs(settings["directory"], exist_ok=True)
+                filename = f"{record['time']:%Y%m%d-%H%M%S-%f}-{endpoint}.prof"
+                profiler.dump_stats(os.path.join(settings["directory"], filename))
+        SLOW_REQUESTS.append(record)
+        print(f"slow request: {record['method']} {record['path']} took {seconds:.3f}s "
+              f"({record['queries']} queries in {record['db_seconds']:.3f}s, "
+              f"templates {record['template_seconds']:.3f}s)")
+    return response
+
+
+def _stop_profiler(exception):
+    # after_request is skipped when the view raised, don't leave the profiler running
+    profiler = g.get("profiler")
+    if profiler:
+        profiler.disable()
+
+
+def init_profiling(app) -> bool:
+    """
+    Register the profiling hooks on the app if PROFILE_REQUESTS is set
+    Returns whether profiling is enabled
+    """
+    if not app.config.get("PROFILE_REQUESTS", False):
+        return False
+
+    settings = {
+        "slow_seconds": app.config.get("PROFILE_SLOW_REQUEST_SECONDS", 0.5),
+        "sample_rate": app.config.get("PROFILE_SAMPLE_RATE", 0.1),
+        "directory": app.config.get("PROFILE_DIR"),
+    }
+
+    @app.before_request
+    def start_profiling():
+        g.profile_settings = settings
+        _start_profiling()
+
+    app.after_request(_finish_profiling)
+    app.teardown_request(_stop_profiler)
+
+    # listen on every engine, including the ones of other binds
+    event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+    before_render_template.connect(_before_render_template, app)
+    template_rendered.connect(_template_rendered, app)
+    print(f"Request profiling enabled, slow requests take over {settings['slow_seconds']}s")
+    return True
@@ -0,0 +1,228 @@
+"""
+Token bucket rate limiting for routes that are worth brute forcing (/solve, /login)
+
+Every client gets a bucket per route that holds up to `burst` tokens and refills at
+`rate` tokens per second. A request takes a token; when the bucket is empty the
+request is rejected with a 429 before the view runs, so no database lookup or
+password hashing happens. Logged in users are limited per user, everyone else per IP,
+or per IP and submitted form field for routes that name one (/login is limited per
+IP and username, so players sharing a classroom NAT don't share a bucket).
+A view can have several limits. /login also has a looser bucket per IP ("login_ip"),
+so one address can't spray passwords over many usernames, and an opt-in bucket per
+username whatever the IP ("login_user").
+
+Behind a reverse proxy every request comes from the proxy's address. Set PROXY_FIX_X_FOR
+to the number of proxies in front of the app to take the client IP from X-Forwarded-For;
+only do so when those proxies set the header, clients can forge it otherwise.
+
+Limits are set per name in RATE_LIMITS, e.g. {"solve": "30/minute", "login": "10/minute"},
+as "<requests>/<second|minute|hour>" or None for no limit. RATE_LIMIT_ENABLED turns
+limiting off entirely.
+
+Buckets live in this process (RATE_LIMIT_STORAGE = "memory", the default) or in the
+Flask-Caching backend (RATE_LIMIT_STORAGE = "cache") so several workers share them.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app, request, session, jsonify
+from werkzeug.middleware.proxy_fix import ProxyFix
+
+from app.server.metrics import METRICS
+
+
+DEFAULT_RATE_LIMITS = {
+    "solve": "30/minute",
+    "login": "10/minute",
+    # a classroom behind one NAT address logs in through this bucket
+    "login_ip": "100/minute",
+    # off by default, anyone could lock a player out by failing their login
+    "login_user": None,
+}
+
+PERIODS = {"second": 1, "minute": 60, "hour": 3600}
+
+
+def parse_limit(limit: str) -> "tuple[float, int]":
+    """
+    "10/minute" -> (refill rate per second, burst)
+    """
+    count, period = limit.split("/")
+    count = int(count)
+    return count / PERIODS[period.strip()], count
+
+
+class MemoryStore():
+    """
+    Buckets kept in this process as key -> (tokens, last update)
+    Buckets that are full again are swept every sweep_interval seconds and the least
+    recently used ones are dropped beyond max_buckets, so memory stays bounded
+    """
+
+    def __init__(self, sweep_interval: float = 60, max_buckets: int = 100000, clock=time.monotonic):
+        self.sweep_interval = sweep_interval
+        self.max_buckets = max_buckets
+        self.clock = clock
+        self.buckets = OrderedDict()
+        # key -> time at which the bucket is full again
+        self._full_at = {}
+        self._lock = threading.Lock()
+        self._next_sweep = clock() + sweep_interval
+
+    def take(self, key: str, rate: float, burst: int) -> float:
+        """
+        Take a token from the bucket
+        Returns 0 if the request is allowed, otherwise the seconds until a token is available
+        """
+        now = self.clock()
+        with self._lock:
+            if now >= self._next_sweep:
+                self._sweep(now)
+            tokens, updated = self.buckets.pop(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            if tokens >= 1:
+                tokens -= 1
+                wait = 0
+            else:
+                wait = (1 - tokens) / rate
+            self.buckets[key] = (tokens, now)
+            self._full_at[key] = now + (burst - tokens) / rate
+            if len(self.buckets) > self.max_buckets:
+                oldest, _ = self.buckets.popitem(last=False)
+                del self._full_at[oldest]
+            return wait
+
+    def _sweep(self, now: float) -> None:
+        # a full bucket is the same as no bucket
+        for key in [key for key, full_at in self._full_at.items() if full_at <= now]:
+            del self.buckets[key]
+            del self._full_at[key]
+        self._next_sweep = now + self.sweep_interval
+
+    def __len__(self) -> int:
+        return len(self.buckets)
+
+
+class CacheStore():
+    """
+    Buckets kept in the Flask-Caching backend, shared by every worker using it
+    Updates are not atomic, concurrent requests of one client may both get the last token
+    """
+
+    def __init__(self, cache, prefix: str = "rate_limit:", clock=time.time):
+        self.cache = cache
+        self.prefix = prefix
+        self.clock = clock
+
+    def take(self, key: str, rate: float, burst: int) -> float:
+        now = self.clock()
+        tokens, updated = self.cache.get(self.prefix + key) or (burst, now)
+        tokens = min(burst, tokens + (now - updated) * rate)
+        if tokens >= 1:
+            tokens -= 1
+            wait = 0
+        else:
+            wait = (1 - tokens) / rate
+        # the entry expires once the bucket is full again
+        self.cache.set(self.prefix + key, (tokens, now), timeout=int((burst - tokens) / rate) + 1)
+        return wait
+
+
+# The store of this process, created on first use (see get_store)
+STORE = None
+
+
+def get_store():
+    global STORE
+    if STORE is None:
+        if current_app.config.get("RATE_LIMIT_STORAGE", "memory") == "cache":
+            from app import cache
+            STORE = CacheStore(cache)
+        else:
+            STORE = MemoryStore(sweep_interval=current_app.config.get("RATE_LIMIT_SWEEP_SECONDS", 60),
+                                max_buckets=current_app.config.get("RATE_LIMIT_MAX_BUCKETS", 100000))
+    return STORE
+
+
+def client_key(field: str = None, per_ip: bool = True) -> str:
+    """
+    The logged in user (read from the session cookie, without loading the user) or the IP,
+    with the value of the given form field if there is one
+    per_ip=False keys anonymous clients on the form field alone
+    """
+    user_id = session.get("_user_id")
+    if user_id:
+        return f"user:{user_id}"
+    value = request.form.get(field, '').strip().lower() if field else None
+    if not per_ip:
+        return f"{field}:{value}"
+    if field:
+        return f"ip:{request.remote_addr}:{field}:{value}"
+    return f"ip:{request.remote_addr}"
+
+
+def rate_limited(name: str, methods: tuple = None, field: str = None, per_ip: bool = True):
+    """
+    Decorator limiting a view to the RATE_LIMITS entry called name
+    Only requests with one of the given methods are counted (all of them by default)
+    Anonymous clients get a bucket per IP and value of the form field, if given,
+    or per value of the form field alone with per_ip=False
+    Stack the decorator to check several limits, a request must get a token from each of them
+    The limits are checked by init_rate_limiting's before_request hook, before the
+    logged in user is loaded
+    """
+    def decorator(f):
+        f.rate_limits = [(name, methods, field, per_ip)] + getattr(f, "rate_limits", [])
+        return f
+    return decorator
+
+
+def check_rate_limit():
+    """
+    Reject the request with a 429 if the view is rate limited and one of the client's buckets is empty
+    """
+    view = current_app.view_functions.get(request.endpoint)
+    config = current_app.config
+    if not hasattr(view, "rate_limits") or not config.get("RATE_LIMIT_ENABLED", True):
+        return None
+    limits = {**DEFAULT_RATE_LIMITS, **(config.get("RATE_LIMITS") or {})}
+    for name, methods, field, per_ip in view.rate_limits:
+        limit = limits.get(name)
+        if not limit or (methods and request.method not in methods):
+            continue
+        rate, burst = parse_limit(limit)
+        wait = get_store().take(f"{name}:{client_key(field, per_ip)}", rate, burst)
+        if wait:
+            return too_many_attempts(name, wait)
+    return None
+
+
+def too_many_attempts(name: str, wait: float):
+    """
+    The 429 response of a request rejected by the name limit, retry after wait seconds
+    """
+    METRICS.increment("rate_limited", route=name)
+    response = jsonify(error="Too many attempts, slow down", retry_after=round(wait, 1))
+    response.status_code = 429
+    response.headers["Retry-After"] = str(int(wait) + 1)
+    return response
+
+
+def trust_proxies(app) -> None:
+    """
+    Take the client IP from the X-Forwarded-For of the PROXY_FIX_X_FOR proxies in front of the app
+    """
+    proxies = app.config.get("PROXY_FIX_X_FOR", 0)
+    if proxies:
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=proxies)
+        print(f"Client IPs are read from X-Forwarded-For, {proxies} trusted proxies")
+
+
+def init_rate_limiting(app) -> None:
+    """
+    Register the rate limit check
+    Must run before Flask-Security is set up so the check comes before loading the user
+    """
+    trust_proxies(app)
+    app.before_request(check_rate_limit)
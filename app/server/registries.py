@@ -0,0 +1,105 @@
+"""
+Read-only snapshots of game objects for the generators
+
+The generators pick random employees thousands of times per cycle.
+Handing them ORM objects means every pick goes through the session identity map
+and SQLAlchemy's attribute instrumentation. A registry loads the columns of a model
+once, with a plain column query, and keeps each row as a namedtuple.
+Records expose the same attribute names as the model columns (employee.username, employee.ip_addr, ...).
+Anything else a generator reads from a record of a model registry (methods, relationships,
+_private columns) comes from the ORM object with the record's id, loaded on first use
+through the session. That path is as slow as before, the columns are what should be hot.
+"""
+import random
+from collections import namedtuple
+
+from sqlalchemy import inspect
+
+from app.server.models import db
+
+
+def _record_instance(record):
+    """
+    The ORM object a record was read from
+    """
+    return db.session.get(record.model, record.id)
+
+
+def _record_getattr(record, attr: str):
+    # only called for names that aren't fields of the record
+    if attr.startswith("__"):
+        raise AttributeError(attr)
+    instance = record.instance()
+    if instance is None:
+        raise AttributeError(f"{record.model.__name__} {record.id} no longer exists, it has no {attr}")
+    return getattr(instance, attr)
+
+
+class Registry():
+    """
+    An immutable, indexable collection of records
+    Supports len(), iteration and indexing, so random.choice(registry) works like on a list
+    """
+    __slots__ = ("name", "fields", "records", "_index_by_id", "_columns")
+
+    def __init__(self, name: str, fields: "list[str]", rows, model=None):
+        self.name = name
+        self.fields = tuple(fields)
+        record_type = namedtuple(f"{name}Record", self.fields)
+        if model is not None and "id" in self.fields:
+            record_type = type(record_type.__name__, (record_type,), {
+                "__slots__": (),
+                "model": model,
+                "instance": _record_instance,
+                "__getattr__": _record_getattr,
+            })
+        self.records = tuple(record_type._make(row) for row in rows)
+        self._index_by_id = None
+        self._columns = {}
+
+    @classmethod
+    def from_model(cls, model) -> "Registry":
+        """
+        Snapshot every row of a model
+        Private columns (prefixed with _) are left out
+        """
+        fields = [attr.key for attr in inspect(model).column_attrs if not attr.key.startswith("_")]
+        query = db.session.query(*[getattr(model, field) for field in fields])
+        if "id" in fields:
+            query = query.order_by(model.id)
+        return cls(model.__name__, fields, query, model=model)
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def __iter__(self):
+        return iter(self.records)
+
+    def __getitem__(self, index):
+        return self.records[index]
+
+    def __repr__(self):
+        return f"<Registry {self.name} ({len(self.records)} records)>"
+
+    def get(self, record_id):
+        """
+        Look up a record by id
+        """
+        if self._index_by_id is None:
+            self._index_by_id = {record.id: record for record in self.records}
+        return self._index_by_id.get(record_id)
+
+    def column(self, field: str) -> tuple:
+        """
+        All values of one field, in record order
+        """
+        if field not in self._columns:
+            position = self.fields.index(field)
+            self._columns[field] = tuple(record[position] for record in self.records)
+        return self._columns[field]
+
+    def sample(self, k: int, rng=random) -> list:
+        """
+        Pick k records at random, with replacement
+        """
+        return rng.choices(self.records, k=k)
@@ -0,0 +1,128 @@
+"""
+Employee reports of the emails the game sends
+
+Every team defends its own copy of the company, and its employees report each generated
+email with a probability equal to the team's security awareness. Reports are drawn for all
+the emails of a generator run at once, by generate_activity right after the email generator,
+and inserted REPORT_BATCH_SIZE rows (default 1000) per statement.
+Offline dataset builds turn CREATE_REPORTS off, the game database then gets no reports.
+
+Reports are read newest first, a page at a time, with keyset pagination on
+(team_id, time, id) so the page cost doesn't grow with the number of reports.
+"""
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+from flask import current_app, has_app_context
+from sqlalchemy import and_, or_, event
+from sqlalchemy.orm import Session
+
+from app.server.metrics import METRICS
+from app.server.models import db, Team, Report
+
+
+# table the game writes its emails to, and the Email column each report field comes from
+EMAIL_TABLE = "Email"
+EMAIL_COLUMNS = {"time": "timestamp", "subject": "subject", "sender": "sender", "recipient": "recipient"}
+
+# longest value the String(50) report columns hold
+MAX_FIELD_LENGTH = 50
+
+# cleared by start_game for offline builds, which must not write game state
+CREATE_REPORTS = True
+
+# Report objects built so far by this process, generate_activity doesn't draw reports
+# for the emails of a generator run that already created its own
+ORM_REPORTS = 0
+
+
+@event.listens_for(Report, "init")
+def count_report(target, args, kwargs) -> None:
+    global ORM_REPORTS
+    ORM_REPORTS += 1
+
+
+@event.listens_for(Session, "before_flush")
+def drop_reports(session, flush_context, instances) -> None:
+    """
+    Reports added to a session (e.g. by the email generator) are dropped while CREATE_REPORTS is off
+    """
+    if not CREATE_REPORTS:
+        for report in [instance for instance in session.new if isinstance(instance, Report)]:
+            # out of the team's pending reports too, or the flush would add it back
+            if report.team is not None:
+                report.team.reports.remove(report)
+            session.expunge(report)
+
+
+def draw_reports(emails: pd.DataFrame, teams: "list[tuple[int, float]]", rng: np.random.Generator) -> "list[dict]":
+    """
+    The reports of every (team id, security awareness) pair for a batch of emails
+    """
+    if emails.empty or not teams:
+        return []
+    fields = {field: emails[column] for field, column in EMAIL_COLUMNS.items()}
+    times = pd.to_datetime(fields.pop("time")).dt.to_pydatetime()
+    fields = {field: values.astype(str).str.slice(0, MAX_FIELD_LENGTH).to_numpy()
+              for field, values in fields.items()}
+
+    rows = []
+    for team_id, awareness in teams:
+        reported = np.flatnonzero(rng.random(len(emails)) < awareness)
+        rows.extend({"team_id": team_id, "time": times[i], "subject": fields["subject"][i],
+                     "sender": fields["sender"][i], "recipient": fields["recipient"][i]}
+                    for i in reported)
+    return rows
+
+
+def write_reports(rows: "list[dict]", batch_size: int = 1000) -> None:
+    """
+    Insert reports batch_size rows per statement and commit them
+    """
+    for start in range(0, len(rows), batch_size):
+        db.session.execute(Report.__table__.insert(), rows[start:start + batch_size])
+    db.session.commit()
+    METRICS.increment("reports_created", len(rows))
+
+
+def create_reports(emails: pd.DataFrame, rng: np.random.Generator = None) -> int:
+    """
+    Draw and store the reports of every team for a batch of emails
+    Returns the number of reports created
+    """
+    if not CREATE_REPORTS:
+        return 0
+    # the admin team doesn't play
+    teams = db.session.query(Team.id, Team.security_awareness).filter(Team.id != 1).all()
+    # reports aren't part of the seeded game data, they only need to be random
+    rows = draw_reports(emails, teams, rng or np.random.default_rng())
+    if rows:
+        batch_size = current_app.config.get("REPORT_BATCH_SIZE", 1000) if has_app_context() else 1000
+        write_reports(rows, batch_size=batch_size)
+    return len(rows)
+
+
+def page_cursor(report) -> str:
+    """
+    Cursor of the page after this report
+    """
+    return f"{report.time.isoformat()}_{report.id}"
+
+
+def reports_page(team_id: int, before: str = None, per_page: int = 50) -> "tuple[list[Report], str]":
+    """
+    A page of the team's reports, newest first, starting after the before cursor
+    Returns the reports and the cursor of the next page (None on the last page)
+    Raises ValueError for a malformed cursor
+    """
+    query = Report.query.filter(Report.team_id == team_id)
+    if before:
+        time, _, report_id = before.rpartition("_")
+        time, report_id = datetime.fromisoformat(time), int(report_id)
+        query = query.filter(or_(Report.time < time, and_(Report.time == time, Report.id < report_id)))
+    # one extra row tells whether there is a next page
+    reports = query.order_by(Report.time.desc(), Report.id.desc()).limit(per_page + 1).all()
+    if len(reports) > per_page:
+        return reports[:per_page], page_cursor(reports[per_page - 1])
+    return reports, None
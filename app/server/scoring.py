@@ -0,0 +1,399 @@
+"""
+Scoring of team deny lists against the game's malicious indicators
+
+A team earns MITIGATION_POINTS (default 100) for every active malicious indicator its
+deny list covers. IPs and file hashes have to be blocked exactly, blocking a domain also
+covers its subdomains (evil.com covers mail.evil.com). Only registered domains and their
+subdomains count: blocking a top level domain or public suffix (com, co.uk) would block
+every site under it, so such entries cover nothing.
+
+The malicious indicators are kept in memory: IPs and hashes in sets, domains in a trie
+keyed by their reversed labels (com -> evil -> mail) whose nodes count the malicious
+domains at or below them, so what a deny list entry covers is read off a single node.
+
+Scores are updated incrementally
+    - a team changing its deny list gets its own score recomputed (rescore_team) against
+      freshly loaded indicators
+    - indicators turning active or inactive (sync_indicators, run by the game loop) move
+      the scores of the teams blocking them, found through the indicator index
+A score rewritten by rescore_team (in the web process) already counts whatever the
+indicators were at that moment, so adding the next sync's changes to it would count
+some of them twice. rescore_team flags the team (Team.rescored) and the next sync scores
+flagged teams from scratch instead of moving their score.
+rescore_all recomputes every team from scratch, the game loop runs it every
+MITIGATION_RESCORE_SECONDS so the two kinds of updates can't drift apart.
+"""
+import ipaddress
+import time
+
+from flask import current_app
+
+from app.server.metrics import METRICS
+from app.server.models import db, Team, TeamMitigation, normalize_indicator, chunks
+
+
+# md5, sha1 and sha256
+HASH_LENGTHS = (32, 40, 64)
+HEX_DIGITS = frozenset("0123456789abcdef")
+
+# public suffixes of more than one label, under which anyone can register a domain
+# single labels (com, net, uk, ...) are all treated as public suffixes
+PUBLIC_SUFFIXES = frozenset([
+    "co.uk", "org.uk", "ac.uk", "gov.uk", "me.uk", "ltd.uk", "plc.uk", "net.uk",
+    "com.au", "net.au", "org.au", "edu.au", "gov.au",
+    "co.nz", "org.nz", "net.nz", "co.za", "org.za", "co.jp", "ne.jp", "or.jp", "ac.jp",
+    "co.in", "net.in", "org.in", "co.kr", "or.kr", "com.br", "net.br", "org.br",
+    "com.cn", "net.cn", "org.cn", "com.mx", "com.ar", "com.tr", "com.tw", "com.hk",
+    "com.sg", "com.my", "co.id", "co.il", "com.ru", "com.ua", "com.pl", "co.at",
+    "github.io", "herokuapp.com", "blogspot.com", "appspot.com", "cloudfront.net",
+    "azurewebsites.net", "s3.amazonaws.com", "duckdns.org", "no-ip.org", "ngrok.io",
+])
+
+
+def indicator_kind(indicator: str) -> str:
+    """
+    "ip", "hash" or "domain"
+    """
+    # only parse what could be an address, the exception is slow
+    if indicator[:1].isdigit() or ":" in indicator:
+        try:
+            ipaddress.ip_address(indicator)
+            return "ip"
+        except ValueError:
+            pass
+    if len(indicator) in HASH_LENGTHS and HEX_DIGITS.issuperset(indicator):
+        return "hash"
+    return "domain"
+
+
+def domain_labels(domain: str) -> tuple:
+    """
+    "mail.evil.com" -> ("com", "evil", "mail")
+    """
+    return tuple(reversed(domain.strip(".").split(".")))
+
+
+def domain_suffixes(domain: str) -> "list[str]":
+    """
+    The domains whose blocking covers this one, "mail.evil.com" -> ["mail.evil.com", "evil.com"]
+    Public suffixes (com) don't cover anything
+    """
+    labels = domain.strip(".").split(".")
+    suffixes = (".".join(labels[i:]) for i in range(len(labels)))
+    return [suffix for suffix in suffixes if not is_public_suffix(suffix)]
+
+
+def is_public_suffix(domain: str) -> bool:
+    """
+    Whether blocking the domain would block sites registered by unrelated parties
+    """
+    return "." not in domain or domain in PUBLIC_SUFFIXES
+
+
+def _parent_blocked(domain: str, blocked: set) -> bool:
+    # blocking a parent domain already covers this one
+    parent = domain
+    while True:
+        _, dot, parent = parent.partition(".")
+        if not dot:
+            return False
+        if parent in blocked:
+            return True
+
+
+class DomainTrie():
+    """
+    Domains keyed by their reversed labels
+    Every node is [domains at or below it, whether it is a domain itself, children]
+    """
+
+    def __init__(self):
+        self.root = [0, False, {}]
+
+    def add(self, domain: str) -> bool:
+        node = self.root
+        path = [node]
+        for label in domain_labels(domain):
+            children = node[2]
+            node = children.get(label)
+            if node is None:
+                node = children[label] = [0, False, {}]
+            path.append(node)
+        if node[1]:
+            return False
+        node[1] = True
+        for parent in path:
+            parent[0] += 1
+        return True
+
+    def remove(self, domain: str) -> bool:
+        node = self.root
+        path = [(None, node)]
+        for label in domain_labels(domain):
+            node = node[2].get(label)
+            if node is None:
+                return False
+            path.append((label, node))
+        if not node[1]:
+            return False
+        node[1] = False
+        for i, (label, parent) in enumerate(path):
+            parent[0] -= 1
+            # drop the branch that no longer holds any domain
+            if parent[0] == 0 and label is not None:
+                del path[i - 1][1][2][label]
+                break
+        return True
+
+    def covered(self, domain: str) -> int:
+        """
+        The number of domains equal to or below the given one
+        """
+        node = self.root
+        for label in reversed(domain.split(".")):
+            node = node[2].get(label)
+            if node is None:
+                return 0
+        return node[0]
+
+    def __len__(self) -> int:
+        return self.root[0]
+
+
+class MitigationScorer():
+    """
+    The active malicious indicators and the scores of deny lists against them
+    source returns the active indicators (load_active_indicators by default), they are
+    loaded again when older than max_age seconds
+    """
+
+    def __init__(self, points: int = 100, source=None, max_age: float = 5, clock=time.monotonic):
+        self.points = points
+        self.source = source or load_active_indicators
+        self.max_age = max_age
+        self.clock = clock
+        self.active = set()
+        self.ips = set()
+        self.hashes = set()
+        self.domains = DomainTrie()
+        self.loaded_at = None
+        # the indicators as of the last sync_indicators, None before the first one
+        self.synced = None
+
+    def _set_for(self, kind: str) -> set:
+        return self.ips if kind == "ip" else self.hashes
+
+    def add_indicator(self, indicator: str) -> bool:
+        if indicator in self.active:
+            return False
+        self.active.add(indicator)
+        kind = indicator_kind(indicator)
+        if kind == "domain":
+            self.domains.add(indicator)
+        else:
+            self._set_for(kind).add(indicator)
+        return True
+
+    def remove_indicator(self, indicator: str) -> bool:
+        if indicator not in self.active:
+            return False
+        self.active.discard(indicator)
+        kind = indicator_kind(indicator)
+        if kind == "domain":
+            self.domains.remove(indicator)
+        else:
+            self._set_for(kind).discard(indicator)
+        return True
+
+    def load(self, indicators) -> None:
+        """
+        Replace the active indicators, without touching any score
+        """
+        self.active = set()
+        self.ips, self.hashes, self.domains = set(), set(), DomainTrie()
+        for indicator in indicators:
+            self.add_indicator(normalize_indicator(indicator))
+        self.loaded_at = self.clock()
+
+    def ensure_loaded(self) -> None:
+        if self.loaded_at is None or self.clock() - self.loaded_at > self.max_age:
+            self.load(self.source())
+
+    def covered(self, deny_list) -> int:
+        """
+        The number of active indicators the deny list blocks, each counted once
+        """
+        count = 0
+        blocked_domains = set()
+        for indicator in deny_list:
+            if indicator in self.ips or indicator in self.hashes:
+                count += 1
+            else:
+                # anything else only matches in the domain trie, no need to tell kinds apart
+                domain = indicator.strip(".")
+                if not is_public_suffix(domain):
+                    blocked_domains.add(domain)
+        for domain in blocked_domains:
+            covered = self.domains.covered(domain)
+            if covered and not _parent_blocked(domain, blocked_domains):
+                count += covered
+        return count
+
+    def score(self, deny_list) -> int:
+        return self.covered(deny_list) * self.points
+
+    def score_teams(self, deny_lists: dict) -> dict:
+        """
+        team id -> deny list  to  team id -> score
+        """
+        return {team_id: self.score(deny_list) for team_id, deny_list in deny_lists.items()}
+
+    def rescore_team(self, team: Team) -> int:
+        """
+        Recompute the score of a team whose deny list changed, the caller commits
+        The score is written as a whole, so it is computed against the current indicators
+        rather than ones up to max_age seconds old
+        The team is flagged so the next sync_indicators doesn't move the new score again
+        """
+        self.load(self.source())
+        team.score = self.score(team.get_deny_list())
+        team.rescored = True
+        return team.score
+
+    def rescore_all(self) -> dict:
+        """
+        Recompute the score of every team from scratch, the caller commits
+        """
+        with METRICS.timer("mitigation_rescore_seconds"):
+            self.ensure_loaded()
+            scores = self.score_teams(_deny_lists())
+            db.session.bulk_update_mappings(Team, [{"id": team_id, "score": score, "rescored": False}
+                                                   for team_id, score in scores.items()])
+        return scores
+
+    def sync_indicators(self, indicators=None) -> dict:
+        """
+        Catch up with the active indicators (from source unless given) and move the score
+        of every team blocking one that turned active or inactive, the caller commits
+        Only one process (the game loop) should sync, or the changes are counted twice
+        Returns team id -> score change
+        """
+        current = {normalize_indicator(indicator) for indicator in
+                   (indicators if indicators is not None else self.source())}
+        if self.synced is None:
+            # nothing to diff against, the stored scores may be from another process
+            self.load(current)
+            self.rescore_all()
+            self.synced = current
+            return {}
+        # diffed against the last sync, rescore_team may have reloaded the indicators since
+        activated = current - self.synced
+        deactivated = self.synced - current
+        self.synced = current
+        for indicator in current - self.active:
+            self.add_indicator(indicator)
+        for indicator in self.active - current:
+            self.remove_indicator(indicator)
+        self.loaded_at = self.clock()
+
+        changes = {}
+        for indicators, sign in ((activated, 1), (deactivated, -1)):
+            for team_id, count in _teams_blocking(indicators).items():
+                changes[team_id] = changes.get(team_id, 0) + sign * count * self.points
+
+        # teams rescored since the last sync already count some of the changes, score them from scratch
+        rescored = dict(db.session.query(Team.id, Team.score).filter(Team.rescored == True))
+        for team_id, score in self.score_teams(_deny_lists(list(rescored))).items():
+            changes[team_id] = score - rescored[team_id]
+            # unless the team was rescored again meanwhile
+            Team.query.filter(Team.id == team_id, Team.rescored == True).update(
+                {Team.score: score, Team.rescored: False}, synchronize_session=False)
+        changes = {team_id: change for team_id, change in changes.items() if change}
+
+        # one UPDATE per distinct change, applied in the database so concurrent rescores aren't lost
+        by_change = {}
+        for team_id, change in changes.items():
+            if team_id not in rescored:
+                by_change.setdefault(change, []).append(team_id)
+        for change, team_ids in by_change.items():
+            for chunk in chunks(team_ids):
+                # a team rescored since the query above keeps the score it was given
+                Team.query.filter(Team.id.in_(chunk), Team.rescored.isnot(True)).update(
+                    {Team.score: Team.score + change}, synchronize_session=False)
+        if activated or deactivated:
+            METRICS.increment("mitigation_indicator_changes", len(activated) + len(deactivated))
+            print(f"{len(activated)} indicators activated, {len(deactivated)} deactivated, "
+                  f"{len(changes)} team scores changed")
+        return changes
+
+
+def _deny_lists(team_ids: "list[int]" = None) -> dict:
+    """
+    team id -> deny list, for the given teams or every team
+    """
+    if team_ids is None:
+        deny_lists = {team_id: [] for team_id, in db.session.query(Team.id)}
+        for team_id, indicator in db.session.query(TeamMitigation.team_id, TeamMitigation.indicator):
+            deny_lists.setdefault(team_id, []).append(indicator)
+        return deny_lists
+    deny_lists = {team_id: [] for team_id in team_ids}
+    for chunk in chunks(team_ids):
+        rows = (
+            db.session.query(TeamMitigation.team_id, TeamMitigation.indicator)
+            .filter(TeamMitigation.team_id.in_(chunk))
+        )
+        for team_id, indicator in rows:
+            deny_lists[team_id].append(indicator)
+    return deny_lists
+
+
+def _teams_blocking(indicators) -> dict:
+    """
+    team id -> how many of the indicators its deny list covers
+    A team blocking a domain and its parent still counts the domain once
+    """
+    covering = {}
+    for indicator in indicators:
+        if indicator_kind(indicator) == "domain":
+            for suffix in domain_suffixes(indicator):
+                covering.setdefault(suffix, set()).add(indicator)
+        else:
+            covering.setdefault(indicator, set()).add(indicator)
+
+    covered_by_team = {}
+    for chunk in chunks(list(covering)):
+        rows = (
+            db.session.query(TeamMitigation.team_id, TeamMitigation.indicator)
+            .filter(TeamMitigation.indicator.in_(chunk))
+        )
+        for team_id, blocked in rows:
+            covered_by_team.setdefault(team_id, set()).update(covering[blocked])
+    return {team_id: len(covered) for team_id, covered in covered_by_team.items()}
+
+
+def load_active_indicators() -> set:
+    """
+    The domains and IPs of the active malicious DNS records and the malware hashes
+    """
+    from app.server.modules.infrastructure.DNSRecord import DNSRecord
+    from app.server.modules.file.vt_seed_files import FILES_MALICIOUS_VT_SEED_HASHES
+
+    indicators = {normalize_indicator(hash) for hash in FILES_MALICIOUS_VT_SEED_HASHES}
+    for domain, ip in db.session.query(DNSRecord.domain, DNSRecord.ip).filter(DNSRecord.active == True):
+        if domain:
+            indicators.add(normalize_indicator(domain))
+        if ip:
+            indicators.add(normalize_indicator(ip))
+    return indicators
+
+
+# The scorer of this process, created on first use (see get_scorer)
+SCORER = None
+
+
+def get_scorer() -> "MitigationScorer":
+    global SCORER
+    if SCORER is None:
+        SCORER = MitigationScorer(points=current_app.config.get("MITIGATION_POINTS", 100),
+                                  max_age=current_app.config.get("MITIGATION_INDICATORS_MAX_AGE", 5))
+    return SCORER
@@ -0,0 +1,155 @@
+"""
+Group commit of solve submissions
+
+With SOLVE_GROUP_COMMIT enabled, /solve hands correct answers to a background writer
+instead of committing them itself. The writer inserts the solves that queued up while
+it was committing, plus those submitted within SOLVE_BATCH_WAIT_MS milliseconds (at most
+SOLVE_BATCH_SIZE in all), in one transaction. A burst of submissions costs one commit
+(one fsync on SQLite) per batch instead of one per solve, and a lone solve is committed
+right away.
+A submitter waits until the transaction holding its solve has committed, so a solve is
+only reported as correct once it is committed. How durable a commit is depends on the
+database (on SQLite, see SQLITE_SYNCHRONOUS).
+A submitter gives up after SOLVE_SUBMIT_TIMEOUT seconds (default 5) and takes its solve
+off the queue, so submitting it again doesn't store it twice. A solve the writer is
+already inserting can't be taken back, its submitter waits for the insert instead.
+"""
+import atexit
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError
+
+from app.server.models import db, Solves
+
+
+class SolveWriter():
+    """
+    Background thread inserting queued solves in batches
+    """
+
+    def __init__(self, app, max_batch: int = 100, max_wait: float = 0.005, timeout: float = 5):
+        self.app = app
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.timeout = timeout
+        self.queue = queue.Queue()
+        self.batches = 0
+        self.solves = 0
+        self._stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="solve-writer", daemon=True)
+
+    def start(self) -> "SolveWriter":
+        self.thread.start()
+        return self
+
+    def stop(self) -> None:
+        """
+        Commit what is queued and stop the thread
+        """
+        self._stopped.set()
+        self.thread.join()
+
+    def submit(self, challenge_id: int, user_id: int, username: str) -> None:
+        """
+        Queue a solve and wait for the batch holding it to commit
+        Raises the error of the insert if the solve could not be stored, and TimeoutError
+        if it was still queued after timeout seconds (it is then dropped, not stored)
+        """
+        future = Future()
+        self.queue.put(({"challenge_id": challenge_id, "user_id": user_id, "username": username}, future))
+        try:
+            future.result(timeout=self.timeout)
+        except TimeoutError:
+            if future.cancel():
+                raise
+            # the writer is inserting it, wait for the outcome
+            future.result()
+
+    def _next_batch(self) -> list:
+        try:
+            batch = [self.queue.get(timeout=0.1)]
+        except queue.Empty:
+            return []
+        # take what queued up during the previous commit
+        while len(batch) < self.max_batch and not self.queue.empty():
+            batch.append(self.queue.get_nowait())
+        # a lone solve is committed right away, under load wait a moment for more
+        if len(batch) == 1:
+            return batch
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self) -> None:
+        with self.app.app_context():
+            while not (self._stopped.is_set() and self.queue.empty()):
+                batch = self._next_batch()
+                if batch:
+                    self._commit(batch)
+            db.session.remove()
+
+    def _insert(self, rows: list) -> None:
+        db.session.execute(Solves.__table__.insert(), rows)
+        db.session.commit()
+
+    def _commit(self, batch: list) -> None:
+        # skip the solves whose submitter gave up waiting
+        batch = [(row, future) for row, future in batch if future.set_running_or_notify_cancel()]
+        if not batch:
+            return
+        try:
+            self._insert([row for row, _ in batch])
+            results = [(future, None) for _, future in batch]
+        except Exception as e:
+            db.session.rollback()
+            print(f"solve batch of {len(batch)} failed ({e}), retrying one by one")
+            # don't let one bad solve fail the whole batch
+            results = []
+            for row, future in batch:
+                try:
+                    self._insert([row])
+                    results.append((future, None))
+                except Exception as e:
+                    db.session.rollback()
+                    results.append((future, e))
+
+        self.batches += 1
+        self.solves += len(batch)
+        for future, error in results:
+            if error is None:
+                future.set_result(True)
+            else:
+                future.set_exception(error)
+
+
+# The writer used by /solve, None unless SOLVE_GROUP_COMMIT is enabled
+SOLVE_WRITER = None
+
+
+def init_solve_writer(app) -> "SolveWriter":
+    """
+    Start the solve writer if SOLVE_GROUP_COMMIT is set
+    """
+    global SOLVE_WRITER
+    if not app.config.get("SOLVE_GROUP_COMMIT", False) or SOLVE_WRITER is not None:
+        return SOLVE_WRITER
+
+    SOLVE_WRITER = SolveWriter(
+        app,
+        max_batch=app.config.get("SOLVE_BATCH_SIZE", 100),
+        max_wait=app.config.get("SOLVE_BATCH_WAIT_MS", 5) / 1000,
+        timeout=app.config.get("SOLVE_SUBMIT_TIMEOUT", 5)
+    ).start()
+    # commit whatever is still queued on shutdown
+    atexit.register(SOLVE_WRITER.stop)
+    print(f"Solves are group committed, batches of up to {SOLVE_WRITER.max_batch} "
+          f"every {SOLVE_WRITER.max_wait * 1000:.0f}ms")
+    return SOLVE_WRITER
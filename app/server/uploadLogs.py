@@ -11,7 +11,48 @@ from azure.kusto.data.data_format import DataFormat
 from azure.kusto.ingest import QueuedIngestClient, IngestionProperties, FileDescriptor, BlobDescriptor, ReportLevel, ReportMethod
 from flask import current_app
 from azure.kusto.data.helpers import dataframe_from_result_table
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import numpy as np
+from app import cache
+from app.server.log_sinks import LogSink, AdxSink, ConsoleSink
+from app.server.metrics import METRICS
 
+# cache key for the list of principals that can view the ADX database
+PERMISSIONS_CACHE_KEY = "adx_database_principals"
+
+# columns that hold the time of an event, the first one a row has is used
+TIME_COLUMNS = ("timestamp", "event_time", "time")
+
+
+def retime_rows(rows: "list[dict]", window: tuple, rng: np.random.Generator) -> None:
+    """
+    Redraw the times of rows (in place) uniformly over window, keeping their order
+    Left alone if every time is already in the window; rows without a readable time are skipped
+    Times are written back as they came: epoch seconds, datetimes or ISO strings
+    """
+    columns = [next((column for column in TIME_COLUMNS if column in row), None) for row in rows]
+    rows = [(row, column) for row, column in zip(rows, columns) if column is not None]
+    if not rows:
+        return
+    values = [row[column] for row, column in rows]
+    times = pd.Series([pd.to_datetime(value, unit="s" if isinstance(value, (int, float)) else None, errors="coerce", utc=True)
+                       for value in values], dtype="datetime64[ns, UTC]").dt.tz_convert(None)
+    readable = times.notna().to_numpy()
+    start, end = (pd.Timestamp(t) for t in window)
+    if times[readable].between(start, end).all():
+        return
+
+    order = np.flatnonzero(readable)[np.argsort(times[readable].to_numpy(), kind="stable")]
+    new_times = pd.to_datetime(np.sort(rng.integers(start.value, max(end.value, start.value + 1), size=len(order)))).floor("us")
+    for i, new_time in zip(order, new_times):
+        row, column = rows[i]
+        if isinstance(row[column], (int, float)):
+            row[column] = new_time.value / 1e9
+        elif isinstance(row[column], str):
+            row[column] = new_time.strftime("%Y-%m-%dT%H:%M:%S")
+        else:
+            row[column] = new_time.to_pydatetime()
 
 
 class LogUploader():
@@ -23,7 +64,46 @@ class LogUploader():
     see: https://github.com/Azure/azure-kusto-python/blob/master/azure-kusto-ingest/tests/sample.py
     """
 
-    def __init__(self, queue_limit=1000):
+    def __init__(self, queue_limit=1000, sink: LogSink = None):
+        # Logs go to ADX unless another sink is given (see log_sinks.py)
+        # Without ADX there is no need for the tenant config or the kusto clients
+        self.sink = sink
+        if sink is None:
+            self._connect()
+            if current_app.config["ADX_DEBUG_MODE"]:
+                # If ADX_DEBUG_MODE is enabled, print the data instead of uploading it to ADX
+                self.sink = ConsoleSink()
+            else:
+                self.sink = AdxSink(self.ingest, self.DATABASE)
+
+        # The queue will allow us to upload multiple rows at once
+        # This allows the game to runs faster and enable us to make fewer API calls
+        # self.queue will be in the format:
+        # {
+        #   "table_name": [dict, dict, dict],
+        #   "table_name2": [dict, dict, dict]
+        # }
+        self.queue = {}
+        # batches that are already dataframes, see send_batch_to_queue
+        # {
+        #   "table_name": [DataFrame, DataFrame]
+        # }
+        self.batches = {}
+        # how many records do we hold until submitting everything to kusto
+        self.queue_limit = queue_limit
+        # running count of rows queued per table, used to report throughput
+        self.row_counts = {}
+        # columns of the rows queued one at a time, per table, batches must match them
+        self.columns = {}
+        # set while rows are held back for time_window
+        self.holding = False
+        # rows sent to a table are also kept here inside a collect block, see collect
+        self.collecting = {}
+
+    def _connect(self) -> None:
+        """
+        Read the ADX settings from the flask config and create the kusto clients
+        """
         # set Azure tenant config variables
         self.AAD_TENANT_ID = current_app.config["AAD_TENANT_ID"]
         self.KUSTO_URI = current_app.config["KUSTO_URI"]
@@ -46,23 +126,9 @@ class LogUploader():
 
         self.ingest = QueuedIngestClient(kcsb_ingest)
         self.client = KustoClient(kcsb_data)
-     
-
-        # The queue will allow us to upload multiple rows at once
-        # This allows the game to runs faster and enable us to make fewer API calls
-        # self.queue will be in the format:
-        # {
-        #   "table_name": [dict, dict, dict],
-        #   "table_name2": [dict, dict, dict]
-        # }
-        self.queue = {}
-        # how many records do we hold until submitting everything to kusto
-        self.queue_limit = queue_limit
-
-
 
     @staticmethod
-    def _create_user_permission_command(user_string:str, database: str) -> str:
+    def _validate_user_string(user_string: str) -> None:
         """
         Take a user string of the following format:
         aaduser=user@contoso.com
@@ -71,12 +137,34 @@ class LogUploader():
         # Does the user_string contain one of the required identifiers?
         if not any(prefix in user_string for prefix in ['aaduser=','msauser=']):
             raise Exception("ERROR: The user identifier must be prefixed by either aaduser= or msauser=")
-        return f".add database {database} viewers ('{user_string}')"
 
-    def get_user_permissions(self) -> list:
+    @staticmethod
+    def _create_user_permission_command(user_strings: "str | list[str]", database: str) -> str:
+        """
+        Build a single management command that adds one or more
+        principals as viewers of the database, e.g.
+        .add database db viewers ('aaduser=a@contoso.com', 'msauser=b@outlook.com')
+        """
+        if isinstance(user_strings, str):
+            user_strings = [user_strings]
+        for user_string in user_strings:
+            LogUploader._validate_user_string(user_string)
+        principals = ", ".join(f"'{user_string}'" for user_string in user_strings)
+        return f".add database {database} viewers ({principals})"
+
+    def get_user_permissions(self, refresh: bool = False) -> list:
         """
         Get a list of user permissions from ADX
+
+        The principal list is cached so that the admin pages don't
+        hit the cluster on every view. Pass refresh=True (or call
+        add_user_permissions_bulk) to re-read it from ADX.
         """
+        if not refresh:
+            perms = cache.get(PERMISSIONS_CACHE_KEY)
+            if perms is not None:
+                return perms
+
         show_permissions_command = f".show database {self.DATABASE} principals | distinct PrincipalDisplayName"
         response = self.client.execute_mgmt(self.DATABASE, show_permissions_command)
 
@@ -84,17 +172,72 @@ class LogUploader():
         if response.get_exceptions():
             raise response.get_exceptions()
 
-        return dataframe_from_result_table(response.primary_results[0])['PrincipalDisplayName'].unique().tolist()
+        perms = dataframe_from_result_table(response.primary_results[0])['PrincipalDisplayName'].unique().tolist()
+        cache.set(PERMISSIONS_CACHE_KEY, perms,
+                  timeout=current_app.config.get("ADX_PERMISSIONS_CACHE_TIMEOUT", 300))
+        return perms
 
-    def add_user_permissions(self, user_string: str) -> None:
+    def add_user_permissions(self, user_string: "str | list[str]") -> None:
         permission_command = LogUploader._create_user_permission_command(user_string, self.DATABASE)
         response = self.client.execute_mgmt(self.DATABASE, permission_command)
         # Raise any errors that come back from 
         if response.get_exceptions():
             raise response.get_exceptions()
 
-   
+    def add_user_permissions_bulk(self, user_strings: "list[str]", batch_size: int = 100,
+                                  max_workers: int = 4) -> "dict[str, str | None]":
+        """
+        Add many principals as database viewers
+
+        Principals are validated up front, then added in batches of
+        batch_size with one management command per batch. Batches are run
+        with at most max_workers commands in flight. If a batch is rejected
+        each of its principals is retried on its own so that the error can
+        be attributed to the principal(s) that caused it.
 
+        Returns a mapping of principal -> None on success or the error message
+        """
+        results = {}
+        valid_user_strings = []
+        # drop blanks and duplicates while keeping the submitted order
+        for user_string in dict.fromkeys(u.strip() for u in user_strings if u.strip()):
+            try:
+                LogUploader._validate_user_string(user_string)
+                valid_user_strings.append(user_string)
+            except Exception as e:
+                results[user_string] = str(e)
+
+        def add_batch(batch: "list[str]") -> "dict[str, str | None]":
+            try:
+                self.add_user_permissions(batch)
+                return {user_string: None for user_string in batch}
+            except Exception as e:
+                if len(batch) == 1:
+                    return {batch[0]: str(e)}
+            # the whole batch failed, find out which principals are at fault
+            batch_results = {}
+            for user_string in batch:
+                batch_results.update(add_batch([user_string]))
+            return batch_results
+
+        batches = [valid_user_strings[i:i + batch_size]
+                   for i in range(0, len(valid_user_strings), batch_size)]
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for batch_results in executor.map(add_batch, batches):
+                results.update(batch_results)
+
+        # the principal list has changed, make sure the next read goes to ADX
+        cache.delete(PERMISSIONS_CACHE_KEY)
+        return results
+
+    def get_queue_length(self) -> int:
+        """
+        Count the rows currently waiting in the queue accross all tables
+        """
+        return sum(len(rows) for rows in self.queue.values()) + \
+            sum(len(df) for batches in self.batches.values() for df in batches)
+
+    def send_request_to_queue(self, table_name: str, data) -> None:
         """
         Data is ingested as JSON
         convert to a pandas dataframe and upload to KUSTO
@@ -113,44 +256,117 @@ class LogUploader():
             self.queue[table_name].append(data)
         else:
             self.queue[table_name] = [data]
+            self.columns.setdefault(table_name, list(data))
+        self.row_counts[table_name] = self.row_counts.get(table_name, 0) + 1
+        for rows in self.collecting.get(table_name, ()):
+            rows.append(data)
 
         # reached the queue limit
         # submit all existing records and clear the queue
+        if not self.holding and self.get_queue_length() > self.queue_limit:
+            self.flush_queue()
+
+    @contextmanager
+    def time_window(self, window: tuple = None, rng: np.random.Generator = None):
+        """
+        Move the rows queued in the block into the (start, end) game time window
+
+        The per-event generators take their timestamps from the module clock (real time
+        times time_multiplier), which knows nothing of the scheduler's ticks. Rows that
+        fall outside the tick get new times drawn uniformly over it, handed out in the order
+        of their old times so that every table keeps its sequence of events (an email
+        still comes before the click on its link). Rows are held back until the block ends.
+        Does nothing when window is None.
+        """
+        if window is None or self.holding:
+            yield
+            return
+        queued = {table_name: len(rows) for table_name, rows in self.queue.items()}
+        self.holding = True
+        try:
+            yield
+        finally:
+            self.holding = False
+        rows = [row for table_name, table_rows in self.queue.items()
+                for row in table_rows[queued.get(table_name, 0):]]
+        retime_rows(rows, window, rng or np.random.default_rng())
         if self.get_queue_length() > self.queue_limit:
-            for table_name, data in self.queue.items():
-                self.ingestion_props = IngestionProperties(
-                    database=self.DATABASE,
-                    table=table_name,
-                    data_format=DataFormat.CSV,
-                    report_level=ReportLevel.FailuresAndSuccesses
-                )
-
-                # turn list of rows in a dataframe
-                # TODO: sort by time before uploading -
-                #   need to first standardize time columns accross tables
-                data_table_df = pd.DataFrame(self.queue[table_name])
-                
-                try:
-                    # if possible sort value using the "timestamp" column
-                    data_table_df = data_table_df.sort_values("timestamp", ascending=True)
-                except:
-                    pass
-
-                print(f"uploading data for type {table_name}")
-                print(data_table_df.shape)
-
-                if current_app.config["ADX_DEBUG_MODE"]:
-                    # If ADX_DEBUG_MODE is enabled, print JSON representation of data
-                    # Then, return early to prevent queueing and uploading to ADX
-                    print(f"Uploading to table {table_name}...")
-
-                    print(data_table_df.to_markdown())
-                else:
-                    # submit logs to Kusto
-                    result = self.ingest.ingest_from_dataframe(
-                        data_table_df, ingestion_properties=self.ingestion_props)
-                    print(result)
-                    print(f"....adding data to azure for {table_name} table")
-
-            # reset the quee
-            self.queue = {}
\ No newline at end of file
+            self.flush_queue()
+
+    @contextmanager
+    def collect(self, table_name: str):
+        """
+        Yield a list of the rows sent to table_name in the block
+        The rows are queued (and flushed) as usual, the list keeps a reference to each of them
+        """
+        rows = []
+        # blocks can be nested, they end in the reverse order they started
+        self.collecting.setdefault(table_name, []).append(rows)
+        try:
+            yield rows
+        finally:
+            self.collecting[table_name].pop()
+            if not self.collecting[table_name]:
+                del self.collecting[table_name]
+
+    def send_batch_to_queue(self, table_name: str, data_table_df: pd.DataFrame) -> None:
+        """
+        Queue a whole batch of rows for a table at once
+        The columns must match the keys of the rows sent to send_request_to_queue
+        (see align_columns)
+        """
+        self.batches.setdefault(table_name, []).append(data_table_df)
+        self.row_counts[table_name] = self.row_counts.get(table_name, 0) + len(data_table_df)
+
+        if self.get_queue_length() > self.queue_limit:
+            self.flush_queue()
+
+    def align_columns(self, table_name: str, data_table_df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Put the columns of a batch in the order of the rows queued one at a time for the table
+        ADX maps CSV columns by position, a batch with other columns would fill the wrong ones
+        Raises ValueError if the columns don't match
+        """
+        columns = self.columns.get(table_name)
+        if columns is None or list(data_table_df.columns) == columns:
+            return data_table_df
+        if set(data_table_df.columns) != set(columns):
+            raise ValueError(f"Batch columns {list(data_table_df.columns)} don't match the columns "
+                             f"{columns} of the {table_name} table")
+        return data_table_df[columns]
+
+    def flush_queue(self) -> None:
+        """
+        Submit every queued row to its table and clear the queue
+        The time spent and the rows sent are recorded in METRICS
+        """
+        with METRICS.timer("uploader_flush_seconds"):
+            self._flush_tables()
+        METRICS.increment("uploader_flushes")
+
+    def _flush_tables(self) -> None:
+        for table_name in {**self.queue, **self.batches}:
+            # turn list of rows in a dataframe
+            # TODO: sort by time before uploading -
+            #   need to first standardize time columns accross tables
+            frames = [self.align_columns(table_name, df) for df in self.batches.get(table_name, [])]
+            if table_name in self.queue:
+                frames = [pd.DataFrame(self.queue[table_name])] + frames
+            data_table_df = pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0]
+            
+            try:
+                # if possible sort value using the "timestamp" column
+                data_table_df = data_table_df.sort_values("timestamp", ascending=True)
+            except:
+                pass
+
+            print(f"uploading data for type {table_name}")
+            print(data_table_df.shape)
+
+            with METRICS.timer("uploader_write_seconds", table=table_name):
+                self.sink.write(table_name, data_table_df)
+            METRICS.increment("uploader_rows", len(data_table_df), table=table_name)
+
+        # reset the quee
+        self.queue = {}
+        self.batches = {}
@@ -2,6 +2,8 @@
 from app.server.models import db
 from app.server.models import GameSession, Solves, Challenges, Users
 from app import cache
+from app.server.metrics import METRICS
+from app.server.database import replica_reads
 
 # Import external modules
 from fileinput import filename
@@ -13,9 +15,12 @@ from itsdangerous import base64_encode
 import string
 from functools import wraps
 from time import time
+from contextlib import contextmanager
+import hashlib
+from app.server.faker_pools import PooledFaker
 
-# instantiate faker
-fake = Faker()
+# instantiate faker, the providers that have a pool draw from it (see faker_pools.py)
+fake = PooledFaker(Faker())
 fake.add_provider(internet)
 fake.add_provider(file)
 fake.add_provider(lorem)
@@ -29,10 +34,80 @@ def timing(f):
         result = f(*args, **kw)
         te = time()
         print(f"function {f.__name__} took: {te-ts}")
+        METRICS.observe("function_seconds", te - ts, function=f.__name__)
         # print 'func:%r args:[%r, %r] took: %2.4f sec' % (f.__name__, args, kw, te-ts)
         return result
     return wrap
 
+@contextmanager
+def phase_timer(name: str, timings: dict):
+    """
+    Time the enclosed block and add the duration (in seconds) to timings[name]
+    The duration is also recorded in the phase_seconds metric
+    """
+    ts = time()
+    try:
+        yield
+    finally:
+        timings[name] = timings.get(name, 0) + time() - ts
+        METRICS.observe("phase_seconds", time() - ts, phase=name)
+
+
+@contextmanager
+def batched_inserts(*models):
+    """
+    Insert the new objects of the given models with one executemany INSERT per table and flush
+    SQLAlchemy only batches INSERTs whose primary keys are known, so before each flush new objects
+    get ids counted up from max(id), in the order they were added to the session.
+    The block must be the only writer of these tables (init_setup runs before the game loop).
+    PostgreSQL sequences are moved past the assigned ids at the end of the block.
+    """
+    from sqlalchemy import event, func, inspect, text
+
+    session = db.session()
+    next_ids = {}
+
+    def assign_ids(session, flush_context, instances):
+        new = sorted((instance for instance in session.new if type(instance) in models and instance.id is None),
+                     key=lambda instance: inspect(instance).insert_order)
+        with session.no_autoflush:
+            for instance in new:
+                model = type(instance)
+                if model not in next_ids:
+                    next_ids[model] = (session.query(func.max(model.id)).scalar() or 0) + 1
+                instance.id = next_ids[model]
+                next_ids[model] += 1
+
+    event.listen(session, "before_flush", assign_ids)
+    try:
+        yield
+        session.flush()
+    finally:
+        event.remove(session, "before_flush", assign_ids)
+    if db.engine.dialect.name == "postgresql":
+        for model in next_ids:
+            table = model.__table__.name
+            session.execute(text(f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), (SELECT max(id) FROM {table}))"))
+
+
+def derive_seed(*parts) -> int:
+    """
+    Derive a 64 bit seed from the given parts
+    Unlike hash() this is stable across processes and interpreter runs
+    """
+    digest = hashlib.sha256(":".join(str(part) for part in parts).encode()).digest()
+    return int.from_bytes(digest[:8], "big")
+
+
+def seed_generation(seed: int) -> None:
+    """
+    Seed every source of randomness used to generate game data
+    Faker.seed seeds the generator shared by all Faker() instances (see models.py and utils.py)
+    """
+    random.seed(seed)
+    Faker.seed(seed)
+
+
 def ordinalize(n):
     """
     http://codegolf.stackexchange.com/a/4712
@@ -43,6 +118,12 @@ def ordinalize(n):
 
 @cache.memoize(timeout=60)
 def get_user_standings():
+    # recomputing the standings is a heavy read, let the replica do it
+    with replica_reads():
+        return _get_user_standings()
+
+
+def _get_user_standings():
     scores = (
         db.session.query(
             Solves.user_id.label("user_id"),
@@ -69,4 +150,310 @@ def get_user_standings():
 
     standings = standings_query.all()
 
-    return standings
\ No newline at end of file
+    return standings
+
+
+def format_place(n: int) -> str:
+    """
+    Ordinal place with a medal for the podium, e.g. 1st  🥇
+    """
+    ranking = ordinalize(n)
+    medals = {1: "  🥇", 2: "  🥈", 3: "  🥉"}
+    return ranking + medals.get(n, "")
+
+
+def ranked_players():
+    """
+    Query for every player (everyone but the admin) with their score, place and rank,
+    with the columns user_id, name, score, place and rank
+    Use it as a .subquery() or .cte()
+    Places are numbered with ROW_NUMBER over the scores, ties go to whoever reached
+    the score first. RANK gives tied players the same rank.
+    Players without a scoring solve have a score of 0 and no place or rank.
+    """
+    scores = (
+        db.session.query(
+            Solves.user_id.label("user_id"),
+            db.func.sum(Challenges.value).label("score"),
+            db.func.max(Solves.id).label("id")
+        )
+        .join(Challenges)
+        .filter(Challenges.value != 0)
+        .filter(Solves.user_id != 1)
+        .group_by(Solves.user_id)
+        .subquery()
+    )
+    has_score = scores.columns.score.isnot(None)
+    place = db.func.row_number().over(
+        order_by=(scores.columns.score.is_(None), scores.columns.score.desc(), scores.columns.id)
+    )
+    rank = db.func.rank().over(
+        order_by=(scores.columns.score.is_(None), scores.columns.score.desc())
+    )
+    return (
+        db.session.query(
+            Users.id.label("user_id"),
+            Users.username.label("name"),
+            db.func.coalesce(scores.columns.score, 0).label("score"),
+            db.case((has_score, place), else_=None).label("place"),
+            db.case((has_score, rank), else_=None).label("rank")
+        )
+        .outerjoin(scores, Users.id == scores.columns.user_id)
+        .filter(Users.username != "admin")
+    )
+
+
+def get_players_around(user_id: int, k: int = 5) -> list:
+    """
+    The player and the k players placed right above and below them, in one query
+    Rows have the columns of ranked_players, ordered by place
+    Empty if the player has no place yet
+    """
+    players = ranked_players().cte("ranked_players")
+    place = db.session.query(players.c.place).filter(players.c.user_id == user_id).scalar_subquery()
+    return (
+        db.session.query(players)
+        .filter(players.c.place.between(place - k, place + k))
+        .order_by(players.c.place)
+        .all()
+    )
+
+
+# largest page a DataTables request can ask for
+DATATABLES_MAX_PAGE = 500
+
+def datatables_page(query, columns: list, search_columns: list, args, tiebreak=None) -> dict:
+    """
+    Run a DataTables server-side processing request against a query
+    columns holds the SQL expression (or tuple of expressions) to sort each table column by,
+    search_columns the expressions the search box is matched against
+    tiebreak is appended to every ordering so pages don't overlap
+    Returns the DataTables payload with the rows of the requested page in "data",
+    the caller turns them into what the table displays
+    """
+    draw = args.get("draw", default=0, type=int)
+    start = max(args.get("start", default=0, type=int), 0)
+    length = args.get("length", default=100, type=int)
+    # a length of -1 asks for every row
+    length = DATATABLES_MAX_PAGE if length < 0 else min(length, DATATABLES_MAX_PAGE)
+
+    total = query.order_by(None).count()
+    search = args.get("search[value]", "").strip()
+    if search:
+        pattern = "%" + search.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+        query = query.filter(db.or_(*[column.ilike(pattern, escape="\\") for column in search_columns]))
+        filtered = query.order_by(None).count()
+    else:
+        filtered = total
+
+    ordering = []
+    i = 0
+    while f"order[{i}][column]" in args:
+        index = args.get(f"order[{i}][column]", type=int)
+        if index is not None and 0 <= index < len(columns):
+            expressions = columns[index] if isinstance(columns[index], tuple) else (columns[index],)
+            descending = args.get(f"order[{i}][dir]") == "desc"
+            ordering.extend(e.desc() if descending else e.asc() for e in expressions)
+        i += 1
+    if tiebreak is not None:
+        ordering.append(tiebreak)
+
+    return {
+        "draw": draw,
+        "recordsTotal": total,
+        "recordsFiltered": filtered,
+        "data": query.order_by(*ordering).offset(start).limit(length).all(),
+    }
+
+
+def create_missing_indexes() -> None:
+    """
+    Create the indexes declared on the models that an existing database doesn't have yet
+    db.create_all only creates missing tables
+    """
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=db.engine, checkfirst=True)
+
+def get_game_session(seed: int = None) -> GameSession:
+    """
+    The game session, created if the database doesn't have one yet
+    The web app creates it before the first request, the cli has to do it itself
+    """
+    from datetime import datetime
+    from flask import current_app
+
+    current_session = db.session.query(GameSession).get(1)
+    if current_session is None:
+        current_session = GameSession(state=False, start_time=datetime.now(),
+                                      seed=seed if seed is not None else current_app.config.get("GAME_SEED"))
+        # there is only ever one session, looked up by this id
+        current_session.id = 1
+        db.session.add(current_session)
+        db.session.commit()
+        print(f"Created a new game session with seed {current_session.seed}")
+    return current_session
+
+
+# columns added to existing tables after their first release, as (table, column)
+# db.create_all only creates missing tables, add_missing_columns adds these
+ADDED_COLUMNS = [
+    ("game_session", "seed"),
+    ("teams", "rescored"),
+]
+
+
+def add_missing_columns(engine=None) -> "list[str]":
+    """
+    Add the columns of ADDED_COLUMNS that an existing database doesn't have yet
+    Game sessions created before the seed column get a random seed
+    Returns the columns added, as "table.column"
+    """
+    from sqlalchemy import inspect, text
+
+    engine = engine or db.engine
+    added = []
+    with engine.begin() as connection:
+        inspector = inspect(connection)
+        for table_name, column_name in ADDED_COLUMNS:
+            if not inspector.has_table(table_name):
+                continue
+            if column_name in {column["name"] for column in inspector.get_columns(table_name)}:
+                continue
+            column = db.metadata.tables[table_name].c[column_name]
+            column_type = column.type.compile(dialect=connection.dialect)
+            connection.execute(text(f"ALTER TABLE {table_name} ADD COLUMN {column_name} {column_type}"))
+            added.append(f"{table_name}.{column_name}")
+
+        if "game_session.seed" in added:
+            for session_id, in connection.execute(text("SELECT id FROM game_session WHERE seed IS NULL")).fetchall():
+                connection.execute(text("UPDATE game_session SET seed = :seed WHERE id = :id"),
+                                   {"seed": random.randrange(2**63), "id": session_id})
+    for column in added:
+        print(f"Added the missing column {column}")
+    return added
+
+
+# formats older releases and hand edits stored report times in, tried before falling back to pandas
+REPORT_TIME_FORMATS = (
+    "%Y-%m-%d %H:%M:%S",
+    "%Y-%m-%d %H:%M",
+    "%Y/%m/%d %H:%M:%S",
+    "%m/%d/%Y %H:%M:%S",
+    "%m/%d/%Y %I:%M:%S %p",
+    "%m/%d/%Y %H:%M",
+    "%d %b %Y %H:%M:%S",
+    "%a, %d %b %Y %H:%M:%S",
+)
+
+
+def _parse_report_time(value: str):
+    """
+    A report time stored as text by an older release, None if it isn't a date
+    Accepts ISO dates, the formats of REPORT_TIME_FORMATS and epoch seconds
+    """
+    from datetime import datetime, timezone
+    import pandas as pd
+
+    value = str(value).strip()
+    parsed = None
+    try:
+        parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        pass
+    for time_format in REPORT_TIME_FORMATS:
+        if parsed is not None:
+            break
+        try:
+            parsed = datetime.strptime(value, time_format)
+        except ValueError:
+            pass
+    if parsed is None and value.replace(".", "", 1).isdigit() and len(value) >= 9:
+        try:
+            parsed = datetime.fromtimestamp(float(value), timezone.utc)
+        except (ValueError, OverflowError, OSError):
+            pass
+    if parsed is None:
+        try:
+            parsed = pd.to_datetime(value).to_pydatetime()
+        except (ValueError, TypeError, OverflowError):
+            return None
+        if not isinstance(parsed, datetime):
+            # NaT
+            return None
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def migrate_report_times(engine=None) -> int:
+    """
+    Convert the report times stored as text (report.time used to be a String column)
+    Values are rewritten as "YYYY-MM-DD HH:MM:SS.ffffff", which is how SQLite stores a DateTime
+    and sorts like one, then server databases change the column type
+    Times that can't be parsed are printed and left as they are, nothing is deleted. Server
+    databases keep the text column until they are fixed by hand and the migration is run again.
+    This is a one-off run by `flask migrate-report-times`, not on startup
+    Returns the number of reports converted
+    """
+    from sqlalchemy import inspect, text, String
+
+    engine = engine or db.engine
+    with engine.begin() as connection:
+        inspector = inspect(connection)
+        if not inspector.has_table("report"):
+            return 0
+        column_type = {column["name"]: column["type"] for column in inspector.get_columns("report")}["time"]
+        if not isinstance(column_type, String):
+            return 0
+
+        query = "SELECT id, time FROM report"
+        if connection.dialect.name == "sqlite":
+            # SQLite keeps the declared VARCHAR, only look at the values not converted yet
+            query += " WHERE time NOT LIKE '____-__-__ __:__:__.______' OR length(time) != 26"
+        converted, invalid = [], []
+        for report_id, value in connection.execute(text(query)).fetchall():
+            parsed = _parse_report_time(value)
+            if parsed is None:
+                invalid.append((report_id, value))
+            else:
+                converted.append({"id": report_id, "time": parsed.isoformat(sep=" ", timespec="microseconds")})
+        if converted:
+            connection.execute(text("UPDATE report SET time = :time WHERE id = :id"), converted)
+        for report_id, value in invalid:
+            print(f"Report {report_id}: can't read the time {value!r}, left as it is")
+
+        new_type = db.metadata.tables["report"].c.time.type.compile(dialect=connection.dialect)
+        if invalid and connection.dialect.name in ("postgresql", "mysql"):
+            print(f"report.time stays {column_type}, fix the {len(invalid)} reports above and run the migration again")
+        elif connection.dialect.name == "postgresql":
+            connection.execute(text(f"ALTER TABLE report ALTER COLUMN time TYPE {new_type} USING time::{new_type}"))
+        elif connection.dialect.name == "mysql":
+            connection.execute(text(f"ALTER TABLE report MODIFY time {new_type} NOT NULL"))
+    if converted:
+        print(f"Converted the time of {len(converted)} reports to a DateTime")
+    return len(converted)
+
+
+def migrate_legacy_mitigations() -> int:
+    """
+    Move the deny lists stored as a JSON blob in Team._mitigations into team_mitigations
+    The blob is cleared once moved, so this is a no-op after the first run
+    Returns the number of teams migrated
+    """
+    from app.server.models import Team
+    import json
+
+    teams = Team.query.filter(Team._mitigations.isnot(None), Team._mitigations != "").all()
+    for team in teams:
+        try:
+            indicators = json.loads(team._mitigations)
+        except ValueError:
+            # written by hand, one indicator per line
+            indicators = team._mitigations.split("\n")
+        team.add_to_deny_list([indicator for indicator in indicators if isinstance(indicator, str)])
+        team._mitigations = ""
+    if teams:
+        db.session.commit()
+        print(f"Moved the deny lists of {len(teams)} teams to team_mitigations")
+    return len(teams)
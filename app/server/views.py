@@ -5,20 +5,29 @@ import random
 import yaml
 import csv
 import io
+import concurrent.futures
 from datetime import datetime
 from flask_login import login_required, current_user
 from flask_security import roles_required
 
 from flask import Blueprint, request, render_template, \
-    flash, g, session, redirect, url_for, abort, current_app, jsonify
+    flash, g, session, redirect, url_for, abort, current_app, jsonify, Response
 from sqlalchemy import asc
 from sqlalchemy.sql.expression import func, select
 from werkzeug.utils import secure_filename
 from app.server.uploadLogs import LogUploader
+from app.server.metrics import METRICS, format_prometheus, game_metrics_path, merge_snapshots, read_export
+from app.server.profiling import SLOW_REQUESTS
+from app.server.database import read_only, mark_written
+from app.server import solve_writer
+from app.server.rate_limit import rate_limited
+from app.server.scoring import get_scorer
+from app.server.reports import reports_page
 
 
 # Import module models (i.e. Company, Employee, Actor, DNSRecord)
-from app.server.models import db, Team, Users, Roles, GameSession, Solves, Challenges
+from app.server.models import db, Team, Users, Roles, GameSession, Solves, Challenges, TeamMitigation, Report
+from app.server.models import normalize_indicators, chunks
 
 from app.server.utils import *
 
@@ -54,6 +63,49 @@ def manage_game():
     return render_template("admin/manage_game.html", game_state=game_state, indicators=indicators)
 
 
+@main.route("/admin/stop_game")
+@roles_required('Admin')
+@login_required
+def stop_game():
+    """
+    Clear the game state flag
+    The game loop polls the flag and stops at the end of the current tick
+    """
+    current_session = db.session.query(GameSession).get(1)
+    current_session.state = False
+    db.session.commit()
+    return jsonify(STATE=current_session.state)
+
+
+@main.route("/admin/metrics")
+@roles_required('Admin')
+@login_required
+def metrics():
+    """
+    Generator timings, uploader flushes and queue depth of the running game
+    The game runs in another process, its metrics are read from the snapshot it exports
+    Every series is labelled with its process, "web" or "game"
+    Pass ?format=prometheus for the Prometheus text format
+    """
+    snapshot = merge_snapshots({"web": METRICS.snapshot(), "game": read_export(game_metrics_path())})
+    if request.args.get("format") == "prometheus":
+        return Response(format_prometheus(snapshot, METRICS.prefix), mimetype="text/plain; version=0.0.4")
+    return jsonify(snapshot)
+
+
+@main.route("/admin/slow_requests")
+@roles_required('Admin')
+@login_required
+def slow_requests():
+    """
+    The slowest recent requests recorded by the request profiler
+    """
+    return render_template("admin/slow_requests.html",
+                           enabled=current_app.config.get("PROFILE_REQUESTS", False),
+                           threshold=current_app.config.get("PROFILE_SLOW_REQUEST_SECONDS", 0.5),
+                           requests=list(reversed(SLOW_REQUESTS)))
+
+
 @main.route("/admin/manage_database")
 @roles_required('Admin')
 @login_required
@@ -70,21 +122,43 @@ def manage_database():
 @login_required
 def manage_teams():
     team_list = Team.query.all()
+    mitigation_counts = dict(
+        db.session.query(TeamMitigation.team_id, func.count(TeamMitigation.id))
+        .group_by(TeamMitigation.team_id)
+    )
     return render_template("admin/manage_teams.html",
-                           teams=team_list)
+                           teams=team_list, mitigation_counts=mitigation_counts)
 
 
 @main.route("/admin/users")
 @roles_required('Admin')
 @login_required
 def manage_users():
-    user_list = Users.query.all()
-    teams = Team.query.all()
+    # the users table loads its rows from /admin/api/users
+    teams = db.session.query(Team.id, Team.name).order_by(Team.id).all()
     return render_template("admin/manage_users.html",
-                           users=user_list,
                            teams=teams)
 
 
+@main.route("/admin/api/users")
+@roles_required('Admin')
+@login_required
+def manage_users_api():
+    """
+    DataTables server-side processing endpoint for the users table
+    Rows are [id, username, team name]
+    """
+    page = datatables_page(
+        db.session.query(Users.id, Users.username, Team.name).outerjoin(Team, Users.team_id == Team.id),
+        columns=[Users.id, Users.username, Team.name],
+        search_columns=[Users.username, Team.name],
+        args=request.args,
+        tiebreak=Users.id
+    )
+    page["data"] = [[user_id, username, team_name] for user_id, username, team_name in page["data"]]
+    return jsonify(page)
+
+
 @main.route("/mitigations")
 @login_required
 def mitigations():
@@ -100,9 +174,9 @@ def mitigations():
 def get_deny_list():
     """
     Query database for team mitigations
-    Return mitigations in list format
+    Return mitigations as a stringified list (kept for older clients, see /api/mitigations)
     """
-    return jsonify(current_user.team._mitigations)
+    return jsonify(json.dumps(current_user.team.get_deny_list()))
 
 
 @main.route("/updateDenyList", methods=['POST'])
@@ -110,50 +184,190 @@ def get_deny_list():
 def update_deny_list():
     """
     POST request from mitigations page on click
-    Take a list of indicators from the view
-    Update the user's _mitigations attribute to reflect
-    Mitigations are stored as a strigified list
-    Must be json loaded after being retrieved
+    Take the whole list of indicators from the view, one per line
+    Only the difference with the stored list is written (see /api/mitigations)
     """
     try:
         deny_list = request.form['dlist']
-        mitigations = deny_list.split("\n")
-        mitigations = [x for x in mitigations if x]
-        current_user.team._mitigations = json.dumps(mitigations)
-
-        # update the teams score
-        # check if any new indicators are tagged as malicious
-        # # award point for malicious indicators found
-        # for indicator in mitigations:
-        #     current_user.team.score += 100
+        added, removed = current_user.team.set_deny_list(deny_list.split("\n"))
 
-        print(current_user.team.score)
+        # update the teams score, points for every malicious indicator the list covers
+        if added or removed:
+            get_scorer().rescore_team(current_user.team)
 
         db.session.commit()
-        return jsonify(success=current_user.team._mitigations)
+        return jsonify(success=True, added=len(added), removed=len(removed), score=current_user.team.score)
     except Exception as e:
+        db.session.rollback()
         print(e)
         return jsonify(success=False)
 
 
+# most indicators a single request may add or remove
+MITIGATIONS_MAX_CHANGES = 10000
+
+
+def _json_list(data: dict, key: str) -> list:
+    values = data.get(key) or []
+    if not isinstance(values, list) or not all(isinstance(value, (str, int)) for value in values):
+        raise ValueError(f"{key} must be a list")
+    return [str(value) for value in values]
+
+
+@main.route("/api/mitigations", methods=['GET', 'POST'])
+@login_required
+def mitigations_api():
+    """
+    GET: the indicators the user's team blocks
+    POST: apply a diff to the team's deny list, {"add": [...], "remove": [...]}
+    """
+    team = current_user.team
+    if request.method == 'GET':
+        return jsonify(team_id=team.id, indicators=team.get_deny_list())
+
+    try:
+        data = request.get_json(force=True, silent=True) or {}
+        add, remove = _json_list(data, "add"), _json_list(data, "remove")
+        if len(add) + len(remove) > MITIGATIONS_MAX_CHANGES:
+            raise ValueError(f"at most {MITIGATIONS_MAX_CHANGES} changes per request")
+        removed = team.remove_from_deny_list(remove)
+        added = team.add_to_deny_list(add)
+        if added or removed:
+            get_scorer().rescore_team(team)
+        db.session.commit()
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify(success=False, error=str(e)), 400
+    except Exception as e:
+        db.session.rollback()
+        print(f"failed to update the deny list of team {team.id}: {e}")
+        return jsonify(success=False, error="Could not update the deny list"), 500
+    return jsonify(success=True, added=added, removed=removed, score=team.score)
+
+
+@main.route("/admin/rescore_mitigations", methods=['POST'])
+@roles_required('Admin')
+@login_required
+def rescore_mitigations():
+    """
+    Recompute the mitigation score of every team from scratch
+    """
+    started = datetime.now()
+    scorer = get_scorer()
+    # pick up indicators that changed since they were last loaded
+    scorer.loaded_at = None
+    scores = scorer.rescore_all()
+    db.session.commit()
+    return jsonify(teams=len(scores), indicators=len(scorer.active),
+                   seconds=(datetime.now() - started).total_seconds())
+
+
+@main.route("/admin/api/mitigations", methods=['POST'])
+@roles_required('Admin')
+@login_required
+@read_only
+def manage_mitigations_api():
+    """
+    Batched lookups of the deny lists, {"team_ids": [...]} and/or {"indicators": [...]}
+    Returns the indicators blocked by each team and the teams blocking each indicator,
+    one query per 500 ids or indicators
+    """
+    try:
+        data = request.get_json(force=True, silent=True) or {}
+        team_ids = [int(team_id) for team_id in _json_list(data, "team_ids")]
+        indicators = normalize_indicators(_json_list(data, "indicators"))
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+
+    teams = {team_id: [] for team_id in team_ids}
+    for chunk in chunks(team_ids):
+        rows = (
+            db.session.query(TeamMitigation.team_id, TeamMitigation.indicator)
+            .filter(TeamMitigation.team_id.in_(chunk))
+            .order_by(TeamMitigation.team_id, TeamMitigation.id)
+        )
+        for team_id, indicator in rows:
+            teams[team_id].append(indicator)
+
+    blocked_by = {indicator: [] for indicator in indicators}
+    for chunk in chunks(indicators):
+        rows = (
+            db.session.query(TeamMitigation.indicator, TeamMitigation.team_id)
+            .filter(TeamMitigation.indicator.in_(chunk))
+            .order_by(TeamMitigation.team_id)
+        )
+        for indicator, team_id in rows:
+            blocked_by[indicator].append(team_id)
+
+    return jsonify(teams=teams, indicators=blocked_by)
+
+
+REPORTS_PAGE_SIZE = 50
+# largest page a client may ask for
+REPORTS_PAGE_MAX = 200
+
+@main.route("/reports")
+@login_required
+@read_only
+def reports():
+    """
+    The emails reported by the employees of the user's team, newest first
+    Pages are selected with the before cursor of the previous page (keyset pagination)
+    """
+    per_page = min(max(request.args.get("per_page", REPORTS_PAGE_SIZE, type=int), 1), REPORTS_PAGE_MAX)
+    before = request.args.get("before")
+    try:
+        page, next_cursor = reports_page(current_user.team_id, before=before, per_page=per_page)
+    except ValueError:
+        abort(400)
+    return render_template("main/reports.html", reports=page, next_cursor=next_cursor,
+                           before=before, per_page=per_page)
+
+
+@main.route("/delreport", methods=['POST'])
+@login_required
+def delreport():
+    """
+    Delete one of the team's reports
+    """
+    try:
+        report_id = request.form['report_id']
+        deleted = Report.query.filter_by(id=report_id, team_id=current_user.team_id).delete()
+        db.session.commit()
+        if deleted:
+            flash("Report removed!", 'success')
+        else:
+            flash("Report not found", 'error')
+    except Exception as e:
+        db.session.rollback()
+        print("Error: %s" % e)
+        flash("Failed to remove report", 'error')
+    return redirect(url_for('main.reports'))
+
+
 @main.route("/updatePermissions", methods=['POST'])
 @roles_required('Admin')
 @login_required
 def update_permissions():
     """
-    POST request from mitigations page on click
-    Take a list of indicators from the view
-    Update the user's _mitigations attribute to reflect
-    Mitigations are stored as a strigified list
-    Must be json loaded after being retrieved
+    POST request from manage database page on click
+    Take a list of principals from the view (one per line)
+    Add them as viewers of the ADX database in batches
+    Return the outcome for each principal so that the admin
+    can see which ones failed and why
     """
     try:
         permissions_list = request.form['plist']
         log_uploader = LogUploader()
         user_strings = [x for x in permissions_list.split("\n") if x]
-        for user_string in user_strings:
-                log_uploader.add_user_permissions(user_string)
-        return jsonify(success=True)
+        results = log_uploader.add_user_permissions_bulk(
+            user_strings,
+            batch_size=current_app.config.get("ADX_PERMISSIONS_BATCH_SIZE", 100),
+            max_workers=current_app.config.get("ADX_PERMISSIONS_MAX_WORKERS", 4)
+        )
+        results = [{"principal": principal, "success": error is None, "error": error}
+                   for principal, error in results.items()]
+        return jsonify(success=all(r["success"] for r in results), results=results)
     except Exception as e:
         print(e)
         flash("Error updating ADX Permissions: ","error")
@@ -180,10 +394,16 @@ def deluser():
 
 @main.route("/teams")
 @login_required
+@read_only
 def teams():
     team_list = Team.query.all()
+    # load every member at once rather than one query per team
+    members = {}
+    for team_id, username in db.session.query(Users.team_id, Users.username).order_by(Users.id):
+        members.setdefault(team_id, []).append(username)
     return render_template("main/teams.html",
-                           teams=team_list)
+                           teams=team_list,
+                           members=members)
 
 
 
@@ -192,16 +412,77 @@ def teams():
 #################
 @main.route("/challenges")
 @login_required
+@read_only
 def challenges():
     challenges = Challenges.query.all()
-    solves = Solves.query.all()
-    users = Users.query.all()
-    return render_template("main/challenges.html", challenges=challenges, solves=solves, users=users)
+    # number of solvers per challenge and the challenges solved by the current user
+    # are loaded up front so the template doesn't query the solves of each challenge
+    solver_counts = dict(
+        db.session.query(Solves.challenge_id, func.count(func.distinct(Solves.user_id)))
+        .group_by(Solves.challenge_id)
+    )
+    solved = {challenge_id for challenge_id, in
+              db.session.query(Solves.challenge_id).filter(Solves.user_id == current_user.id)}
+    return render_template("main/challenges.html", challenges=challenges,
+                           solver_counts=solver_counts, solved=solved)
+
+# number of players shown above and below the current user on the rankings page
+AROUND_ME = 5
+# most neighbours the around me API returns on each side
+AROUND_ME_MAX = 50
 
 @main.route("/rankings")
+@read_only
 def rankings():
-    users = Users.query.filter(Users.username!="admin").all()
-    return render_template("main/rankings.html", users=users)
+    # the table loads its rows from /api/rankings
+    around_me = []
+    if current_user.is_authenticated:
+        around_me = get_players_around(current_user.id, k=AROUND_ME)
+    return render_template("main/rankings.html", around_me=around_me, format_place=format_place)
+
+
+@main.route("/api/rankings/around_me")
+@login_required
+@read_only
+def rankings_around_me():
+    """
+    The current user's place and rank with the k (default 5) players above and below them
+    """
+    k = min(max(request.args.get("k", default=AROUND_ME, type=int), 0), AROUND_ME_MAX)
+    players = get_players_around(current_user.id, k=k)
+    me = next((player for player in players if player.user_id == current_user.id), None)
+    return jsonify(
+        user_id=current_user.id,
+        place=me.place if me else None,
+        rank=me.rank if me else None,
+        players=[{
+            "place": player.place,
+            "rank": player.rank,
+            "name": player.name,
+            "score": player.score,
+            "me": player.user_id == current_user.id
+        } for player in players]
+    )
+
+
+@main.route("/api/rankings")
+@read_only
+def rankings_api():
+    """
+    DataTables server-side processing endpoint for the rankings table
+    Rows are [place, name, score]
+    """
+    players = ranked_players().subquery()
+    page = datatables_page(
+        db.session.query(players),
+        columns=[(players.c.place.is_(None), players.c.place), players.c.name, players.c.score],
+        search_columns=[players.c.name],
+        args=request.args,
+        tiebreak=players.c.user_id
+    )
+    page["data"] = [[format_place(row.place) if row.place else "", row.name, row.score]
+                    for row in page["data"]]
+    return jsonify(page)
 
 
 @main.route('/addchallenge', methods=['POST', 'GET'])
@@ -307,18 +588,26 @@ def delete_challenge():
 
 @main.route('/solve', methods=['POST', 'GET'])
 @login_required
+@rate_limited("solve")
 def solve_challenge():
     answer = request.form['answer']
     challenge_id = request.form['challenge_id']
     challenge = db.session.query(Challenges).get(challenge_id)
-    print(challenge.solvers)
     if answer.lower() in [a.lower() for a in challenge.answer.split(";")]:
         print("answer is correct")
         try:
-            solve = Solves(challenge_id=challenge_id, user_id=current_user.id, username=current_user.username)
-            db.session.add(solve)
-            db.session.commit()
+            if solve_writer.SOLVE_WRITER:
+                # committed with the other solves submitted at the same time
+                solve_writer.SOLVE_WRITER.submit(challenge.id, current_user.id, current_user.username)
+                mark_written()
+            else:
+                solve = Solves(challenge_id=challenge_id, user_id=current_user.id, username=current_user.username)
+                db.session.add(solve)
+                db.session.commit()
             flash("Correct", "success")
+        except concurrent.futures.TimeoutError:
+            print("solve writer timed out")
+            flash("The scoreboard is busy and your answer was not saved, please submit it again", "error")
         except Exception as e:
             print(e)
             print("already solved")
@@ -339,6 +628,8 @@ def delteam():
     try:
         team_id = request.form['team_id']
         team = db.session.query(Team).get(team_id)
+        TeamMitigation.query.filter_by(team_id=team.id).delete(synchronize_session=False)
+        Report.query.filter_by(team_id=team.id).delete(synchronize_session=False)
         db.session.delete(team)
         db.session.commit()
         flash("Team removed!", 'success')
@@ -0,0 +1,55 @@
+"""
+Faker pools against direct Faker calls
+
+For each pooled provider, times n direct Faker calls, n calls of the same provider
+through PooledFaker (what the per-event generators do) and one vectorized draw of
+n values from the pool. Pool construction time is reported separately.
+
+    python -m benchmarks.faker_pools --n 100000 --size 10000
+"""
+import argparse
+import time
+
+import numpy as np
+from faker import Faker
+
+from app.server import faker_pools
+from app.server.faker_pools import FakerPool, PooledFaker, PROVIDERS
+
+
+def timed(f) -> float:
+    started = time.perf_counter()
+    f()
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--n", type=int, default=100000, help="values drawn per provider")
+    parser.add_argument("--size", type=int, default=10000, help="provider calls per pool")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    fake = Faker()
+    fake.seed_instance(args.seed)
+    np_rng = np.random.default_rng(args.seed)
+
+    started = time.perf_counter()
+    pool = faker_pools.POOL = FakerPool(size=args.size, seed=args.seed)
+    build = time.perf_counter() - started
+    pooled_fake = PooledFaker(fake)
+    print(f"built {len(PROVIDERS)} pools of {args.size} calls in {build:.2f}s\n")
+
+    print(f"{'pool':<12}{'faker/s':>14}{'pooled/s':>14}{'sample_many/s':>16}{'speedup':>10}")
+    for name, provider in PROVIDERS.items():
+        generate = getattr(fake, provider)
+        direct = timed(lambda: [generate() for _ in range(args.n)])
+        draw = getattr(pooled_fake, provider)
+        pooled = timed(lambda: [draw() for _ in range(args.n)])
+        batch = timed(lambda: pool.sample_many(name, args.n, np_rng))
+        print(f"{name:<12}{args.n / direct:>14.0f}{args.n / pooled:>14.0f}{args.n / batch:>16.0f}"
+              f"{direct / pooled:>9.0f}x")
+
+
+if __name__ == "__main__":
+    main()
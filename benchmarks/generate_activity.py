@@ -0,0 +1,67 @@
+"""
+Rows per second benchmark for generate_activity
+
+Runs a few cycles of activity for every actor, first in this process
+and then on the generation engine with an increasing number of processes.
+The game must have been initialised (employees and actors exist).
+Logs are thrown away so only generation is measured.
+
+    python -m benchmarks.generate_activity --cycles 3 --processes 2 4 8
+"""
+import argparse
+import time
+
+from app import app
+from app.server import game_functions
+from app.server.game_engine import GenerationEngine
+from app.server.log_sinks import NullSink
+from app.server.registries import Registry
+
+
+def bench_sequential(actors: list, employees: Registry, cycles: int) -> "tuple[int, float]":
+    game_functions.LOG_UPLOADER = game_functions.LogUploader(queue_limit=10000, sink=NullSink())
+    started = time.perf_counter()
+    for _ in range(cycles):
+        for actor in actors:
+            game_functions.generate_activity(actor, employees, **game_functions.get_activity_counts(actor))
+    game_functions.LOG_UPLOADER.flush_queue()
+    return sum(game_functions.LOG_UPLOADER.row_counts.values()), time.perf_counter() - started
+
+
+def bench_engine(actors: list, processes: int, cycles: int, seed: int) -> "tuple[int, float]":
+    engine = GenerationEngine(processes=processes, seed=seed, sink="null")
+    try:
+        started = time.perf_counter()
+        rows = 0
+        for cycle in range(cycles):
+            rows += sum(engine.run_cycle(actors, cycle=cycle).values())
+        return rows, time.perf_counter() - started
+    finally:
+        engine.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--cycles", type=int, default=3)
+    parser.add_argument("--processes", type=int, nargs="*", default=[2, 4])
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    with app.app_context():
+        game_functions.MALWARE_OBJECTS = game_functions.create_malware()
+        employees = Registry.from_model(game_functions.Employee)
+        actors = game_functions.Actor.query.all()
+
+        results = [("sequential", *bench_sequential(actors, employees, args.cycles))]
+        for processes in args.processes:
+            results.append((f"{processes} processes", *bench_engine(actors, processes, args.cycles, args.seed)))
+
+    baseline = results[0][1] / results[0][2]
+    print(f"{'mode':<16}{'rows':>10}{'seconds':>10}{'rows/s':>12}{'speedup':>9}")
+    for mode, rows, elapsed in results:
+        rate = rows / elapsed
+        print(f"{mode:<16}{rows:>10}{elapsed:>10.2f}{rate:>12.0f}{rate / baseline:>8.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""
+A burst of concurrent logins
+
+Every thread logs in as its own player, over and over, while a probe thread keeps
+requesting a page that does no hashing (the login form). Reports logins per second,
+login latency and the latency of the probe, which shows how much the hashing slows
+down everything else, for each PASSWORD_HASH_PROCESSES setting (0 hashes inline):
+
+    python -m benchmarks.login_burst --threads 16 --processes 0 2 4
+    python -m benchmarks.login_burst --method pbkdf2:sha256:600000
+
+Runs against DATABASE_URL, or a temporary SQLite database when it isn't set.
+The tables of the database are dropped and recreated, pass --reset to allow it
+on a database that already has users.
+"""
+import argparse
+import os
+import statistics
+import sys
+import threading
+import time
+from datetime import datetime
+
+os.environ.setdefault("APPLICATION_SETTINGS", "tests.config.TestConfig")
+
+from werkzeug.security import generate_password_hash
+
+from app import app, db
+from app.server import passwords
+from app.server.models import Users, Team, GameSession
+
+
+PASSWORD = "password"
+
+
+def seed(players: int, method: str) -> None:
+    db.drop_all()
+    db.create_all()
+    pw_hash = generate_password_hash(PASSWORD, method=method)
+    now = datetime.now()
+    db.session.bulk_insert_mappings(Team, [{"id": 1, "name": "admins", "score": 0, "_mitigations": "",
+                                            "security_awareness": .25}])
+    db.session.bulk_insert_mappings(Users, [
+        {"id": i, "username": f"user{i}", "email": f"user{i}@example.com", "pw_hash": pw_hash,
+         "registered_on": now, "team_id": 1, "active": True}
+        for i in range(1, players + 2)
+    ])
+    db.session.add(GameSession(state=False, start_time=now))
+    db.session.commit()
+
+
+def log_in(user_id: int, logins: int, latencies: list) -> None:
+    client = app.test_client()
+    for _ in range(logins):
+        started = time.perf_counter()
+        client.post("/login", data={"username": f"user{user_id}", "password": PASSWORD})
+        latencies.append(time.perf_counter() - started)
+        client.get("/logout")
+
+
+def probe(done: threading.Event, latencies: list) -> None:
+    client = app.test_client()
+    while not done.is_set():
+        started = time.perf_counter()
+        client.get("/login")
+        latencies.append(time.perf_counter() - started)
+        time.sleep(0.01)
+
+
+def percentile(latencies: list, p: float) -> float:
+    latencies = sorted(latencies)
+    return latencies[max(int(len(latencies) * p) - 1, 0)] * 1000
+
+
+def bench(processes: int, threads: int, logins: int) -> dict:
+    # a fresh pool for every setting
+    if passwords.POOL is not None:
+        passwords.POOL.shutdown()
+    passwords.POOL = None
+    app.config["PASSWORD_HASH_PROCESSES"] = processes
+
+    latencies, probe_latencies = [], []
+    done = threading.Event()
+    prober = threading.Thread(target=probe, args=(done, probe_latencies))
+    # user 1 is the admin
+    workers = [threading.Thread(target=log_in, args=(2 + i, logins, latencies)) for i in range(threads)]
+    started = time.perf_counter()
+    prober.start()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - started
+    done.set()
+    prober.join()
+
+    return {
+        "logins": len(latencies),
+        "per_second": len(latencies) / elapsed,
+        "p50": statistics.median(latencies) * 1000,
+        "p95": percentile(latencies, .95),
+        "probe_p50": statistics.median(probe_latencies) * 1000,
+        "probe_p95": percentile(probe_latencies, .95),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--logins", type=int, default=10, help="logins made by each thread")
+    parser.add_argument("--processes", type=int, nargs="+", default=[0, 2, 4],
+                        help="PASSWORD_HASH_PROCESSES settings to compare")
+    parser.add_argument("--method", default=passwords.DEFAULT_METHOD, help="PASSWORD_HASH_METHOD")
+    parser.add_argument("--reset", action="store_true", help="allow wiping a database that has users")
+    args = parser.parse_args()
+
+    with app.app_context():
+        if Users.query.count() > 1 and not args.reset:
+            sys.exit(f"{db.engine.url.render_as_string(hide_password=True)} already has users, "
+                     "pass --reset to wipe it")
+        seed(players=args.threads, method=args.method)
+        db.session.remove()
+
+    # measure the hashing, not the rate limiter
+    app.config["RATE_LIMIT_ENABLED"] = False
+    app.config["PASSWORD_HASH_METHOD"] = args.method
+
+    print(f"\n{'processes':>10}{'logins':>8}{'logins/s':>10}{'p50 ms':>10}{'p95 ms':>10}"
+          f"{'probe p50':>11}{'probe p95':>11}")
+    for processes in args.processes:
+        result = bench(processes, args.threads, args.logins)
+        print(f"{processes:>10}{result['logins']:>8}{result['per_second']:>10.1f}{result['p50']:>10.1f}"
+              f"{result['p95']:>10.1f}{result['probe_p50']:>11.1f}{result['probe_p95']:>11.1f}")
+
+
+if __name__ == "__main__":
+    main()
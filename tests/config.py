@@ -0,0 +1,22 @@
+"""
+Configuration used by the test suite, selected through APPLICATION_SETTINGS
+"""
+import os
+import tempfile
+
+
+class TestConfig():
+    TESTING = True
+    SECRET_KEY = "test-secret-key"
+    SECURITY_PASSWORD_SALT = "test-salt"
+    WTF_CSRF_ENABLED = False
+    MAIL_SUPPRESS_SEND = True
+
+    # a fresh database file for every test session
+    SQLALCHEMY_DATABASE_URI = "sqlite:///" + os.path.join(tempfile.mkdtemp(prefix="kc7-tests-"), "test.db")
+    # a replica that is always in sync: the same file
+    SQLALCHEMY_BINDS = {"replica": SQLALCHEMY_DATABASE_URI}
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+
+    # measure the routes without the help of the cache
+    CACHE_TYPE = "NullCache"
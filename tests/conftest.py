@@ -0,0 +1,144 @@
+"""
+Shared fixtures: a database seeded with event-sized volumes and logged in clients
+
+The database is seeded once per test session with bulk inserts
+(2000 users in 200 teams, 100 challenges and 50000 solves).
+"""
+import os
+import random
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+import pytest
+
+os.environ.setdefault("APPLICATION_SETTINGS", "tests.config.TestConfig")
+
+from werkzeug.security import generate_password_hash
+from sqlalchemy import event
+
+from app import app as flask_app, db
+from app.server import scoring
+from app.server.scoring import MitigationScorer
+from app.server.models import Users, Team, Roles, UserRoles, Challenges, Solves, GameSession
+
+
+NUM_TEAMS = 200
+NUM_USERS = 2000
+NUM_CHALLENGES = 100
+NUM_SOLVES = 50000
+PASSWORD = "password"
+
+ADMIN_ID = 1
+PLAYER_ID = 2
+
+
+def seed_database(seed: int = 7) -> None:
+    rng = random.Random(seed)
+    # hashing is slow, every user shares the same password
+    pw_hash = generate_password_hash(PASSWORD)
+    now = datetime.now()
+
+    db.drop_all()
+    db.create_all()
+
+    db.session.bulk_insert_mappings(Roles, [{"id": 1, "name": "Admin"}])
+    db.session.bulk_insert_mappings(Team, [
+        {"id": 1, "name": "admins", "score": 0, "_mitigations": "", "security_awareness": .25}
+    ] + [
+        {"id": i, "name": f"team{i}", "score": 0, "_mitigations": "", "security_awareness": .25}
+        for i in range(2, NUM_TEAMS + 1)
+    ])
+    db.session.bulk_insert_mappings(Users, [
+        {"id": ADMIN_ID, "username": "admin", "email": "admin@logstream.com",
+         "pw_hash": pw_hash, "registered_on": now, "team_id": 1, "active": True}
+    ] + [
+        {"id": i, "username": f"user{i}", "email": f"user{i}@example.com",
+         "pw_hash": pw_hash, "registered_on": now, "team_id": 2 + i % (NUM_TEAMS - 1), "active": True}
+        for i in range(2, NUM_USERS + 1)
+    ])
+    db.session.bulk_insert_mappings(UserRoles, [{"user_id": ADMIN_ID, "role_id": 1}])
+    db.session.bulk_insert_mappings(Challenges, [
+        {"id": i, "name": f"challenge{i}", "category": f"category{i % 5}",
+         "description": f"description of challenge {i}", "answer": f"answer{i}",
+         "value": rng.choice([10, 20, 50, 100])}
+        for i in range(1, NUM_CHALLENGES + 1)
+    ])
+    # distinct (user, challenge) pairs, players only
+    pairs = rng.sample(range((NUM_USERS - 1) * NUM_CHALLENGES), NUM_SOLVES)
+    db.session.bulk_insert_mappings(Solves, [
+        {"user_id": 2 + pair // NUM_CHALLENGES, "challenge_id": 1 + pair % NUM_CHALLENGES,
+         "username": f"user{2 + pair // NUM_CHALLENGES}"}
+        for pair in pairs
+    ])
+    db.session.add(GameSession(state=False, start_time=now))
+    db.session.commit()
+
+
+@pytest.fixture(scope="session")
+def app():
+    # requests must push their own app context, flask_login keeps the user on g
+    with flask_app.app_context():
+        seed_database()
+        db.session.remove()
+    # run the before_first_request setup now so it isn't counted against the first route tested
+    with flask_app.test_request_context():
+        flask_app.try_trigger_before_first_request_functions()
+        db.session.remove()
+    # the game modules the malicious indicators come from aren't part of the tests
+    scoring.SCORER = MitigationScorer(source=set)
+    return flask_app
+
+
+def _client_for(app, user_id: int):
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session["_user_id"] = str(user_id)
+        session["_fresh"] = True
+    return client
+
+
+@pytest.fixture
+def player_client(app):
+    return _client_for(app, PLAYER_ID)
+
+
+@pytest.fixture
+def admin_client(app):
+    return _client_for(app, ADMIN_ID)
+
+
+@pytest.fixture
+def count_queries(app):
+    """
+    Context manager recording the SQL statements and wall time of the enclosed block
+        with count_queries() as stats:
+            client.get("/")
+        stats["queries"], stats["seconds"]
+    stats["engines"] holds the engine ("primary" or "replica") each statement ran on
+    """
+    @contextmanager
+    def counter():
+        stats = {"statements": [], "engines": [], "queries": 0, "seconds": 0.0}
+
+        def recorder(name):
+            def record(conn, cursor, statement, parameters, context, executemany):
+                stats["statements"].append(statement)
+                stats["engines"].append(name)
+            return record
+
+        with app.app_context():
+            engines = {"primary": db.engine, "replica": db.get_engine(app, bind="replica")}
+        listeners = {name: recorder(name) for name in engines}
+        for name, engine in engines.items():
+            event.listen(engine, "before_cursor_execute", listeners[name])
+        started = time.perf_counter()
+        try:
+            yield stats
+        finally:
+            stats["seconds"] = time.perf_counter() - started
+            for name, engine in engines.items():
+                event.remove(engine, "before_cursor_execute", listeners[name])
+            stats["queries"] = len(stats["statements"])
+
+    return counter
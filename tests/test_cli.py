@@ -0,0 +1,57 @@
+"""
+The flask build-dataset command
+"""
+from datetime import datetime
+
+import pytest
+
+from app import db
+from app.server.models import GameSession
+from app.server.utils import get_game_session
+from app.server.game_clock import GameScheduler
+
+
+@pytest.fixture
+def empty_game_session(app):
+    """
+    A database without a game session, as the cli finds it before the web app ever ran
+    """
+    with app.app_context():
+        GameSession.query.delete()
+        db.session.commit()
+    yield
+    with app.app_context():
+        get_game_session()
+
+
+def test_game_session_is_created_when_missing(app, empty_game_session):
+    with app.app_context():
+        current_session = get_game_session(seed=42)
+        assert current_session.id == 1
+        assert current_session.seed == 42
+        # the existing session is returned from then on
+        assert get_game_session(seed=7).seed == 42
+
+
+def test_build_dataset_on_an_empty_database(app, empty_game_session, tmp_path):
+    pytest.importorskip("app.server.modules", reason="the game generation modules are not in this tree")
+    result = app.test_cli_runner().invoke(args=["build-dataset", "--days", "1", "--seed", "42",
+                                                "--sink", "file", "--output", str(tmp_path)])
+    assert result.exit_code == 0, result.output
+    with app.app_context():
+        assert GameSession.query.get(1).seed == 42
+
+
+def test_offline_scheduler_ignores_the_session(app):
+    with app.app_context():
+        current_session = get_game_session()
+        current_session.state = False
+        db.session.commit()
+        scheduler = GameScheduler(current_session, {"*": 1}, tick_seconds=3.6, max_days=1, follow_session=False)
+        ticks = list(scheduler.ticks())
+        # 1 hour ticks from the seed date
+        assert len(ticks) == 24
+        assert scheduler.first_window() == (ticks[0].start, ticks[0].end)
+        assert ticks[0].start == datetime(2022, 1, 1)
+        # the live game stops with the session
+        assert list(GameScheduler(current_session, {"*": 1}, tick_seconds=3.6, max_days=1).ticks()) == []
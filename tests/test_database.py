@@ -0,0 +1,54 @@
+"""
+Database backend settings
+"""
+import pytest
+
+from app.server import database
+
+
+class FakeApp():
+    def __init__(self, **config):
+        self.config = config
+
+
+@pytest.fixture
+def pragmas():
+    # configure_database replaces the pragmas of the test database's connections
+    previous = dict(database.SQLITE_PRAGMAS)
+    yield database.SQLITE_PRAGMAS
+    database.SQLITE_PRAGMAS.clear()
+    database.SQLITE_PRAGMAS.update(previous)
+
+
+def test_sqlite_synchronous_is_full_by_default(pragmas, tmp_path):
+    database.configure_database(FakeApp(SQLALCHEMY_DATABASE_URI=f"sqlite:///{tmp_path / 'kc7.db'}"))
+    assert pragmas["journal_mode"] == "WAL"
+    assert pragmas["synchronous"] == "FULL"
+
+
+def test_sqlite_synchronous_normal_is_opt_in(pragmas, tmp_path):
+    uri = f"sqlite:///{tmp_path / 'kc7.db'}"
+    database.configure_database(FakeApp(SQLALCHEMY_DATABASE_URI=uri, SQLITE_SYNCHRONOUS="normal"))
+    assert pragmas["synchronous"] == "NORMAL"
+    with pytest.raises(ValueError):
+        database.configure_database(FakeApp(SQLALCHEMY_DATABASE_URI=uri, SQLITE_SYNCHRONOUS="OFF"))
+
+
+def test_batched_inserts_use_one_statement_per_table(app, count_queries):
+    from datetime import datetime
+    from app import db
+    from app.server.models import Report
+    from app.server.utils import batched_inserts
+
+    with app.app_context():
+        first_id = (db.session.query(db.func.max(Report.id)).scalar() or 0) + 1
+        with count_queries() as stats:
+            with batched_inserts(Report):
+                reports = [Report(f"subject {i}", "sender@evil.com", "employee@company.com",
+                                  datetime(2023, 1, 1), None) for i in range(100)]
+                db.session.add_all(reports)
+        inserts = [statement for statement in stats["statements"] if statement.startswith("INSERT")]
+        assert len(inserts) == 1
+        # ids follow the order the objects were added in
+        assert [report.id for report in reports] == list(range(first_id, first_id + 100))
+        db.session.rollback()
@@ -0,0 +1,49 @@
+"""
+Faker pools: draws only depend on the caller's generator
+"""
+import numpy as np
+
+from app.server.faker_pools import FakerPool
+
+
+PROVIDERS = {"domain": "domain_name", "ipv4": "ipv4_public"}
+
+
+def draw(pool: FakerPool, chunk_seed: int) -> list:
+    rng = np.random.default_rng(chunk_seed)
+    return [list(pool.sample_many("domain", 20, rng)) for _ in range(10)]
+
+
+def test_same_chunk_seed_same_values():
+    # two processes with the same game seed, one of which already served other chunks
+    fresh = FakerPool(size=200, seed=42, generations=4, providers=PROVIDERS)
+    busy = FakerPool(size=200, seed=42, generations=4, providers=PROVIDERS)
+    for chunk_seed in range(50):
+        draw(busy, chunk_seed)
+    assert draw(fresh, 7) == draw(busy, 7)
+
+
+def test_generations_are_distinct_pools():
+    pool = FakerPool(size=200, seed=42, generations=3, providers=PROVIDERS)
+    assert set(pool.get("domain", 0)) != set(pool.get("domain", 1))
+    # the first generation is the pool of a single generation pool with the same seed
+    single = FakerPool(size=200, seed=42, providers=PROVIDERS)
+    assert list(single.get("domain")) == list(pool.get("domain", 0))
+
+
+def test_pooled_faker_draws_from_the_pool(monkeypatch):
+    from faker import Faker
+    from app.server import faker_pools
+    from app.server.faker_pools import PooledFaker
+
+    monkeypatch.setattr(faker_pools, "POOL", FakerPool(size=50, seed=1, generations=2))
+    fake = PooledFaker(Faker())
+    Faker.seed(3)
+    first = [fake.domain_name() for _ in range(20)]
+    Faker.seed(3)
+    assert [fake.domain_name() for _ in range(20)] == first
+    pooled = set(faker_pools.POOL.get("domain", 0)) | set(faker_pools.POOL.get("domain", 1))
+    assert set(first) <= pooled
+    # calls with arguments and other providers still go to Faker
+    assert len(fake.sentence(nb_words=3).split()) >= 3
+    assert fake.name()
@@ -0,0 +1,23 @@
+"""
+Generation engine: one work unit per process, balanced on the actors' budgets
+"""
+from app.server.game_engine import split_actors
+
+
+def test_actors_are_balanced_over_the_processes():
+    # the Default actor generates most of the events
+    budgets = {1: 500, 2: 2, 3: 2, 4: 2, 5: 2, 6: 2}
+    groups = split_actors([1, 2, 3, 4, 5, 6], budgets, parts=2)
+    assert groups == [[1], [2, 3, 4, 5, 6]]
+
+    groups = split_actors([6, 5, 4, 3, 2, 1], {}, parts=4)
+    assert len(groups) == 4
+    assert sorted(actor_id for group in groups for actor_id in group) == [1, 2, 3, 4, 5, 6]
+    # groups keep the order the actors were given in
+    assert all(group == sorted(group, reverse=True) for group in groups)
+
+
+def test_no_more_units_than_actors():
+    assert split_actors([1, 2], {1: 10}, parts=8) == [[1], [2]]
+    assert split_actors([3], None, parts=1) == [[3]]
+    assert split_actors([], None, parts=4) == []
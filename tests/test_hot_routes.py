@@ -0,0 +1,142 @@
+"""
+Query count and wall time budgets for the routes hit hardest during an event
+
+Every budget is an upper bound for the database seeded in conftest.py. A route going over
+its query budget usually means a template started triggering a query per row (N+1).
+The time budgets are generous so they hold on slow CI machines.
+"""
+import pytest
+
+from app.server.models import Challenges, Solves, Users
+from tests.conftest import NUM_USERS, PLAYER_ID
+
+
+# route -> (max SQL statements, max seconds)
+BUDGETS = {
+    "/rankings": (5, 1.5),
+    "/challenges": (6, 1.0),
+    "/teams": (5, 0.5),
+    "/solve": (6, 0.5),
+    "/admin/users": (5, 1.0),
+    "/api/rankings": (6, 1.0),
+    "/admin/api/users": (7, 1.0),
+    "/api/rankings/around_me": (4, 0.5),
+}
+
+
+def assert_within_budget(route: str, stats: dict) -> None:
+    max_queries, max_seconds = BUDGETS[route]
+    assert stats["queries"] <= max_queries, (
+        f"{route} ran {stats['queries']} queries (budget {max_queries}):\n" + "\n".join(stats["statements"])
+    )
+    assert stats["seconds"] <= max_seconds, f"{route} took {stats['seconds']:.2f}s (budget {max_seconds}s)"
+
+
+@pytest.mark.parametrize("route", ["/rankings", "/challenges", "/teams"])
+def test_player_pages(player_client, count_queries, route):
+    with count_queries() as stats:
+        response = player_client.get(route)
+    assert response.status_code == 200
+    assert_within_budget(route, stats)
+
+
+def datatables_args(start=0, length=100, order_column=2, order_dir="desc", search=""):
+    return {"draw": 3, "start": start, "length": length, "search[value]": search,
+            "order[0][column]": order_column, "order[0][dir]": order_dir}
+
+
+def test_rankings_api(player_client, count_queries):
+    with count_queries() as stats:
+        response = player_client.get("/api/rankings", query_string=datatables_args())
+    assert_within_budget("/api/rankings", stats)
+
+    page = response.get_json()
+    assert page["draw"] == 3
+    # every player but the admin
+    assert page["recordsTotal"] == page["recordsFiltered"] == NUM_USERS - 1
+    assert len(page["data"]) == 100
+    scores = [row[2] for row in page["data"]]
+    assert scores == sorted(scores, reverse=True)
+    assert page["data"][0][0].startswith("1st")
+
+
+def test_rankings_api_pages_dont_overlap(player_client):
+    first = player_client.get("/api/rankings", query_string=datatables_args(start=0)).get_json()
+    second = player_client.get("/api/rankings", query_string=datatables_args(start=100)).get_json()
+    assert not {row[1] for row in first["data"]} & {row[1] for row in second["data"]}
+
+
+def test_rankings_api_search_keeps_places(player_client):
+    page = player_client.get("/api/rankings", query_string=datatables_args(search="user1999")).get_json()
+    assert page["recordsFiltered"] == 1
+    place, name, score = page["data"][0]
+    # the place is the position in the full rankings, not in the search results
+    position = int(place.split()[0][:-2])
+    ranked = player_client.get("/api/rankings", query_string=datatables_args(
+        start=position - 1, length=1, order_column=0, order_dir="asc")).get_json()
+    assert ranked["data"] == [[place, name, score]]
+
+
+def test_rankings_around_me(player_client, count_queries):
+    with count_queries() as stats:
+        response = player_client.get("/api/rankings/around_me", query_string={"k": 3})
+    assert_within_budget("/api/rankings/around_me", stats)
+
+    around = response.get_json()
+    assert around["user_id"] == PLAYER_ID
+    places = [player["place"] for player in around["players"]]
+    assert places == list(range(max(around["place"] - 3, 1), around["place"] + 4))
+    assert [player["me"] for player in around["players"]].count(True) == 1
+    ranks = [player["rank"] for player in around["players"]]
+    assert ranks == sorted(ranks)
+
+    # the same players as the full rankings at those places
+    ranked = player_client.get("/api/rankings", query_string=datatables_args(
+        start=places[0] - 1, length=len(places), order_column=0, order_dir="asc")).get_json()
+    assert [row[1] for row in ranked["data"]] == [player["name"] for player in around["players"]]
+
+
+def test_get_place_matches_rankings(app, player_client):
+    around = player_client.get("/api/rankings/around_me").get_json()
+    with app.app_context():
+        assert Users.query.get(PLAYER_ID).get_place(numeric=True) == around["place"]
+
+
+def test_admin_users_api(admin_client, count_queries):
+    with count_queries() as stats:
+        response = admin_client.get("/admin/api/users",
+                                    query_string=datatables_args(order_column=1, order_dir="asc", search="team1"))
+    assert_within_budget("/admin/api/users", stats)
+
+    page = response.get_json()
+    assert page["recordsTotal"] == NUM_USERS
+    assert 0 < page["recordsFiltered"] < NUM_USERS
+    assert all("team1" in team for _, _, team in page["data"])
+    usernames = [username for _, username, _ in page["data"]]
+    assert usernames == sorted(usernames)
+
+
+def test_admin_users_api_requires_admin(player_client):
+    assert player_client.get("/admin/api/users").status_code != 200
+
+
+def test_solve(app, player_client, count_queries):
+    with app.app_context():
+        challenge = Challenges.query.filter(~Challenges.id.in_(
+            Solves.query.with_entities(Solves.challenge_id).filter_by(user_id=PLAYER_ID))).first()
+        challenge_id, answer = challenge.id, challenge.answer
+
+    with count_queries() as stats:
+        response = player_client.post("/solve", data={"challenge_id": challenge_id, "answer": answer})
+    assert response.status_code == 302
+    assert_within_budget("/solve", stats)
+
+    with app.app_context():
+        assert Solves.query.filter_by(user_id=PLAYER_ID, challenge_id=challenge_id).count() == 1
+
+
+def test_admin_users(admin_client, count_queries):
+    with count_queries() as stats:
+        response = admin_client.get("/admin/users")
+    assert response.status_code == 200
+    assert_within_budget("/admin/users", stats)
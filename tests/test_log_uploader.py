@@ -0,0 +1,73 @@
+"""
+LogUploader: rows of the per-event generators are timed inside the game tick
+"""
+from datetime import datetime
+
+import numpy as np
+
+from app.server.log_sinks import NullSink
+from app.server.uploadLogs import LogUploader
+
+
+WINDOW = (datetime(2023, 1, 1), datetime(2023, 1, 2))
+
+
+def test_rows_are_moved_into_the_window_in_order():
+    uploader = LogUploader(queue_limit=3, sink=NullSink())
+    uploader.send_request_to_queue("ProcessEvents", {"event_time": "2023-01-01T10:00:00", "process_name": "before"})
+    with uploader.time_window(WINDOW, np.random.default_rng(1)):
+        # the module clock ran ahead of the tick
+        for i in range(5):
+            uploader.send_request_to_queue("ProcessEvents", {"event_time": f"2023-03-0{i + 1}T00:00:00", "process_name": str(i)})
+            uploader.send_request_to_queue("PassiveDns", {"timestamp": 1680000000.0 + i, "domain": str(i)})
+        # rows are held back until the block ends
+        assert uploader.get_queue_length() == 11
+
+    processes = uploader.queue.get("ProcessEvents")
+    assert processes is None or processes[0]["event_time"] == "2023-01-01T10:00:00"
+    assert uploader.row_counts == {"ProcessEvents": 6, "PassiveDns": 5}
+
+
+def test_retimed_rows_keep_their_order_and_format():
+    uploader = LogUploader(queue_limit=100, sink=NullSink())
+    with uploader.time_window(WINDOW, np.random.default_rng(2)):
+        for i in range(20):
+            uploader.send_request_to_queue("PassiveDns", {"timestamp": 1680000000.0 + i, "domain": str(i)})
+            uploader.send_request_to_queue("ProcessEvents", {"event_time": f"2023-03-01T00:00:{i:02d}", "process_name": str(i)})
+
+    times = [row["timestamp"] for row in uploader.queue["PassiveDns"]]
+    assert all(isinstance(t, float) for t in times)
+    assert times == sorted(times)
+    assert all(WINDOW[0].timestamp() - 86400 < t < WINDOW[1].timestamp() + 86400 for t in times)
+    processes = [row["event_time"] for row in uploader.queue["ProcessEvents"]]
+    assert processes == sorted(processes)
+    assert all("2023-01-01T00:00:00" <= t <= "2023-01-02T00:00:00" for t in processes)
+
+
+def test_rows_inside_the_window_are_left_alone():
+    uploader = LogUploader(queue_limit=100, sink=NullSink())
+    with uploader.time_window(WINDOW):
+        uploader.send_request_to_queue("ProcessEvents", {"event_time": "2023-01-01T12:34:56", "process_name": "on time"})
+    with uploader.time_window(None):
+        uploader.send_request_to_queue("ProcessEvents", {"event_time": "2030-01-01T00:00:00", "process_name": "no tick"})
+    assert [row["event_time"] for row in uploader.queue["ProcessEvents"]] == ["2023-01-01T12:34:56", "2030-01-01T00:00:00"]
+
+
+def test_collected_rows_are_still_shipped(app):
+    from app.server.models import Report
+
+    uploader = LogUploader(queue_limit=2, sink=NullSink())
+    with app.app_context():
+        before = Report.query.count()
+        with uploader.collect("Email") as emails:
+            for i in range(5):
+                uploader.send_request_to_queue("Email", {"timestamp": f"2023-01-01T00:00:0{i}", "subject": str(i),
+                                                         "sender": "a@evil.com", "recipient": "b@acme.com"})
+            uploader.send_request_to_queue("PassiveDns", {"timestamp": 1.0, "domain": "evil.com"})
+        uploader.send_request_to_queue("Email", {"timestamp": "2023-01-01T00:00:09", "subject": "after"})
+        uploader.flush_queue()
+        # the uploader only ships rows, the game loop creates the reports
+        assert Report.query.count() == before
+    assert [row["subject"] for row in emails] == ["0", "1", "2", "3", "4"]
+    assert uploader.row_counts["Email"] == 6
+    assert uploader.collecting == {}
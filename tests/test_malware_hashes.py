@@ -0,0 +1,46 @@
+"""
+Malware hashes: every hash belongs to exactly one family
+"""
+import pytest
+
+from app.server import malware_hashes
+from app.server.malware_hashes import build_hash_index, index_malware_hashes, get_malware_family_for_hash
+
+
+HASHES = [f"{i:064x}" for i in range(10)]
+
+
+class Malware():
+    def __init__(self, name: str):
+        self.name = name
+        self.hashes = []
+
+
+@pytest.fixture(autouse=True)
+def restore_index():
+    previous = malware_hashes.FILE_HASH_MALWARE_MAPPING
+    yield
+    malware_hashes.FILE_HASH_MALWARE_MAPPING = previous
+
+
+def test_hashes_are_dealt_round_robin():
+    families = index_malware_hashes([Malware("emotet"), Malware("qakbot"), Malware("ryuk")], HASHES)
+    assert [len(family.hashes) for family in families] == [4, 3, 3]
+    for family in families:
+        assert all(get_malware_family_for_hash(hash) == family.name for hash in family.hashes)
+    assert get_malware_family_for_hash("unknown") is None
+    # the hash list is left alone, a second game gets the same index
+    assert HASHES == [f"{i:064x}" for i in range(10)]
+    again = index_malware_hashes([Malware("emotet"), Malware("qakbot"), Malware("ryuk")], HASHES)
+    assert [family.hashes for family in again] == [family.hashes for family in families]
+
+
+def test_duplicate_families_are_rejected():
+    with pytest.raises(ValueError, match="emotet"):
+        index_malware_hashes([Malware("emotet"), Malware("ryuk"), Malware("emotet")], HASHES)
+    with pytest.raises(ValueError):
+        build_hash_index(("a", "a"), tuple(HASHES))
+
+
+def test_no_families_no_hashes():
+    assert dict(build_hash_index((), tuple(HASHES))) == {}
@@ -0,0 +1,59 @@
+"""
+Metrics: the game process exports its metrics, the web process serves them
+"""
+import pytest
+
+from app.server.metrics import Metrics, merge_snapshots, read_export
+from tests.conftest import ADMIN_ID, _client_for
+
+
+def game_metrics() -> Metrics:
+    metrics = Metrics()
+    metrics.increment("generator_rows", 500, generator="email")
+    metrics.observe("generator_seconds", 0.5, generator="email")
+    metrics.set_gauge("uploader_queue_rows", 12)
+    return metrics
+
+
+def test_prometheus_text():
+    assert game_metrics().to_prometheus().splitlines() == [
+        "# TYPE kc7_generator_rows counter",
+        'kc7_generator_rows{generator="email"} 500',
+        "# TYPE kc7_uploader_queue_rows gauge",
+        "kc7_uploader_queue_rows 12",
+        "# TYPE kc7_generator_seconds summary",
+        'kc7_generator_seconds_count{generator="email"} 1',
+        'kc7_generator_seconds_sum{generator="email"} 0.5',
+    ]
+
+
+def test_export_round_trip(tmp_path):
+    path = str(tmp_path / "metrics" / "game.json")
+    assert read_export(path) is None
+    game_metrics().export(path)
+    snapshot = read_export(path)
+    assert snapshot["counters"] == [{"name": "generator_rows", "labels": {"generator": "email"}, "value": 500}]
+    # only the finished file is left behind
+    assert [p.name for p in (tmp_path / "metrics").iterdir()] == ["game.json"]
+
+    merged = merge_snapshots({"web": Metrics().snapshot(), "game": snapshot, "worker": None})
+    assert merged["counters"] == [{"name": "generator_rows", "labels": {"generator": "email", "process": "game"},
+                                   "value": 500}]
+    assert [gauge["name"] for gauge in merged["gauges"]] == ["snapshot_age_seconds", "uploader_queue_rows"]
+
+
+@pytest.fixture
+def exported_game_metrics(app, tmp_path):
+    path = str(tmp_path / "game_metrics.json")
+    app.config["METRICS_EXPORT_PATH"] = path
+    game_metrics().export(path)
+    yield
+    app.config.pop("METRICS_EXPORT_PATH")
+
+
+def test_admin_metrics_include_the_game_process(app, exported_game_metrics):
+    client = _client_for(app, ADMIN_ID)
+    counters = client.get("/admin/metrics").get_json()["counters"]
+    assert {"name": "generator_rows", "labels": {"generator": "email", "process": "game"}, "value": 500} in counters
+    text = client.get("/admin/metrics?format=prometheus").get_data(as_text=True)
+    assert 'kc7_generator_rows{generator="email",process="game"} 500' in text
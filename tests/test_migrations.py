@@ -0,0 +1,69 @@
+"""
+Startup migrations of databases created by older releases
+"""
+from datetime import datetime
+
+from sqlalchemy import create_engine, inspect, select, text
+
+from app.server.models import Report
+from app.server.utils import add_missing_columns, migrate_report_times
+
+
+def test_game_session_seed_is_added(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'baseline.db'}")
+    with engine.begin() as connection:
+        # game_session as created by the baseline release
+        connection.execute(text("CREATE TABLE game_session (id INTEGER NOT NULL, state BOOLEAN, "
+                                "start_time VARCHAR(50), seed_date VARCHAR(50), time_multiplier INTEGER, "
+                                "PRIMARY KEY (id))"))
+        connection.execute(text("INSERT INTO game_session (id, state, start_time, seed_date, time_multiplier) "
+                                "VALUES (1, 0, '2022-01-01 00:00:00', '2022-01-01', 1000)"))
+
+    assert add_missing_columns(engine) == ["game_session.seed"]
+    # running it again changes nothing
+    assert add_missing_columns(engine) == []
+
+    assert "seed" in {column["name"] for column in inspect(engine).get_columns("game_session")}
+    with engine.connect() as connection:
+        seed = connection.execute(text("SELECT seed FROM game_session WHERE id = 1")).scalar()
+    assert seed is not None
+
+
+def test_legacy_report_times_are_converted(tmp_path, capsys):
+    engine = create_engine(f"sqlite:///{tmp_path / 'baseline.db'}")
+    legacy_times = ["2023-01-01T00:00:05", "2023-01-01 00:00:04", "01/01/2023 00:00:12",
+                    "2023-01-01T00:00:30+00:00", "not a date", "2023-01-01 10:00:00", "1672531260.5"]
+    with engine.begin() as connection:
+        # report as created by the baseline release
+        connection.execute(text("CREATE TABLE report (id INTEGER NOT NULL, subject VARCHAR(50) NOT NULL, "
+                                "sender VARCHAR(50) NOT NULL, recipient VARCHAR(50) NOT NULL, "
+                                "time VARCHAR(50) NOT NULL, team_id INTEGER, PRIMARY KEY (id))"))
+        connection.execute(text("INSERT INTO report (id, subject, sender, recipient, time, team_id) "
+                                "VALUES (:id, 'subject', 'sender', 'recipient', :time, 2)"),
+                           [{"id": i + 1, "time": time} for i, time in enumerate(legacy_times)])
+
+    assert migrate_report_times(engine) == 6
+    # the report that can't be read is kept and listed
+    assert "Report 5: can't read the time 'not a date'" in capsys.readouterr().out
+    with engine.connect() as connection:
+        assert connection.execute(text("SELECT time FROM report WHERE id = 5")).scalar() == "not a date"
+    # running it again changes nothing
+    assert migrate_report_times(engine) == 0
+
+    # read back as DateTime values, newest first like the reports page
+    with engine.begin() as connection:
+        connection.execute(text("DELETE FROM report WHERE id = 5"))
+    table = Report.__table__
+    with engine.connect() as connection:
+        rows = connection.execute(select(table.c.id, table.c.time).order_by(table.c.time.desc())).fetchall()
+    assert [row.id for row in rows] == [6, 7, 4, 3, 1, 2]
+    assert rows[0].time == datetime(2023, 1, 1, 10, 0, 0)
+    assert rows[1].time == datetime(2023, 1, 1, 0, 1, 0, 500000)
+    assert rows[3].time == datetime(2023, 1, 1, 0, 0, 12)
+
+
+def test_report_times_are_migrated_on_demand(app):
+    # the app's own report table is already a DateTime, there is nothing to convert
+    result = app.test_cli_runner().invoke(args=["migrate-report-times"])
+    assert result.exit_code == 0, result.output
+    assert "Converted 0 reports" in result.output
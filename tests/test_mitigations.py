@@ -0,0 +1,83 @@
+"""
+Team deny lists stored in team_mitigations
+"""
+import json
+
+from app import db
+from app.server.models import Team, TeamMitigation, Users
+from app.server.utils import migrate_legacy_mitigations
+from tests.conftest import _client_for
+
+
+USER_ID = 150
+
+
+def team_of(app, user_id: int) -> int:
+    with app.app_context():
+        return Users.query.get(user_id).team_id
+
+
+def test_diff_updates(app, count_queries):
+    client = _client_for(app, USER_ID)
+    indicators = [f"bad{i}.example.com" for i in range(2000)]
+    response = client.post("/api/mitigations", json={"add": indicators + ["  BAD0.example.com "]})
+    assert response.status_code == 200
+    assert response.get_json()["added"] == indicators
+
+    # only the change is written, whatever the size of the list
+    with count_queries() as stats:
+        response = client.post("/api/mitigations", json={"add": ["10.0.0.1", "bad1.example.com"],
+                                                         "remove": ["bad0.example.com", "unknown.example.com"]})
+    assert response.get_json() == {"success": True, "added": ["10.0.0.1"], "removed": ["bad0.example.com"],
+                                   "score": 0}
+    inserts = [statement for statement in stats["statements"] if statement.startswith("INSERT")]
+    assert len(inserts) == 1
+
+    listed = client.get("/api/mitigations").get_json()
+    assert listed["team_id"] == team_of(app, USER_ID)
+    assert listed["indicators"] == indicators[1:] + ["10.0.0.1"]
+
+
+def test_rejects_bad_input(app):
+    client = _client_for(app, USER_ID)
+    assert client.post("/api/mitigations", json={"add": "evil.com"}).status_code == 400
+    assert client.post("/api/mitigations", json={"add": ["x" * 300]}).status_code == 400
+
+
+def test_legacy_endpoints(app):
+    client = _client_for(app, USER_ID + 1)
+    response = client.post("/updateDenyList", data={"dlist": "a.com\nb.com\n\nc.com"})
+    assert response.get_json() == {"success": True, "added": 3, "removed": 0, "score": 0}
+    response = client.post("/updateDenyList", data={"dlist": "c.com\nd.com"})
+    assert response.get_json() == {"success": True, "added": 1, "removed": 2, "score": 0}
+    assert json.loads(client.get("/getDenyList").get_json()) == ["c.com", "d.com"]
+
+
+def test_batched_lookup(app, admin_client):
+    first, second = team_of(app, USER_ID + 2), team_of(app, USER_ID + 3)
+    _client_for(app, USER_ID + 2).post("/api/mitigations", json={"add": ["shared.example.net", "one.example.net"]})
+    _client_for(app, USER_ID + 3).post("/api/mitigations", json={"add": ["shared.example.net"]})
+
+    response = admin_client.post("/admin/api/mitigations", json={
+        "team_ids": [first, second], "indicators": ["Shared.example.net", "nobody.example.net"]})
+    result = response.get_json()
+    assert result["teams"] == {str(first): ["shared.example.net", "one.example.net"],
+                               str(second): ["shared.example.net"]}
+    assert result["indicators"] == {"shared.example.net": sorted([first, second]), "nobody.example.net": []}
+
+
+def test_legacy_blob_is_migrated(app):
+    with app.app_context():
+        team = Team(name="legacy", score=0, _mitigations=json.dumps(["Evil.com", "1.2.3.4", "evil.com"]))
+        db.session.add(team)
+        db.session.commit()
+        team_id = team.id
+
+        assert migrate_legacy_mitigations() == 1
+        assert migrate_legacy_mitigations() == 0
+        assert Team.query.get(team_id).get_deny_list() == ["evil.com", "1.2.3.4"]
+        assert Team.query.get(team_id)._mitigations == ""
+
+        TeamMitigation.query.filter_by(team_id=team_id).delete()
+        db.session.delete(Team.query.get(team_id))
+        db.session.commit()
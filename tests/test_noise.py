@@ -0,0 +1,64 @@
+"""
+Vectorized noise: the tables and columns the per-event generators write
+"""
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from app.server import faker_pools
+from app.server.faker_pools import FakerPool
+from app.server.noise import synthesize_outbound_browsing, synthesize_inbound_browsing, synthesize_auth_events, \
+    company_domains, TABLE_COLUMNS
+from app.server.registries import Registry
+from app.server.uploadLogs import LogUploader
+from app.server.log_sinks import NullSink
+
+
+WINDOW = (datetime(2023, 1, 1), datetime(2023, 1, 2))
+EMPLOYEES = Registry("Employee", ["id", "username", "ip_addr", "user_agent", "hostname", "company_domain"], [
+    (i, f"user{i}", f"10.0.0.{i}", "Mozilla/5.0", f"HOST-{i}", "acme.com") for i in range(1, 11)
+])
+
+
+@pytest.fixture(autouse=True)
+def small_pools():
+    previous = faker_pools.POOL
+    faker_pools.POOL = FakerPool(size=100, seed=1)
+    yield
+    faker_pools.POOL = previous
+
+
+def test_tables_and_columns_are_pinned():
+    # ADX maps CSV columns by position, changing these breaks ingestion
+    assert TABLE_COLUMNS == {
+        "OutboundBrowsing": ["timestamp", "method", "src_ip", "user_agent", "url"],
+        "InboundBrowsing": ["timestamp", "method", "src_ip", "user_agent", "url"],
+        "AuthenticationEvents": ["timestamp", "hostname", "src_ip", "user_agent", "username", "result", "description"],
+    }
+    rng = np.random.default_rng(1)
+    assert list(synthesize_outbound_browsing(EMPLOYEES, 5, WINDOW, rng).columns) == TABLE_COLUMNS["OutboundBrowsing"]
+    assert list(synthesize_inbound_browsing(5, WINDOW, rng).columns) == TABLE_COLUMNS["InboundBrowsing"]
+    assert list(synthesize_auth_events(EMPLOYEES, 5, WINDOW, rng).columns) == TABLE_COLUMNS["AuthenticationEvents"]
+
+
+def test_browsing_goes_to_the_given_domains():
+    rng = np.random.default_rng(2)
+    outbound = synthesize_outbound_browsing(EMPLOYEES, 50, WINDOW, rng, domains=["default-actor.com"])
+    assert outbound["url"].str.startswith("https://default-actor.com/").all()
+    assert company_domains(EMPLOYEES) == ["acme.com"]
+    inbound = synthesize_inbound_browsing(50, WINDOW, rng, domains=company_domains(EMPLOYEES))
+    assert inbound["url"].str.startswith("https://acme.com/").all()
+    assert inbound["timestamp"].between("2023-01-01", "2023-01-02").all()
+
+
+def test_batches_follow_the_columns_of_per_event_rows():
+    uploader = LogUploader(sink=NullSink())
+    uploader.send_request_to_queue("InboundBrowsing", {"timestamp": "2023-01-01T00:00:00", "method": "GET",
+                                                       "src_ip": "1.2.3.4", "user_agent": "curl", "url": "https://a"})
+    reordered = pd.DataFrame({"url": ["https://b"], "user_agent": ["curl"], "src_ip": ["5.6.7.8"],
+                              "method": ["POST"], "timestamp": ["2023-01-01T00:00:01"]})
+    assert list(uploader.align_columns("InboundBrowsing", reordered).columns) == TABLE_COLUMNS["InboundBrowsing"]
+    with pytest.raises(ValueError):
+        uploader.align_columns("InboundBrowsing", reordered.rename(columns={"src_ip": "ip"}))
@@ -0,0 +1,66 @@
+"""
+Password hashing on the process pool and rehash on login
+"""
+import pytest
+from werkzeug.security import check_password_hash, generate_password_hash
+
+from app import db
+from app.server.models import Users
+from app.server.passwords import HashingPool, HashingBusy, needs_rehash, normalize_method
+from tests.conftest import PASSWORD, PLAYER_ID
+
+
+def test_pool_hashes_and_verifies():
+    pool = HashingPool(processes=1)
+    try:
+        pw_hash = pool.run(generate_password_hash, "secret", "pbkdf2:sha256:1000")
+        assert pw_hash.startswith("pbkdf2:sha256:1000$")
+        assert pool.run(check_password_hash, pw_hash, "secret")
+        assert not pool.run(check_password_hash, pw_hash, "wrong")
+    finally:
+        pool.shutdown()
+
+
+def test_pool_rejects_callers_over_the_cap():
+    pool = HashingPool(processes=1, max_concurrent=1, timeout=0.05)
+    # the only slot is taken
+    pool._slots.acquire()
+    try:
+        with pytest.raises(HashingBusy):
+            pool.run(generate_password_hash, "secret")
+    finally:
+        pool._slots.release()
+        pool.shutdown()
+
+
+def test_needs_rehash():
+    pw_hash = generate_password_hash("secret", "pbkdf2:sha256:1000")
+    assert not needs_rehash(pw_hash, "pbkdf2:sha256:1000")
+    assert needs_rehash(pw_hash, "pbkdf2:sha256:2000")
+    assert needs_rehash(pw_hash, "pbkdf2:sha256")
+    assert normalize_method("pbkdf2:sha256") == normalize_method("pbkdf2:sha256:260000")
+    assert not needs_rehash(generate_password_hash("secret"), "pbkdf2:sha256")
+
+
+def test_login_rehashes_with_the_configured_method(app):
+    user_id = PLAYER_ID + 50
+    with app.app_context():
+        user = Users.query.get(user_id)
+        user.pw_hash = generate_password_hash(PASSWORD, "pbkdf2:sha256:1000")
+        db.session.commit()
+
+    previous = app.config.get("PASSWORD_HASH_METHOD")
+    app.config["PASSWORD_HASH_METHOD"] = "pbkdf2:sha256:2000"
+    try:
+        client = app.test_client()
+        response = client.post("/login", data={"username": f"user{user_id}", "password": PASSWORD})
+        assert response.status_code == 302
+        with client.session_transaction() as session:
+            assert session.get("_user_id") == str(user_id)
+    finally:
+        app.config["PASSWORD_HASH_METHOD"] = previous
+
+    with app.app_context():
+        user = Users.query.get(user_id)
+        assert user.pw_hash.startswith("pbkdf2:sha256:2000$")
+        assert user.check_password(PASSWORD)
@@ -0,0 +1,125 @@
+"""
+Token bucket rate limiting
+"""
+import pytest
+
+from app.server import rate_limit
+from app.server.rate_limit import MemoryStore, parse_limit
+from tests.conftest import PLAYER_ID, _client_for
+
+
+class Clock():
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_parse_limit():
+    assert parse_limit("30/minute") == (0.5, 30)
+    assert parse_limit("5/second") == (5, 5)
+
+
+def test_bucket_empties_and_refills():
+    clock = Clock()
+    store = MemoryStore(clock=clock)
+    assert [store.take("a", rate=1, burst=3) for _ in range(3)] == [0, 0, 0]
+    assert store.take("a", rate=1, burst=3) == pytest.approx(1)
+    # other clients have their own bucket
+    assert store.take("b", rate=1, burst=3) == 0
+    clock.now += 1
+    assert store.take("a", rate=1, burst=3) == 0
+
+
+def test_sweep_and_cap_bound_memory():
+    clock = Clock()
+    store = MemoryStore(sweep_interval=10, max_buckets=5, clock=clock)
+    for i in range(8):
+        store.take(f"client{i}", rate=1, burst=2)
+    assert len(store) == 5
+    # every bucket is full again by the next sweep
+    clock.now += 11
+    store.take("late", rate=1, burst=2)
+    assert len(store) == 1
+
+
+@pytest.fixture
+def strict_limits(app):
+    previous = app.config.get("RATE_LIMITS")
+    app.config["RATE_LIMITS"] = {"solve": "2/minute", "login": "2/minute"}
+    rate_limit.STORE = None
+    yield
+    app.config["RATE_LIMITS"] = previous
+    rate_limit.STORE = None
+
+
+def test_solve_is_limited_before_touching_the_database(app, strict_limits, count_queries):
+    client = _client_for(app, PLAYER_ID + 60)
+    for _ in range(2):
+        assert client.post("/solve", data={"challenge_id": 1, "answer": "wrong"}).status_code == 302
+    with count_queries() as stats:
+        response = client.post("/solve", data={"challenge_id": 1, "answer": "wrong"})
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) > 0
+    assert stats["queries"] == 0
+
+
+def test_login_is_limited_per_ip_and_username(app, strict_limits):
+    client = app.test_client()
+    assert client.get("/login").status_code == 200
+    for _ in range(2):
+        client.post("/login", data={"username": "user2", "password": "wrong"})
+    assert client.post("/login", data={"username": "User2", "password": "wrong"}).status_code == 429
+    # the login form itself isn't limited
+    assert client.get("/login").status_code == 200
+    # another player behind the same address can still log in
+    assert client.post("/login", data={"username": "user3", "password": "wrong"}).status_code != 429
+
+
+@pytest.fixture
+def behind_proxy(app):
+    wsgi_app = app.wsgi_app
+    app.config["PROXY_FIX_X_FOR"] = 1
+    rate_limit.trust_proxies(app)
+    yield
+    app.wsgi_app = wsgi_app
+    app.config.pop("PROXY_FIX_X_FOR")
+
+
+def test_client_ip_is_read_from_a_trusted_proxy(app, strict_limits, behind_proxy):
+    client = app.test_client()
+    login = {"username": "user4", "password": "wrong"}
+    for _ in range(2):
+        client.post("/login", data=login, headers={"X-Forwarded-For": "203.0.113.1"})
+    assert client.post("/login", data=login, headers={"X-Forwarded-For": "203.0.113.1"}).status_code == 429
+    assert client.post("/login", data=login, headers={"X-Forwarded-For": "203.0.113.2"}).status_code != 429
+
+
+@pytest.fixture
+def spraying_limits(app):
+    previous = app.config.get("RATE_LIMITS")
+    app.config["RATE_LIMITS"] = {"login": "2/minute", "login_ip": "3/minute", "login_user": "4/minute"}
+    rate_limit.STORE = None
+    yield
+    app.config["RATE_LIMITS"] = previous
+    rate_limit.STORE = None
+
+
+def test_one_ip_cannot_spray_many_usernames(app, spraying_limits):
+    client = app.test_client()
+    ip = {"REMOTE_ADDR": "198.51.100.1"}
+    for username in ("user5", "user6", "user7"):
+        assert client.post("/login", data={"username": username, "password": "wrong"}, environ_base=ip).status_code != 429
+    assert client.post("/login", data={"username": "user8", "password": "wrong"}, environ_base=ip).status_code == 429
+    # other addresses have their own bucket
+    assert client.post("/login", data={"username": "user8", "password": "wrong"},
+                       environ_base={"REMOTE_ADDR": "198.51.100.2"}).status_code != 429
+
+
+def test_many_ips_cannot_guess_one_username(app, spraying_limits):
+    client = app.test_client()
+    login = {"username": "user9", "password": "wrong"}
+    for i in range(4):
+        assert client.post("/login", data=login, environ_base={"REMOTE_ADDR": f"198.51.100.{10 + i}"}).status_code != 429
+    assert client.post("/login", data=login, environ_base={"REMOTE_ADDR": "198.51.100.20"}).status_code == 429
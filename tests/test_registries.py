@@ -0,0 +1,47 @@
+"""
+Registries: generators get column snapshots, everything else still comes from the model
+"""
+import random
+
+import pytest
+
+from app.server.models import Team, Users
+from app.server.registries import Registry
+from tests.conftest import PLAYER_ID
+
+
+def test_records_fall_back_to_the_model(app):
+    with app.app_context():
+        team = Team.query.get(2)
+        team.add_to_deny_list(["registry-test.com"])
+        teams = Registry.from_model(Team)
+        record = teams.get(2)
+        # columns come from the snapshot
+        assert record.name == team.name
+        assert "_mitigations" not in teams.fields
+        # methods, private columns and relationships from the ORM object
+        assert "registry-test.com" in record.get_deny_list()
+        assert record._mitigations == team._mitigations
+        team.remove_from_deny_list(["registry-test.com"])
+
+        users = Registry.from_model(Users)
+        assert users.get(PLAYER_ID).team.id == Users.query.get(PLAYER_ID).team_id
+        with pytest.raises(AttributeError):
+            users.get(PLAYER_ID).no_such_attribute
+
+
+def team_names(registry, rng) -> "list[str]":
+    # what a generator does with the employees it is handed
+    return [f"{member.name}:{len(member.get_deny_list())}" for member in (rng.choice(registry) for _ in range(5))]
+
+
+def test_generators_accept_a_registry(app):
+    with app.app_context():
+        teams = Team.query.order_by(Team.id).all()
+        assert team_names(Registry.from_model(Team), random.Random(1)) == team_names(teams, random.Random(1))
+
+
+def test_plain_registries_only_have_columns():
+    registry = Registry("Employee", ["id", "username"], [(1, "alice")])
+    with pytest.raises(AttributeError):
+        registry.get(1).ip_addr
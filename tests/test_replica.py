@@ -0,0 +1,47 @@
+"""
+Routing of reads to the replica bind (configured in tests/config.py)
+"""
+from tests.conftest import PLAYER_ID
+
+
+def test_read_only_views_read_from_the_replica(player_client, count_queries):
+    with count_queries() as stats:
+        player_client.get("/api/rankings", query_string={"length": 10})
+    # loading the logged in user happens before the view, on the primary
+    assert "replica" in stats["engines"]
+    assert stats["engines"][-1] == "replica"
+
+
+def test_writes_go_to_the_primary(app, player_client, count_queries):
+    from app.server.models import Challenges, Solves
+
+    with app.app_context():
+        challenge = Challenges.query.filter(~Challenges.id.in_(
+            Solves.query.with_entities(Solves.challenge_id).filter_by(user_id=PLAYER_ID))).first()
+        challenge_id, answer = challenge.id, challenge.answer
+
+    with count_queries() as stats:
+        player_client.post("/solve", data={"challenge_id": challenge_id, "answer": answer})
+    assert set(stats["engines"]) == {"primary"}
+    assert any(statement.startswith("INSERT INTO solves") for statement in stats["statements"])
+
+
+def test_writer_reads_own_writes_from_the_primary(app, count_queries):
+    from tests.conftest import _client_for
+    from app.server.models import Challenges, Solves
+
+    client = _client_for(app, PLAYER_ID + 1)
+    with app.app_context():
+        challenge = Challenges.query.filter(~Challenges.id.in_(
+            Solves.query.with_entities(Solves.challenge_id).filter_by(user_id=PLAYER_ID + 1))).first()
+        challenge_id, answer = challenge.id, challenge.answer
+
+    client.post("/solve", data={"challenge_id": challenge_id, "answer": answer})
+    with count_queries() as stats:
+        client.get("/challenges")
+    assert set(stats["engines"]) == {"primary"}
+
+    # other players still read from the replica
+    with count_queries() as stats:
+        _client_for(app, PLAYER_ID + 2).get("/challenges")
+    assert "replica" in stats["engines"]
@@ -0,0 +1,123 @@
+"""
+Employee reports: batched creation and the keyset paginated /reports page
+"""
+import re
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+from app import db
+from app.server.models import Report, Team, Users
+from app.server import reports
+from app.server.reports import draw_reports, write_reports, create_reports
+from tests.conftest import _client_for
+
+
+USER_ID = 190
+NUM_REPORTS = 5000
+
+
+def emails(n: int) -> pd.DataFrame:
+    return pd.DataFrame({
+        "timestamp": [f"2022-01-01T00:{i // 60 % 60:02d}:{i % 60:02d}" for i in range(n)],
+        "sender": [f"sender{i}@evil.com" for i in range(n)],
+        "recipient": [f"employee{i}@company.com" for i in range(n)],
+        "subject": [f"subject {i} " + "x" * 60 for i in range(n)],
+        "link": ["http://evil.com"] * n,
+    })
+
+
+def test_draw_reports_follows_security_awareness():
+    rows = draw_reports(emails(100), [(2, 1.0), (3, 0.0), (4, 0.5)], np.random.default_rng(1))
+    by_team = {team_id: [row for row in rows if row["team_id"] == team_id] for team_id in (2, 3, 4)}
+    assert len(by_team[2]) == 100
+    assert len(by_team[3]) == 0
+    assert 25 < len(by_team[4]) < 75
+    assert by_team[2][5]["time"] == datetime(2022, 1, 1, 0, 0, 5)
+    assert by_team[2][5]["sender"] == "sender5@evil.com"
+    assert len(by_team[2][5]["subject"]) == 50
+
+
+def test_create_reports_for_every_team(app):
+    with app.app_context():
+        before = Report.query.count()
+        created = create_reports(emails(20), rng=np.random.default_rng(2))
+        assert created > 0
+        assert Report.query.count() == before + created
+        # the admin team doesn't get reports
+        assert Report.query.filter_by(team_id=1).count() == 0
+
+
+def seed_reports(app, team_id: int) -> None:
+    started = datetime(2023, 1, 1)
+    with app.app_context():
+        # pairs of reports share a timestamp, the id breaks the tie
+        write_reports([{"team_id": team_id, "time": started + timedelta(seconds=i // 2), "subject": f"report {i}",
+                        "sender": "sender@evil.com", "recipient": "employee@company.com"}
+                       for i in range(NUM_REPORTS)])
+
+
+def test_reports_are_keyset_paginated(app, count_queries):
+    with app.app_context():
+        team_id = Users.query.get(USER_ID).team_id
+        Report.query.filter_by(team_id=team_id).delete()
+        db.session.commit()
+    seed_reports(app, team_id)
+    client = _client_for(app, USER_ID)
+
+    seen = []
+    url = "/reports?per_page=200"
+    pages = 0
+    while url:
+        with count_queries() as stats:
+            response = client.get(url)
+        assert response.status_code == 200
+        assert stats["queries"] <= 4, "\n".join(stats["statements"])
+        assert stats["seconds"] < 0.5
+        html = response.get_data(as_text=True)
+        seen.extend(int(subject) for subject in re.findall(r"<td>report (\d+)</td>", html))
+        match = re.search(r'href="(/reports\?before=[^"]+)">Older', html)
+        url = match.group(1).replace("&amp;", "&") if match else None
+        pages += 1
+
+    assert pages == NUM_REPORTS // 200
+    # newest first, every report exactly once
+    assert seen == list(range(NUM_REPORTS - 1, -1, -1))
+
+
+def test_bad_cursor(app):
+    client = _client_for(app, USER_ID)
+    assert client.get("/reports?before=yesterday").status_code == 400
+
+
+def test_reports_can_only_be_deleted_by_their_team(app):
+    with app.app_context():
+        team_id = Users.query.get(USER_ID).team_id
+        report_id = Report.query.filter_by(team_id=team_id).first().id
+
+    _client_for(app, USER_ID + 1).post("/delreport", data={"report_id": report_id})
+    with app.app_context():
+        assert Report.query.get(report_id) is not None
+
+    _client_for(app, USER_ID).post("/delreport", data={"report_id": report_id})
+    with app.app_context():
+        assert Report.query.get(report_id) is None
+
+
+def test_offline_builds_create_no_reports(app, monkeypatch):
+    monkeypatch.setattr(reports, "CREATE_REPORTS", False)
+    with app.app_context():
+        before = Report.query.count()
+        assert create_reports(emails(20), rng=np.random.default_rng(3)) == 0
+        # reports the email generator adds to the session are dropped too
+        db.session.add(Report("subject", "sender@evil.com", "employee@company.com", datetime(2023, 1, 1), Team.query.get(2)))
+        db.session.commit()
+        assert Report.query.count() == before
+
+
+def test_reports_take_the_time_of_email_rows():
+    made = reports.ORM_REPORTS
+    report = Report("subject", "sender@evil.com", "employee@company.com", "2023-01-01T00:00:05", None)
+    assert report.time == datetime(2023, 1, 1, 0, 0, 5)
+    assert reports.ORM_REPORTS == made + 1
@@ -0,0 +1,165 @@
+"""
+Mitigation scoring of deny lists against the malicious indicators
+"""
+import random
+import time
+
+import pytest
+
+from app import db
+from app.server import scoring
+from app.server.models import Team, Users
+from app.server.scoring import DomainTrie, MitigationScorer, domain_suffixes, indicator_kind
+from tests.conftest import _client_for
+
+
+SHA256 = "a" * 64
+
+
+def test_indicator_kind():
+    assert indicator_kind("10.1.2.3") == "ip"
+    assert indicator_kind("2001:db8::1") == "ip"
+    assert indicator_kind(SHA256) == "hash"
+    assert indicator_kind("d41d8cd98f00b204e9800998ecf8427e") == "hash"
+    assert indicator_kind("evil.com") == "domain"
+    assert indicator_kind("cafe.com") == "domain"
+
+
+def test_domain_trie_counts_subdomains():
+    trie = DomainTrie()
+    for domain in ["evil.com", "mail.evil.com", "a.b.evil.com", "good.org"]:
+        assert trie.add(domain)
+    assert not trie.add("evil.com")
+    assert trie.covered("evil.com") == 3
+    assert trie.covered("b.evil.com") == 1
+    assert trie.covered("com") == 3
+    assert trie.covered("notevil.com") == 0
+
+    assert trie.remove("a.b.evil.com")
+    assert not trie.remove("a.b.evil.com")
+    assert trie.covered("evil.com") == 2
+    assert "b" not in trie.root[2]["com"][2]["evil"][2]
+    assert len(trie) == 3
+
+
+def test_deny_list_covers_each_indicator_once():
+    scorer = MitigationScorer(points=10)
+    scorer.load(["evil.com", "Mail.Evil.com", "10.0.0.1", SHA256, "other.net"])
+    assert scorer.covered(["evil.com", "mail.evil.com"]) == 2
+    assert scorer.covered(["mail.evil.com", "10.0.0.1", "10.0.0.2", SHA256]) == 3
+    assert scorer.score([]) == 0
+
+
+def test_blocking_a_public_suffix_scores_nothing():
+    scorer = MitigationScorer(points=10)
+    scorer.load(["evil.com", "mail.evil.com", "other.net", "bad.co.uk", "phish.github.io"])
+    assert scorer.score(["com", "net", ".com.", "co.uk", "uk", "github.io"]) == 0
+    assert scorer.score(["bad.co.uk", "phish.github.io"]) == 20
+    assert domain_suffixes("mail.evil.co.uk") == ["mail.evil.co.uk", "evil.co.uk"]
+
+
+def test_full_rescore_is_fast():
+    rng = random.Random(3)
+    indicators = [f"host{i}.bad{i % 500}.com" for i in range(6000)]
+    indicators += [f"10.{i // 256 % 256}.{i % 256}.1" for i in range(3000)]
+    indicators += [f"{rng.getrandbits(256):064x}" for _ in range(1000)]
+    scorer = MitigationScorer()
+    scorer.load(indicators)
+
+    deny_lists = {}
+    for team_id in range(100):
+        deny_list = rng.sample(indicators, 200)
+        deny_list += [f"bad{rng.randrange(1000)}.com" for _ in range(20)]
+        deny_lists[team_id] = deny_list
+
+    started = time.perf_counter()
+    scores = scorer.score_teams(deny_lists)
+    seconds = time.perf_counter() - started
+    assert len(scores) == 100
+    assert all(score >= 200 * scorer.points for score in scores.values())
+    # milliseconds in practice, generous for slow CI machines
+    assert seconds < 0.5
+
+
+@pytest.fixture
+def scorer(app):
+    active = set()
+    previous = scoring.SCORER
+    scoring.SCORER = MitigationScorer(points=100, source=lambda: set(active), max_age=0)
+    yield scoring.SCORER, active
+    scoring.SCORER = previous
+
+
+def team_score(app, team_id: int) -> int:
+    with app.app_context():
+        return Team.query.get(team_id).score
+
+
+def test_scores_follow_deny_lists_and_indicators(app, scorer):
+    scorer, active = scorer
+    active.update(["evil.com", "10.6.6.6"])
+    user_id = 170
+    with app.app_context():
+        team_id = Users.query.get(user_id).team_id
+    client = _client_for(app, user_id)
+
+    # the team side: the team's own score is recomputed
+    response = client.post("/api/mitigations", json={"add": ["evil.com", "10.6.6.6", "fine.org"]})
+    assert response.get_json()["score"] == 200
+    assert team_score(app, team_id) == 200
+
+    # the indicator side: teams blocking a new indicator or one of its parents gain its points
+    with app.app_context():
+        scorer.sync_indicators()
+        active.update(["c2.evil.com", "fine.org", "unblocked.net"])
+        changes = scorer.sync_indicators()
+        db.session.commit()
+    assert changes[team_id] == 200
+    assert team_score(app, team_id) == 400
+
+    active.discard("10.6.6.6")
+    with app.app_context():
+        changes = scorer.sync_indicators()
+        db.session.commit()
+    assert changes[team_id] == -100
+    assert team_score(app, team_id) == 300
+
+    # a full rescore agrees with the incremental updates
+    with app.app_context():
+        scores = scorer.rescore_all()
+        db.session.commit()
+    assert scores[team_id] == 300
+
+
+def test_team_rescore_reads_current_indicators(app):
+    active = {"evil.com"}
+    previous = scoring.SCORER
+    # cached indicators never expire on their own
+    scoring.SCORER = scorer = MitigationScorer(points=100, source=lambda: set(active), max_age=3600)
+    user_id = 171
+    with app.app_context():
+        team_id = Users.query.get(user_id).team_id
+    client = _client_for(app, user_id)
+    try:
+        with app.app_context():
+            scorer.sync_indicators()
+            db.session.commit()
+        active.add("10.7.7.7")
+        response = client.post("/api/mitigations", json={"add": ["evil.com", "10.7.7.7"]})
+        assert response.get_json()["score"] == 200
+
+        # the game loop's next sync sees the indicator as new, but the rewritten score already counts it
+        with app.app_context():
+            assert team_id not in scorer.sync_indicators()
+            db.session.commit()
+        assert team_score(app, team_id) == 200
+
+        # once synced, the team's score moves with the indicators again
+        active.add("c2.evil.com")
+        with app.app_context():
+            assert scorer.sync_indicators()[team_id] == 100
+            db.session.commit()
+            assert scorer.rescore_all()[team_id] == 300
+        assert team_score(app, team_id) == 300
+    finally:
+        scoring.SCORER = previous
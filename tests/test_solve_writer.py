@@ -0,0 +1,81 @@
+"""
+Group commit of solves
+"""
+import threading
+from concurrent.futures import TimeoutError
+
+import pytest
+
+from app.server import solve_writer
+from app.server.models import Challenges, Solves
+from app.server.solve_writer import SolveWriter
+from tests.conftest import PLAYER_ID, NUM_CHALLENGES, _client_for
+
+
+def unsolved_challenges(user_id: int) -> list:
+    solved = {challenge_id for challenge_id, in
+              Solves.query.with_entities(Solves.challenge_id).filter_by(user_id=user_id)}
+    return [challenge_id for challenge_id in range(1, NUM_CHALLENGES + 1) if challenge_id not in solved]
+
+
+def test_concurrent_solves_are_batched(app):
+    users = range(PLAYER_ID + 10, PLAYER_ID + 40)
+    with app.app_context():
+        todo = {user_id: unsolved_challenges(user_id)[:5] for user_id in users}
+        before = Solves.query.count()
+
+    writer = SolveWriter(app, max_batch=50, max_wait=0.02).start()
+    try:
+        def submit_all(user_id):
+            for challenge_id in todo[user_id]:
+                writer.submit(challenge_id, user_id, f"user{user_id}")
+
+        threads = [threading.Thread(target=submit_all, args=(user_id,)) for user_id in users]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        writer.stop()
+
+    submitted = sum(len(challenges) for challenges in todo.values())
+    assert writer.solves == submitted
+    assert writer.batches < submitted
+    with app.app_context():
+        assert Solves.query.count() - before == submitted
+
+
+def test_solve_view_uses_the_writer(app):
+    user_id = PLAYER_ID + 50
+    with app.app_context():
+        challenge = Challenges.query.get(unsolved_challenges(user_id)[0])
+        challenge_id, answer = challenge.id, challenge.answer
+
+    solve_writer.SOLVE_WRITER = SolveWriter(app).start()
+    try:
+        response = _client_for(app, user_id).post("/solve", data={"challenge_id": challenge_id, "answer": answer})
+        assert solve_writer.SOLVE_WRITER.solves == 1
+    finally:
+        solve_writer.SOLVE_WRITER.stop()
+        solve_writer.SOLVE_WRITER = None
+
+    assert response.status_code == 302
+    with app.app_context():
+        assert Solves.query.filter_by(user_id=user_id, challenge_id=challenge_id).count() == 1
+
+
+def test_timed_out_solve_is_not_stored(app):
+    user_id = PLAYER_ID + 60
+    with app.app_context():
+        challenge_id = unsolved_challenges(user_id)[0]
+
+    # nothing commits until the writer starts
+    writer = SolveWriter(app, timeout=0.05)
+    with pytest.raises(TimeoutError):
+        writer.submit(challenge_id, user_id, f"user{user_id}")
+    writer.start()
+    writer.stop()
+
+    assert writer.solves == 0
+    with app.app_context():
+        assert Solves.query.filter_by(user_id=user_id, challenge_id=challenge_id).count() == 0